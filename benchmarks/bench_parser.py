@@ -0,0 +1,165 @@
+"""
+dhcpdump text parser micro-benchmark.
+
+Parses a recorded dhcpdump capture (benchmarks/data/dhcpdump_capture.txt by
+default, 200 packets rendered from synthetic handshakes in dhcpdump's format)
+with the original if/elif parse_entry and with the current prefix-dispatch
+parser, and reports packets/sec and the size of each packet representation.
+
+    python benchmarks/bench_parser.py [--capture FILE] [--repeat 50] [--output results.json]
+"""
+import argparse
+import json
+import os
+import sys
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from notouch import dhcpdump
+
+DEFAULT_CAPTURE = os.path.join(os.path.dirname(os.path.abspath(__file__)), "data",
+    "dhcpdump_capture.txt")
+
+
+def legacy_parse_entry(entry):
+    """
+    The parser before the prefix-dispatch rework, kept as the baseline.
+    """
+    packet = {
+        "ts": "",
+        "ip_src": "",
+        "mac_src": "",
+        "ip_dst": "",
+        "mac_dst": "",
+        "op": -1,
+        "opname": "",
+        "htype": -1,
+        "hlen" : -1,
+        "hops": -1,
+        "xid": "",
+        "secs": "",
+        "flags": -1,
+        "ciaddr": "",
+        "yiaddr": "",
+        "siaddr": "",
+        "giaddr": "",
+        "chaddr": "",
+        "sname": "",
+        "file": "",
+        "options": [],
+    }
+    for line in entry:
+        if line.startswith("TIME:"):
+            packet["ts"] = line.split(":", 1)[-1].strip()
+        elif line.startswith("IP:"):
+            line = line.split(":", 1)[-1].strip()
+            src, dst = line.split(">")
+            packet["ip_src"] = src.split("(")[0].strip()
+            packet["ip_dst"] = dst.split("(")[0].strip()
+            packet["mac_src"] = src.split("(")[1].strip(' )')
+            packet["mac_dst"] = dst.split("(")[1].strip(')')
+        elif line.startswith("OP:"):
+            packet["op"] = int(line.split(":")[1].split("(")[0].strip())
+        elif line.startswith("HTYPE:"):
+            packet["htype"] = int(line.split(":")[1].split("(")[0].strip())
+        elif line.startswith("HLEN:"):
+            packet["hlen"] = int(line.split(":")[-1].strip())
+        elif line.startswith("HOPS:"):
+            packet["hops"] = int(line.split(":")[-1].strip())
+        elif line.startswith("SECS:"):
+            packet["secs"] = int(line.split(":")[-1].strip())
+        elif line.startswith("FLAGS:"):
+            packet["flags"] = line.split(":")[-1].strip()
+        elif line.startswith("XID:"):
+            packet["xid"] = line.split(":")[-1].strip()
+        elif line.startswith("CIADDR:"):
+            packet["ciaddr"] = line.split(":", 1)[-1].strip()
+        elif line.startswith("YIADDR:"):
+            packet["yiaddr"] = line.split(":", 1)[-1].strip()
+        elif line.startswith("SIADDR:"):
+            packet["siaddr"] = line.split(":", 1)[-1].strip()
+        elif line.startswith("GIADDR:"):
+            packet["giaddr"] = line.split(":", 1)[-1].strip()
+        elif line.startswith("SNAME:"):
+            packet["sname"] = line.split(":", 1)[-1].strip()
+        elif line.startswith("FNAME:"):
+            packet["fname"] = line.split(":", 1)[-1].strip()
+        elif line.startswith("CHADDR:"):
+            packet["chaddr"] = line.split(":", 1)[-1].strip()[0:17]
+        elif line.startswith("OPTION:"):
+            line = line.split(":", 1)[-1].strip()
+            op = int(line.split("(", 1)[0].strip())
+            if op in [55, 57, 93, 94, 97]:
+                continue
+            rest = line.split(")", 1)[-1].strip()
+            name = rest.split("  ")[0].strip()
+            data = rest.split("  ")[-1].strip()
+            if data.endswith(")"):
+                data = data.split("(")[-1].strip(" )").lower()
+            key = name.lower().replace(" ", "_")
+            packet["options"].append({
+                "name": key,
+                "data": data,
+                "op": op,
+            })
+            if op == 53:
+                packet["opname"] = data
+    return packet
+
+
+def dict_size(packet):
+    size = sys.getsizeof(packet) + sys.getsizeof(packet["options"])
+    return size + sum(sys.getsizeof(option) for option in packet["options"])
+
+
+def record_size(packet):
+    size = sys.getsizeof(packet) + sys.getsizeof(packet.options)
+    return size + sum(sys.getsizeof(option) for option in packet.options)
+
+
+def measure(parse, lines, repeat):
+    best = float("inf")
+    for _ in range(repeat):
+        start = time.time()
+        packets = [parse(entry) for entry in dhcpdump.split_entries(lines)]
+        best = min(best, time.time() - start)
+    return packets, len(packets) / best
+
+
+def main():
+    parser = argparse.ArgumentParser(description="dhcpdump text parser benchmark")
+    parser.add_argument("--capture", type=str, default=DEFAULT_CAPTURE,
+        help="Recorded dhcpdump output to parse.")
+    parser.add_argument("--repeat", type=int, default=50, help="Timing repetitions (best of).")
+    parser.add_argument("--output", type=str, help="Write results as JSON to this file.")
+    args = parser.parse_args()
+
+    with open(args.capture) as capture:
+        lines = capture.readlines()
+
+    legacy_packets, legacy_rate = measure(legacy_parse_entry, lines, args.repeat)
+    packets, rate = measure(dhcpdump.parse_entry, lines, args.repeat)
+
+    results = {
+        "benchmark": "parser",
+        "packets": len(packets),
+        "before_packets_per_sec": legacy_rate,
+        "after_packets_per_sec": rate,
+        "before_bytes_per_packet": sum(map(dict_size, legacy_packets)) / len(legacy_packets),
+        "after_bytes_per_packet": sum(map(record_size, packets)) / len(packets),
+    }
+    print "packets parsed:  %d" % results["packets"]
+    print "before:          %.0f packets/sec, %d bytes/packet" % (
+        results["before_packets_per_sec"], results["before_bytes_per_packet"])
+    print "after:           %.0f packets/sec, %d bytes/packet" % (
+        results["after_packets_per_sec"], results["after_bytes_per_packet"])
+
+    if args.output:
+        with open(args.output, "w") as output:
+            json.dump(results, output, indent=4)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,78 @@
+"""
+Payload size and server decode cost of agent upload encodings.
+
+Encodes batches of synthetic acks the way scripts/dhcpdump_parser.py does for
+each --format/--nocompress combination, and measures the bytes on the wire
+and the CPU time notouch.codec spends decoding them, both per 1000 acks. The
+columnar format (scripts/dhcp_wire.py) is compared against the plain JSON array.
+
+    python benchmarks/bench_payload.py [--batch 1000] [--output results.json]
+"""
+import argparse
+import json
+import os
+import sys
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+sys.path.insert(0, os.path.join(ROOT, "scripts"))
+
+import dhcpdump_parser
+from notouch import codec
+from synthetic import Network
+
+
+def measure(acks, body_format, compress, repeat):
+    body, headers = dhcpdump_parser.encode(acks, body_format, compress)
+    encode_time = decode_time = float("inf")
+    for _ in range(repeat):
+        start = time.time()
+        dhcpdump_parser.encode(acks, body_format, compress)
+        encode_time = min(encode_time, time.time() - start)
+
+        start = time.time()
+        codec.decode_documents(body, headers["Content-Type"], headers.get("Content-Encoding"))
+        decode_time = min(decode_time, time.time() - start)
+
+    per_1k = 1000.0 / len(acks)
+    return {
+        "format": body_format,
+        "compress": compress,
+        "bytes_per_1k_acks": int(len(body) * per_1k),
+        "encode_ms_per_1k_acks": encode_time * per_1k * 1000,
+        "decode_ms_per_1k_acks": decode_time * per_1k * 1000,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Agent upload payload benchmark")
+    parser.add_argument("--batch", type=int, default=1000, help="Acks per batch.")
+    parser.add_argument("--repeat", type=int, default=20, help="Timing repetitions (best of).")
+    parser.add_argument("--output", type=str, help="Write results as JSON to this file.")
+    args = parser.parse_args()
+
+    acks = Network().acks(args.batch)
+    formats = ["json", "columnar"]
+    if codec.msgpack is not None:
+        formats.append("msgpack")
+
+    results = []
+    for body_format in formats:
+        for compress in (False, True):
+            results.append(measure(acks, body_format, compress, args.repeat))
+
+    print "%-8s %-6s %14s %12s %12s" % ("format", "gzip", "bytes/1k", "encode ms", "decode ms")
+    for result in results:
+        print "%-8s %-6s %14d %12.2f %12.2f" % (result["format"], result["compress"],
+            result["bytes_per_1k_acks"], result["encode_ms_per_1k_acks"],
+            result["decode_ms_per_1k_acks"])
+
+    if args.output:
+        with open(args.output, "w") as output:
+            json.dump({"benchmark": "payload", "batch": args.batch, "results": results},
+                output, indent=4)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,76 @@
+"""
+Packet decode rate of the native pcap decoder versus dhcpdump text parsing.
+
+Writes synthetic DHCP handshakes to a pcap capture and to the equivalent
+dhcpdump text, then measures packets/sec for scripts/dhcp_pcap.py decoding the
+capture and for notouch.dhcpdump.parse_entry parsing the text (excluding the
+cost of running dhcpdump itself, which the pcap path avoids entirely).
+
+    python benchmarks/bench_pcap.py [--handshakes 5000] [--pcap out.pcap] [--output results.json]
+"""
+import argparse
+import json
+import os
+import StringIO
+import sys
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+sys.path.insert(0, os.path.join(ROOT, "scripts"))
+
+import dhcp_pcap
+import synthetic
+from notouch import dhcpdump
+
+
+def rate(count, seconds):
+    return count / seconds if seconds else float("inf")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Native pcap decoder benchmark")
+    parser.add_argument("--handshakes", type=int, default=5000,
+        help="DISCOVER/OFFER/REQUEST/ACK handshakes to generate.")
+    parser.add_argument("--pcap", type=str, help="Also save the generated capture here.")
+    parser.add_argument("--output", type=str, help="Write results as JSON to this file.")
+    args = parser.parse_args()
+
+    packets = [packet for handshake in synthetic.Network().handshakes(args.handshakes)
+        for packet in handshake]
+    capture = StringIO.StringIO()
+    synthetic.write_pcap(capture, packets)
+    capture = capture.getvalue()
+    if args.pcap:
+        with open(args.pcap, "wb") as pcap:
+            pcap.write(capture)
+    entries = [[line.strip() for line in synthetic.to_dhcpdump(packet)[:-1]]
+        for packet in packets]
+
+    start = time.time()
+    decoded = sum(1 for _ in dhcp_pcap.packets(dhcp_pcap.read_pcap(StringIO.StringIO(capture))))
+    pcap_seconds = time.time() - start
+
+    start = time.time()
+    for entry in entries:
+        dhcpdump.parse_entry(entry)
+    text_seconds = time.time() - start
+
+    results = {
+        "benchmark": "pcap",
+        "packets": len(packets),
+        "pcap_decoded": decoded,
+        "pcap_packets_per_sec": rate(decoded, pcap_seconds),
+        "dhcpdump_text_packets_per_sec": rate(len(entries), text_seconds),
+    }
+    print "packets:               %d" % results["packets"]
+    print "pcap decode:           %.0f packets/sec" % results["pcap_packets_per_sec"]
+    print "dhcpdump text parse:   %.0f packets/sec" % results["dhcpdump_text_packets_per_sec"]
+
+    if args.output:
+        with open(args.output, "w") as output:
+            json.dump(results, output, indent=4)
+
+
+if __name__ == "__main__":
+    main()
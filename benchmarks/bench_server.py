@@ -0,0 +1,224 @@
+"""
+Throughput and latency of the notouch server's ingest and query endpoints.
+
+Runs the real server (notouch.server, with its forked workers, connection
+pools, write path and caches) against a scratch rethinkdb database, once per
+--workers count, and drives it with --concurrency concurrent async clients.
+Each scenario sends --requests requests and reports requests/sec, documents/sec
+for ingest, and p50/p99/p999 latency. Traffic comes from benchmarks/synthetic.py:
+acks from full DISCOVER/OFFER/REQUEST/ACK handshakes across many clients, relays
+and servers, posted at each of --batch_sizes, server stats snapshots, and the
+range, host and rollup queries a dashboard makes.
+
+Requires a running rethinkdb server. The database given by --rethinkdb_db is
+emptied before each run.
+
+    python benchmarks/bench_server.py [--workers 1,4] [--batch_sizes 1,100,1000]
+        [--requests 500] [--concurrency 16] [--output results.json]
+"""
+import argparse
+import json
+import os
+import random
+import shutil
+import signal
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+import tornado.gen
+import tornado.httpclient
+import tornado.ioloop
+
+from notouch.util import clean_database, create_database
+from synthetic import Network
+
+START_TIMEOUT = 30
+
+
+def percentile(latencies, fraction):
+    """
+    Nearest-rank percentile of a sorted list.
+    """
+    if not latencies:
+        return None
+    return latencies[min(len(latencies) - 1, int(fraction * len(latencies)))]
+
+
+def free_port():
+    sock = socket.socket()
+    sock.bind(("localhost", 0))
+    port = sock.getsockname()[1]
+    sock.close()
+    return port
+
+
+def start_server(args, workers, port, metrics_dir):
+    """
+    Start notouch.server in its own process group, so that stop_server reaches
+        the forked workers too, and wait until it serves requests.
+    """
+    command = [sys.executable, "-c", "from notouch.server import main; main()",
+        "--port", str(port), "--workers", str(workers),
+        "--rethinkdb_host", args.rethinkdb_host,
+        "--rethinkdb_port", str(args.rethinkdb_port),
+        "--rethinkdb_db", args.rethinkdb_db,
+        "--metrics_dir", metrics_dir] + args.server_args
+    with open(os.devnull, "w") as devnull:
+        proc = subprocess.Popen(command, cwd=ROOT, stdout=devnull, preexec_fn=os.setsid)
+
+    deadline = time.time() + START_TIMEOUT
+    client = tornado.httpclient.HTTPClient()
+    while True:
+        try:
+            client.fetch("http://localhost:%d/" % port)
+            return proc
+        except Exception:
+            if proc.poll() is not None or time.time() > deadline:
+                stop_server(proc)
+                raise RuntimeError("notouch server failed to start.")
+            time.sleep(0.2)
+
+
+def stop_server(proc):
+    try:
+        os.killpg(proc.pid, signal.SIGTERM)
+    except OSError:
+        pass
+    proc.wait()
+
+
+@tornado.gen.coroutine
+def run_scenario(base_url, requests, concurrency):
+    """
+    Send (method, path, body) requests with at most concurrency in flight and
+        return (sorted latencies, errors, elapsed seconds).
+    """
+    client = tornado.httpclient.AsyncHTTPClient(max_clients=concurrency)
+    pending = iter(requests)
+    latencies = []
+    errors = [0]
+
+    @tornado.gen.coroutine
+    def worker():
+        for method, path, body in pending:
+            headers = {"Content-Type": "application/json"} if body is not None else {}
+            start = time.time()
+            try:
+                yield client.fetch(base_url + path, method=method, body=body,
+                    headers=headers, request_timeout=60)
+            except tornado.httpclient.HTTPError:
+                errors[0] += 1
+            else:
+                latencies.append(time.time() - start)
+
+    start = time.time()
+    yield [worker() for _ in range(concurrency)]
+    raise tornado.gen.Return((sorted(latencies), errors[0], time.time() - start))
+
+
+def scenarios(network, args):
+    """
+    Yield (name, batch size, requests) for each scenario, ingest first so the
+        queries run against a populated database.
+    """
+    acks = network.acks(max(args.batch_sizes) * 4)
+    chaddrs = sorted(set(ack["chaddr"] for ack in acks))
+    for batch_size in args.batch_sizes:
+        bodies = [json.dumps(acks[i:i + batch_size])
+            for i in range(0, len(acks) - batch_size + 1, batch_size)]
+        yield "ack_ingest", batch_size, [("POST", "/api/v1/dhcp/ack", bodies[i % len(bodies)])
+            for i in range(args.requests)]
+
+    snapshots = network.server_stats(min(args.requests, 50), handshakes=50)
+    yield "stats_ingest", 1, [("POST", "/api/v1/dhcp/server_stats",
+        json.dumps([snapshots[i % len(snapshots)]])) for i in range(args.requests)]
+
+    rand = random.Random(1)
+    yield "ack_query_recent", None, [("GET", "/api/v1/dhcp/ack?order=desc&limit=100", None)
+        for _ in range(args.requests)]
+    yield "ack_query_chaddr", None, [("GET", "/api/v1/dhcp/ack?chaddr=%s" %
+        rand.choice(chaddrs), None) for _ in range(args.requests)]
+    yield "ack_query_giaddr", None, [("GET", "/api/v1/dhcp/ack?giaddr=%s&order=desc" %
+        rand.choice(network.relays), None) for _ in range(args.requests)]
+    yield "host_lookup", None, [("GET", "/api/v1/hosts/%s" % rand.choice(chaddrs), None)
+        for _ in range(args.requests)]
+    yield "stats_rollup_query", None, [("GET",
+        "/api/v1/dhcp/server_stats/rollup?resolution=minute&server_ip=%s" %
+        rand.choice(network.servers), None) for _ in range(args.requests)]
+
+
+def main():
+    parser = argparse.ArgumentParser(description="notouch server load benchmark")
+    parser.add_argument("--workers", type=str, default="1,4",
+        help="Comma separated server worker counts to benchmark.")
+    parser.add_argument("--batch_sizes", type=str, default="1,100,1000",
+        help="Comma separated acks per ingest request.")
+    parser.add_argument("--requests", type=int, default=500, help="Requests per scenario.")
+    parser.add_argument("--concurrency", type=int, default=16,
+        help="Concurrent client requests.")
+    parser.add_argument("--clients", type=int, default=50000, help="Distinct client MACs.")
+    parser.add_argument("--relays", type=int, default=500, help="Distinct relays.")
+    parser.add_argument("--servers", type=int, default=8, help="Distinct DHCP servers.")
+    parser.add_argument("--rethinkdb_host", type=str, default="localhost")
+    parser.add_argument("--rethinkdb_port", type=int, default=28015)
+    parser.add_argument("--rethinkdb_db", type=str, default="notouch_bench",
+        help="Scratch database, emptied before each run.")
+    parser.add_argument("--output", type=str, help="Write results as JSON to this file.")
+    parser.add_argument("server_args", nargs=argparse.REMAINDER,
+        help="Extra notouch server arguments, after --.")
+    args = parser.parse_args()
+    args.batch_sizes = [int(size) for size in args.batch_sizes.split(",")]
+    args.server_args = [arg for arg in args.server_args if arg != "--"]
+
+    conn = create_database(args.rethinkdb_host, args.rethinkdb_port, args.rethinkdb_db)
+    io_loop = tornado.ioloop.IOLoop.current()
+    results = []
+    print "%-8s %-20s %6s %10s %12s %9s %9s %9s %7s" % ("workers", "scenario", "batch",
+        "req/s", "docs/s", "p50 ms", "p99 ms", "p999 ms", "errors")
+    for workers in [int(count) for count in args.workers.split(",")]:
+        clean_database(conn, args.rethinkdb_db, testing=True)
+        port = free_port()
+        metrics_dir = tempfile.mkdtemp(prefix="notouch-bench-metrics-")
+        proc = start_server(args, workers, port, metrics_dir)
+        try:
+            network = Network(args.clients, args.relays, args.servers)
+            for name, batch_size, requests in scenarios(network, args):
+                latencies, errors, elapsed = io_loop.run_sync(lambda: run_scenario(
+                    "http://localhost:%d" % port, requests, args.concurrency))
+                result = {
+                    "workers": workers,
+                    "scenario": name,
+                    "batch_size": batch_size,
+                    "requests": len(requests),
+                    "errors": errors,
+                    "seconds": elapsed,
+                    "requests_per_sec": len(latencies) / elapsed,
+                    "docs_per_sec": len(latencies) * batch_size / elapsed if batch_size else None,
+                    "p50_ms": percentile(latencies, 0.5) * 1000 if latencies else None,
+                    "p99_ms": percentile(latencies, 0.99) * 1000 if latencies else None,
+                    "p999_ms": percentile(latencies, 0.999) * 1000 if latencies else None,
+                }
+                results.append(result)
+                print "%-8d %-20s %6s %10.0f %12s %9.2f %9.2f %9.2f %7d" % (workers, name,
+                    batch_size or "-", result["requests_per_sec"],
+                    "%.0f" % result["docs_per_sec"] if batch_size else "-",
+                    result["p50_ms"] or 0, result["p99_ms"] or 0, result["p999_ms"] or 0,
+                    errors)
+        finally:
+            stop_server(proc)
+            shutil.rmtree(metrics_dir, ignore_errors=True)
+
+    if args.output:
+        with open(args.output, "w") as output:
+            json.dump({"benchmark": "server", "concurrency": args.concurrency,
+                "results": results}, output, indent=4)
+
+
+if __name__ == "__main__":
+    main()
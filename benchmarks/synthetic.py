@@ -0,0 +1,250 @@
+"""
+Synthetic DHCP traffic for benchmarks.
+
+Packets use the same schema as scripts/dhcpdump_parser.py produces, with a
+configurable number of distinct clients, relays and DHCP servers so that
+indexes and compression see realistic cardinalities.
+"""
+import calendar
+import datetime
+import random
+import socket
+import struct
+
+OPNAMES = ["dhcpdiscover", "dhcpoffer", "dhcprequest", "dhcpack"]
+MESSAGE_TYPES = {"dhcpdiscover": 1, "dhcpoffer": 2, "dhcprequest": 3, "dhcpack": 5}
+IP_OPTIONS = frozenset([1, 3, 6, 28, 42, 54])
+DURATION_OPTIONS = frozenset([51, 58, 59])
+DURATION_UNITS = {"d": 86400, "h": 3600, "m": 60, "s": 1}
+
+# Multi-line option dhcpdump prints for client requests.
+PARAMETER_REQUEST_LIST = [
+    "OPTION:  57 (  2) Maximum DHCP message size 1152",
+    "OPTION:  55 (  6) Parameter Request List      1 (Subnet mask)",
+    "                         66 (TFTP server name)",
+    "                          6 (DNS server)",
+    "                         15 (Domainname)",
+    "                          3 (Routers)",
+    "                         67 (Bootfile name)",
+]
+
+
+class Network(object):
+    """
+    A fixed population of clients, relays and servers to draw traffic from.
+    """
+    def __init__(self, clients=5000, relays=50, servers=4, seed=0):
+        self.random = random.Random(seed)
+        self.clients = [self.mac() for _ in range(clients)]
+        self.relays = ["10.%d.%d.1" % (i // 256, i % 256) for i in range(relays)]
+        self.servers = ["10.255.0.%d" % (i + 1) for i in range(servers)]
+        self.start = datetime.datetime(2015, 1, 1)
+
+    def mac(self):
+        return ":".join("%02x" % self.random.randint(0, 255) for _ in range(6))
+
+    def packet(self, opname, chaddr, giaddr, server, xid, ts):
+        """
+        Build one packet. Server replies (offer/ack) carry the full option set.
+        """
+        reply = opname in ("dhcpoffer", "dhcpack")
+        yiaddr = "0.0.0.0"
+        if reply:
+            yiaddr = "%s.%d" % (giaddr.rsplit(".", 1)[0], self.random.randint(2, 254))
+        options = [{"name": "dhcp_message_type", "data": opname, "op": 53}]
+        if reply:
+            subnet = giaddr.rsplit(".", 1)[0]
+            host = "host-%s" % chaddr.replace(":", "")
+            options.extend([
+                {"name": "server_identifier", "data": server, "op": 54},
+                {"name": "ip_address_leasetime", "data": "7d", "op": 51},
+                {"name": "subnet_mask", "data": "255.255.255.0", "op": 1},
+                {"name": "routers", "data": giaddr, "op": 3},
+                {"name": "dns_server", "data": "10.255.1.1", "op": 6},
+                {"name": "host_name", "data": host, "op": 12},
+                {"name": "domainname", "data": "example.com", "op": 15},
+                {"name": "broadcast_address", "data": subnet + ".255", "op": 28},
+                {"name": "ntp_servers", "data": "10.255.1.2", "op": 42},
+                {"name": "t1", "data": "3d12h", "op": 58},
+                {"name": "t2", "data": "6d3h", "op": 59},
+            ])
+        return {
+            "ts": ts.strftime("%Y-%m-%d %H:%M:%S.%f"),
+            "ip_src": server if reply else giaddr,
+            "mac_src": self.mac(),
+            "ip_dst": giaddr if reply else server,
+            "mac_dst": self.mac(),
+            "op": 2 if reply else 1,
+            "opname": opname,
+            "htype": 1,
+            "hlen": 6,
+            "hops": 1,
+            "xid": xid,
+            "secs": 0,
+            "flags": "0000",
+            "ciaddr": "0.0.0.0",
+            "yiaddr": yiaddr,
+            "siaddr": server if reply else "0.0.0.0",
+            "giaddr": giaddr,
+            "chaddr": chaddr,
+            "sname": ".",
+            "fname": "/pxelinux.0" if reply else ".",
+            "options": options,
+        }
+
+    def handshakes(self, count, interval=0.01):
+        """
+        Yield lists of the four DISCOVER/OFFER/REQUEST/ACK packets for count
+            handshakes starting interval seconds apart.
+        """
+        for i in range(count):
+            chaddr = self.random.choice(self.clients)
+            giaddr = self.random.choice(self.relays)
+            server = self.random.choice(self.servers)
+            xid = "%08x" % self.random.getrandbits(32)
+            ts = self.start + datetime.timedelta(seconds=i * interval)
+            packets = []
+            for opname in OPNAMES:
+                ts += datetime.timedelta(milliseconds=self.random.randint(1, 50))
+                packets.append(self.packet(opname, chaddr, giaddr, server, xid, ts))
+            yield packets
+
+    def acks(self, count):
+        """
+        Return count dhcpack packets.
+        """
+        return [packets[-1] for packets in self.handshakes(count)]
+
+    def server_stats(self, count, handshakes=100):
+        """
+        Return count server_stats snapshots, as posted by the agent, each
+            covering handshakes handshakes to one server.
+        """
+        snapshots = []
+        for i in range(count):
+            server = self.servers[i % len(self.servers)]
+            snapshot = {
+                "server_ip": server,
+                "server_hostname": "dhcp-%s" % server.rsplit(".", 1)[-1],
+                "clients": {},
+            }
+            for opname in OPNAMES:
+                snapshot[opname + "_count"] = 0
+            for packets in self.handshakes(handshakes):
+                for packet in packets:
+                    snapshot[packet["opname"] + "_count"] += 1
+                    counts = snapshot["clients"].setdefault(packet["chaddr"],
+                        dict((opname, 0) for opname in OPNAMES))
+                    counts[packet["opname"]] += 1
+            snapshot["timestamp_start"] = packets[0]["ts"]
+            snapshot["timestamp_end"] = packets[-1]["ts"]
+            snapshots.append(snapshot)
+        return snapshots
+
+
+def parse_duration(text):
+    """
+    Parse a dhcpdump duration like "3d12h" into seconds.
+    """
+    seconds = number = 0
+    for char in text:
+        if char.isdigit():
+            number = number * 10 + int(char)
+        else:
+            seconds += number * DURATION_UNITS[char]
+            number = 0
+    return seconds
+
+
+def timestamp(packet):
+    """
+    Return a packet's ts as (seconds, microseconds) since the epoch.
+    """
+    ts = datetime.datetime.strptime(packet["ts"], "%Y-%m-%d %H:%M:%S.%f")
+    return calendar.timegm(ts.timetuple()), ts.microsecond
+
+
+def to_dhcpdump(packet):
+    """
+    Render a packet as the lines of a dhcpdump entry, including the separator.
+    """
+    lines = [
+        "  TIME: %s" % packet["ts"],
+        "    IP: %s (%s) > %s (%s)" % (packet["ip_src"], packet["mac_src"], packet["ip_dst"],
+            packet["mac_dst"]),
+        "    OP: %d (%s)" % (packet["op"], "BOOTPREPLY" if packet["op"] == 2 else "BOOTPREQUEST"),
+        " HTYPE: %d (Ethernet)" % packet["htype"],
+        "  HLEN: %d" % packet["hlen"],
+        "  HOPS: %d" % packet["hops"],
+        "   XID: %s" % packet["xid"],
+        "  SECS: %d" % packet["secs"],
+        " FLAGS: %s" % packet["flags"],
+        "CIADDR: %s" % packet["ciaddr"],
+        "YIADDR: %s" % packet["yiaddr"],
+        "SIADDR: %s" % packet["siaddr"],
+        "GIADDR: %s" % packet["giaddr"],
+        "CHADDR: %s:00:00:00:00:00:00:00:00:00:00" % packet["chaddr"],
+        " SNAME: %s" % packet["sname"],
+        " FNAME: %s" % packet["fname"],
+    ]
+    if packet["op"] == 1:
+        lines.extend(PARAMETER_REQUEST_LIST)
+    for option in packet["options"]:
+        data = option["data"]
+        length = len(data)
+        if option["op"] == 53:
+            data = "%d (%s)" % (MESSAGE_TYPES[data], data.upper())
+            length = 1
+        elif option["op"] in DURATION_OPTIONS:
+            data = "%d (%s)" % (parse_duration(data), data)
+            length = 4
+        elif option["op"] in IP_OPTIONS:
+            length = 4 * len(data.split(","))
+        name = option["name"].replace("_", " ").capitalize()
+        lines.append("OPTION: %3d (%3d) %-26s%s" % (option["op"], length, name, data))
+    lines.append("")
+    lines.append("-" * 75)
+    return lines
+
+
+def to_frame(packet):
+    """
+    Encode a packet as an Ethernet/IPv4/UDP/BOOTP frame.
+    """
+    options = ["\x63\x82\x53\x63"]
+    for option in packet["options"]:
+        op, data = option["op"], option["data"]
+        if op == 53:
+            value = chr(MESSAGE_TYPES[data])
+        elif op in IP_OPTIONS:
+            value = "".join(socket.inet_aton(ip) for ip in data.split(","))
+        elif op in DURATION_OPTIONS:
+            value = struct.pack("!I", parse_duration(data))
+        else:
+            value = data
+        options.append(chr(op) + chr(len(value)) + value)
+    options.append("\xff")
+
+    mac = lambda value: "".join(chr(int(byte, 16)) for byte in value.split(":"))
+    bootp = struct.pack("!BBBBIHH4s4s4s4s16s64s128s", packet["op"], packet["htype"],
+        packet["hlen"], packet["hops"], int(packet["xid"], 16), packet["secs"],
+        int(packet["flags"], 16), socket.inet_aton(packet["ciaddr"]),
+        socket.inet_aton(packet["yiaddr"]), socket.inet_aton(packet["siaddr"]),
+        socket.inet_aton(packet["giaddr"]), mac(packet["chaddr"]), packet["sname"].strip("."),
+        packet["fname"].strip(".")) + "".join(options)
+    udp = struct.pack("!HHHH", 67, 67, 8 + len(bootp), 0) + bootp
+    ip = struct.pack("!BBHHHBBH4s4s", 0x45, 0, 20 + len(udp), 0, 0, 64, 17, 0,
+        socket.inet_aton(packet["ip_src"]), socket.inet_aton(packet["ip_dst"])) + udp
+    return mac(packet["mac_dst"]) + mac(packet["mac_src"]) + "\x08\x00" + ip
+
+
+def write_pcap(stream, packets):
+    """
+    Write packets to stream as an Ethernet pcap capture.
+    """
+    stream.write(struct.pack("<IHHiIII", 0xa1b2c3d4, 2, 4, 0, 0, 65535, 1))
+    for packet in packets:
+        frame = to_frame(packet)
+        seconds, microseconds = timestamp(packet)
+        stream.write(struct.pack("<IIII", seconds, microseconds, len(frame), len(frame)))
+        stream.write(frame)
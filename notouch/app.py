@@ -1,17 +1,94 @@
 import tornado
 from .routes import HANDLERS
+from .feed import ChangeFeed
+from .metrics import Metrics
+from .handlers.buffer import WriteBuffer
+from .handlers.cache import QueryCache
+from .ingest import IngestPool
+from .retention import Retention
+from .storage import RethinkDBStorage, SQLiteStorage
+from .util import TABLES
 
 class Application(tornado.web.Application):
 
-    def __init__(self, tornado_kwargs={}, rethinkdb_host="localhost", rethinkdb_port=28015,
-        rethinkdb_db="notouch"):
+    def __init__(self, tornado_kwargs={}, storage="rethinkdb", rethinkdb_host="localhost",
+        rethinkdb_port=28015, rethinkdb_db="notouch", sqlite_path="notouch.db",
+        sqlite_poll_interval=0.25, write_buffer_size=0, write_buffer_delay=50,
+        durability="hard", pool_min_size=2, pool_max_size=10, pool_checkout_timeout=5.0,
+        archive_dir=None, retention_interval=3600, retention_batch_size=500,
+        retention_rate=2000, cache_size=1024, cache_ttl=5.0, metrics_dir=None,
+        ingest_workers=0):
+        """
+        storage - Storage backend, "rethinkdb" or "sqlite". See notouch.storage.
+        sqlite_path - Database file of the sqlite backend.
+        sqlite_poll_interval - Seconds between polls for writes by other workers
+            while the sqlite backend follows a table's changes.
+        write_buffer_size - Coalesce ingested documents across requests and insert
+            them once this many are pending. 0 disables coalescing.
+        write_buffer_delay - Maximum milliseconds a document waits in the write
+            buffer before it is flushed.
+        durability - Write durability for ingest, "hard" or "soft".
+        pool_min_size, pool_max_size - Bounds on the number of rethinkdb connections
+            each worker keeps in its connection pool. The query cache keeps a
+            changefeed, and so a connection, open per cached table.
+        pool_checkout_timeout - Seconds a query waits for a pooled connection.
+        archive_dir - Archive rows past their retention period (see
+            notouch.util.RETENTION) here and delete them. None disables retention.
+        retention_interval - Seconds between retention runs.
+        retention_batch_size, retention_rate - Rows archived per batch, and the
+            maximum rows deleted per second.
+        cache_size - Query responses cached per worker, 0 disables the cache.
+        cache_ttl - Seconds a cached query response is served for at most.
+        metrics_dir - Directory where forked workers share metrics snapshots, so
+            /metrics reports on all of them. See notouch.metrics.
+        ingest_workers - Processes per worker validating large ingest bodies,
+            0 validates them on the IOLoop. See notouch.ingest.
+        """
 
         tornado_kwargs["handlers"] = HANDLERS
 
         self.rethinkdb_host = rethinkdb_host
         self.rethinkdb_port = rethinkdb_port
         self.rethinkdb_db = rethinkdb_db
-        self.conn = None
+
+        self.metrics = Metrics(metrics_dir)
+        # Route pattern of each handler, used to label metrics.
+        self.routes = dict((handler, pattern) for pattern, handler in HANDLERS)
+
+        if storage == "sqlite":
+            self.storage = SQLiteStorage(sqlite_path, poll_interval=sqlite_poll_interval,
+                metrics=self.metrics)
+        elif storage == "rethinkdb":
+            self.storage = RethinkDBStorage(rethinkdb_host, rethinkdb_port, rethinkdb_db,
+                min_size=pool_min_size, max_size=pool_max_size,
+                checkout_timeout=pool_checkout_timeout, metrics=self.metrics)
+        else:
+            raise ValueError("Unknown storage backend: %s" % storage)
+        # The rethinkdb connection pool, for its status endpoint.
+        self.pool = getattr(self.storage, "pool", None)
+
+        self.ingest = IngestPool(ingest_workers)
+
+        self.durability = durability
+        self.write_buffers = {}
+        if write_buffer_size > 0:
+            for table in TABLES:
+                self.write_buffers[table] = WriteBuffer(self, table, max_docs=write_buffer_size,
+                    max_delay=write_buffer_delay / 1000.0, durability=durability)
+
+        # Changefeeds for ack streams and query cache invalidation, started on
+        # first subscription.
+        self.feeds = dict((table, ChangeFeed(self, table)) for table in TABLES)
+
+        self.query_cache = None
+        if cache_size > 0:
+            self.query_cache = QueryCache(self, max_entries=cache_size, ttl=cache_ttl)
+
+        # Started by the server in one worker only.
+        self.retention = None
+        if archive_dir is not None:
+            self.retention = Retention(self, archive_dir, interval=retention_interval,
+                batch_size=retention_batch_size, max_rate=retention_rate)
 
         tornado_args = []
-        super(Application, self).__init__(*tornado_args, **tornado_kwargs)
\ No newline at end of file
+        super(Application, self).__init__(*tornado_args, **tornado_kwargs)
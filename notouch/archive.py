@@ -0,0 +1,121 @@
+"""
+Date-partitioned gzip NDJSON archives of expired rows.
+
+Rows removed by the retention task (see notouch.retention) are appended to
+<archive_dir>/<table>/<YYYY-MM-DD>.ndjson.gz, partitioned on the date of the
+row's time field. Each append writes a new gzip member, which gzip readers
+treat as one continuous stream, so a partition can be extended across
+retention runs without rewriting it.
+
+The archives are read back with notouch-archive:
+
+> notouch-archive --archive_dir /var/lib/notouch/archive --table dhcpack \
+        --from "2015-01-01" --to "2015-01-03" --chaddr 00:00:00:00:00:00
+"""
+import argparse
+import gzip
+import json
+import os
+import sys
+
+from .util import RETENTION
+
+EXTENSION = ".ndjson.gz"
+
+
+def partition(ts):
+    """
+    The partition (date) of a "YYYY-MM-DD HH:MM:SS.ffffff" timestamp.
+    """
+    return ts[:10]
+
+
+def partition_path(archive_dir, table, date):
+    return os.path.join(archive_dir, table, date + EXTENSION)
+
+
+def write(archive_dir, table, time_field, rows, json_default=None):
+    """
+    Append rows to the partitions for their dates, syncing each file to disk
+        before returning so the rows can safely be deleted afterwards.
+    """
+    partitions = {}
+    for row in rows:
+        partitions.setdefault(partition(row[time_field]), []).append(row)
+
+    table_dir = os.path.join(archive_dir, table)
+    if not os.path.isdir(table_dir):
+        os.makedirs(table_dir)
+    for date, partition_rows in sorted(partitions.items()):
+        with open(partition_path(archive_dir, table, date), "ab") as archive_file:
+            with gzip.GzipFile(fileobj=archive_file, mode="wb") as gzip_file:
+                for row in partition_rows:
+                    gzip_file.write(json.dumps(row, default=json_default))
+                    gzip_file.write("\n")
+            archive_file.flush()
+            os.fsync(archive_file.fileno())
+
+
+def partitions(archive_dir, table, start=None, end=None):
+    """
+    Return the dates of the partitions of table that may hold rows with
+        start <= time < end, oldest first.
+    """
+    table_dir = os.path.join(archive_dir, table)
+    if not os.path.isdir(table_dir):
+        return []
+    dates = sorted(name[:-len(EXTENSION)] for name in os.listdir(table_dir)
+        if name.endswith(EXTENSION))
+    return [date for date in dates if (start is None or date >= partition(start))
+        and (end is None or date <= partition(end))]
+
+
+def read(archive_dir, table, time_field, start=None, end=None, filters=None):
+    """
+    Yield archived rows of table with start <= time < end, matching every
+        field -> value in filters. Rows come out in partition order.
+    """
+    filters = filters or {}
+    for date in partitions(archive_dir, table, start, end):
+        with gzip.open(partition_path(archive_dir, table, date), "rb") as archive_file:
+            for line in archive_file:
+                row = json.loads(line)
+                ts = row.get(time_field)
+                if start is not None and ts < start:
+                    continue
+                if end is not None and ts >= end:
+                    continue
+                if all(row.get(field) == value for field, value in filters.items()):
+                    yield row
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Read notouch archives as NDJSON.")
+    parser.add_argument("--archive_dir", dest="archive_dir", type=str, required=True,
+        help="Directory the notouch server archives expired rows to.")
+    parser.add_argument("--table", dest="table", type=str, default="dhcpack",
+        choices=sorted(RETENTION), help="Table to read archived rows of.")
+    parser.add_argument("--from", dest="start", type=str,
+        help="Only rows with a time at or after this.")
+    parser.add_argument("--to", dest="end", type=str, help="Only rows with a time before this.")
+    parser.add_argument("--chaddr", dest="chaddr", type=str, help="Only acks for this client.")
+    parser.add_argument("--xid", dest="xid", type=str, help="Only acks with this xid.")
+    parser.add_argument("--giaddr", dest="giaddr", type=str, help="Only acks via this relay.")
+    parser.add_argument("--server_ip", dest="server_ip", type=str,
+        help="Only server stats of this server.")
+    args = parser.parse_args()
+
+    filters = {}
+    for field in ("chaddr", "xid", "giaddr", "server_ip"):
+        if getattr(args, field) is not None:
+            filters[field] = getattr(args, field)
+
+    time_field = RETENTION[args.table]["time_field"]
+    try:
+        for row in read(args.archive_dir, args.table, time_field, args.start, args.end,
+                filters):
+            sys.stdout.write(json.dumps(row))
+            sys.stdout.write("\n")
+    except IOError:
+        # Output piped to something like head that exited.
+        pass
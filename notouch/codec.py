@@ -0,0 +1,110 @@
+"""
+Decoding of ingest request bodies.
+
+Agents may send documents as JSON (the default) or msgpack, optionally gzip
+compressed with Content-Encoding: gzip. Compression matters because every ack
+in a batch repeats the same keys and option names, so batches shrink by an
+order of magnitude. msgpack support requires the optional msgpack package.
+
+Batches of acks may also be sent in the columnar format of notouch.wire, which
+states those repeated keys, options and values once per batch.
+"""
+import json
+import zlib
+
+from . import wire
+
+try:
+    import msgpack
+except ImportError:
+    msgpack = None
+
+# Bodies without a specific content type (e.g. older agents, or curl -d) are JSON.
+JSON_CONTENT_TYPES = ["application/json", "text/plain", "application/x-www-form-urlencoded", ""]
+MSGPACK_CONTENT_TYPES = ["application/x-msgpack", "application/msgpack"]
+
+# Upper bound on the size of a decompressed body, protecting workers from
+# small gzip bodies that inflate to gigabytes.
+MAX_DECODED_SIZE = 256 * 1024 * 1024
+
+
+class DecodeError(ValueError):
+    """
+    The body could not be decoded into a list of documents.
+    """
+
+
+class UnsupportedMediaType(DecodeError):
+    """
+    The body uses a content type or encoding that can't be decoded.
+    """
+
+
+class BodyTooLarge(DecodeError):
+    """
+    The decompressed body is larger than the allowed maximum.
+    """
+
+
+def media_type(content_type):
+    """
+    Strip parameters (e.g. charset) from a Content-Type header value.
+    """
+    return (content_type or "").split(";", 1)[0].strip().lower()
+
+
+def gunzip(body, max_size=MAX_DECODED_SIZE):
+    """
+    Decompress a gzip body, raising BodyTooLarge past max_size bytes.
+    """
+    decompressor = zlib.decompressobj(16 + zlib.MAX_WBITS)
+    try:
+        data = decompressor.decompress(body, max_size)
+    except zlib.error as e:
+        raise DecodeError("Invalid gzip body: %s" % e)
+    if decompressor.unconsumed_tail:
+        raise BodyTooLarge("Decompressed body is larger than %d bytes." % max_size)
+    return data
+
+
+def decode_documents(body, content_type="application/json", content_encoding=None,
+        max_size=MAX_DECODED_SIZE):
+    """
+    Decode a request body into a list of documents.
+
+    A single document is returned as a one element list. Raises DecodeError
+    (or one of its subclasses) if the body can't be decoded.
+    """
+    content_encoding = (content_encoding or "identity").strip().lower()
+    if content_encoding == "gzip":
+        body = gunzip(body, max_size)
+    elif content_encoding != "identity":
+        raise UnsupportedMediaType("Unsupported Content-Encoding: %s" % content_encoding)
+
+    content_type = media_type(content_type)
+    if content_type in MSGPACK_CONTENT_TYPES:
+        if msgpack is None:
+            raise UnsupportedMediaType("msgpack bodies require the msgpack package.")
+        try:
+            docs = msgpack.unpackb(body, raw=False)
+        except Exception as e:
+            raise DecodeError("Invalid msgpack body: %s" % e)
+    elif content_type in JSON_CONTENT_TYPES:
+        try:
+            docs = json.loads(body)
+        except ValueError as e:
+            raise DecodeError("Invalid JSON body: %s" % e)
+    elif content_type == wire.COLUMNAR_CONTENT_TYPE:
+        try:
+            docs = wire.decode(json.loads(body))
+        except ValueError as e:
+            # Both invalid JSON and wire.WireError.
+            raise DecodeError("Invalid columnar body: %s" % e)
+    else:
+        raise UnsupportedMediaType("Unsupported Content-Type: %s" % content_type)
+
+    if isinstance(docs, dict):
+        docs = [docs]
+    if not isinstance(docs, list) or not all(isinstance(doc, dict) for doc in docs):
+        raise DecodeError("Body must be a document or list of documents.")
+    return docs
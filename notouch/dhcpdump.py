@@ -0,0 +1,140 @@
+"""
+Parser for dhcpdump's text output.
+
+dhcpdump prints each packet it captures as a block of "NAME: value" lines
+followed by a separator line (see scripts/dhcpdump_parser.py for a sample).
+The agent parses its live output with these, and notouch-import (see
+notouch.importer) parses saved captures with the same code, so both store the
+same packets.
+"""
+from .packet import Packet
+
+
+# Options parse_entry leaves out of the packet.
+SKIPPED_OPTIONS = frozenset([55, 57, 93, 94, 97])
+
+# Option display names seen so far, mapped to their normalized keys.
+option_keys = {}
+
+
+def parse_ip(packet, value):
+    src, dst = value.split(">")
+    src_ip, src_mac = src.split("(")
+    dst_ip, dst_mac = dst.split("(")
+    packet.ip_src = src_ip.strip()
+    packet.ip_dst = dst_ip.strip()
+    packet.mac_src = src_mac.strip(" )")
+    packet.mac_dst = dst_mac.strip(" )")
+
+
+def parse_chaddr(packet, value):
+    # dhcpdump prints all 16 chaddr bytes, keep the hlen bytes actually used.
+    hlen = packet.hlen if 0 < packet.hlen <= 16 else 6
+    packet.chaddr = value[0:hlen * 3 - 1]
+
+
+def parse_option(packet, value):
+    op = int(value.split("(", 1)[0])
+    if op in SKIPPED_OPTIONS:
+        return
+    parts = value.split(")", 1)[-1].strip().split("  ")
+    name = parts[0]
+    data = parts[-1].strip()
+    if data.endswith(")"):
+        data = data.split("(")[-1].strip(" )").lower()
+    key = option_keys.get(name)
+    if key is None:
+        key = option_keys[name] = name.strip().lower().replace(" ", "_")
+    packet.options.append((op, key, data))
+    if op == 53:
+        packet.opname = data
+
+
+def set_field(field, convert=None):
+    """
+    Build a line parser storing the line's value in a Packet field.
+    """
+    if convert is None:
+        return lambda packet, value: setattr(packet, field, value)
+    return lambda packet, value: setattr(packet, field, convert(value))
+
+
+def leading_int(value):
+    """
+    Parse values like "2 (BOOTPREPLY)" or "1 (Ethernet)".
+    """
+    return int(value.split("(", 1)[0])
+
+
+# dhcpdump line prefix -> parser called with the packet and the value after ":".
+LINE_PARSERS = {
+    "TIME": set_field("ts"),
+    "IP": parse_ip,
+    "OP": set_field("op", leading_int),
+    "HTYPE": set_field("htype", leading_int),
+    "HLEN": set_field("hlen", int),
+    "HOPS": set_field("hops", int),
+    "XID": set_field("xid"),
+    "SECS": set_field("secs", int),
+    "FLAGS": set_field("flags"),
+    "CIADDR": set_field("ciaddr"),
+    "YIADDR": set_field("yiaddr"),
+    "SIADDR": set_field("siaddr"),
+    "GIADDR": set_field("giaddr"),
+    "CHADDR": parse_chaddr,
+    "SNAME": set_field("sname"),
+    "FNAME": set_field("fname"),
+    "OPTION": parse_option,
+}
+
+
+def parse_entry(entry):
+    """
+    Parse the (stripped) lines of one dhcpdump entry into a Packet. Each line
+    is dispatched on its prefix with a single dict lookup; lines without a
+    known prefix, like the continuation lines of multi-line options, are
+    ignored.
+    """
+    packet = Packet()
+    for line in entry:
+        prefix, _, value = line.partition(":")
+        parser = LINE_PARSERS.get(prefix)
+        if parser is not None:
+            parser(packet, value.strip())
+    return packet
+
+
+class EntrySplitter(object):
+    """
+    Group lines of dhcpdump output into entries as they arrive. Lines can be
+    fed in any number of calls; an entry is complete at the separator
+    dhcpdump prints after it.
+    """
+    # Line seperator for each entry is 75 '-' characters.
+    SEPARATOR = "-" * 75
+
+    def __init__(self):
+        self.entry = []
+
+    def feed(self, lines):
+        """
+        Return the stripped lines of each entry completed by lines.
+        """
+        entries = []
+        for line in lines:
+            line = line.strip()
+            if line == self.SEPARATOR:
+                if self.entry:
+                    entries.append(self.entry)
+                self.entry = []
+            elif line != '':
+                self.entry.append(line)
+        return entries
+
+
+def split_entries(lines):
+    """
+    Group lines of dhcpdump output into entries, returning the stripped lines
+    of each entry.
+    """
+    return EntrySplitter().feed(lines)
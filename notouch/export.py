@@ -0,0 +1,111 @@
+"""
+Serialization of bulk exports, see the dhcp/ack/export API.
+
+An export is a table range streamed as NDJSON (one document per line) or CSV
+(a header row, then one row per document with the columns in CSV_FIELDS), and
+either format can be gzip compressed ("ndjson.gz", "csv.gz"). Exporter turns
+batches of documents into chunks of the response body as they are read, so an
+export of any size is serialized in constant memory.
+
+Rows come out in [time, id] index order, and every format includes both, so an
+interrupted export can be resumed by starting a new one after the time and id
+of the last complete row received.
+"""
+import csv
+import json
+import StringIO
+import zlib
+
+# Export format -> Content-Type of the uncompressed response.
+CONTENT_TYPES = {
+    "ndjson": "application/x-ndjson",
+    "csv": "text/csv; charset=utf-8",
+}
+GZIP_SUFFIX = ".gz"
+GZIP_CONTENT_TYPE = "application/gzip"
+
+# Table -> columns of its CSV exports. Lists and objects (e.g. an ack's options)
+# are written as JSON.
+CSV_FIELDS = {
+    "dhcpack": ["ts", "id", "chaddr", "yiaddr", "xid", "giaddr", "ciaddr", "siaddr",
+        "mac_src", "mac_dst", "ip_src", "ip_dst", "lease_time", "renewal_time",
+        "rebinding_time", "options"],
+}
+
+
+def formats():
+    """
+    Every accepted export format.
+    """
+    return sorted(CONTENT_TYPES.keys() + [name + GZIP_SUFFIX for name in CONTENT_TYPES])
+
+
+def csv_value(value, json_default=None):
+    if value is None:
+        return ""
+    if isinstance(value, (list, dict)):
+        return json.dumps(value, default=json_default)
+    if isinstance(value, unicode):
+        return value.encode("utf-8")
+    return str(value)
+
+
+class Exporter(object):
+    def __init__(self, export_format, table, json_default=None):
+        """
+        export_format - One of formats(), raising ValueError otherwise.
+        table - Table exported, which picks the CSV columns.
+        json_default - Serializer for objects json can't encode, see json.dumps.
+        """
+        name = export_format
+        self.gzip = name.endswith(GZIP_SUFFIX)
+        if self.gzip:
+            name = name[:-len(GZIP_SUFFIX)]
+        if name not in CONTENT_TYPES or (name == "csv" and table not in CSV_FIELDS):
+            raise ValueError("format must be one of %s." % ", ".join(formats()))
+        self.format = name
+        self.fields = CSV_FIELDS.get(table)
+        self.json_default = json_default
+        self.extension = export_format
+        self.content_type = GZIP_CONTENT_TYPE if self.gzip else CONTENT_TYPES[name]
+
+        self.compressor = None
+        if self.gzip:
+            self.compressor = zlib.compressobj(6, zlib.DEFLATED, 16 + zlib.MAX_WBITS)
+
+    def compress(self, data):
+        if self.compressor is None:
+            return data
+        return self.compressor.compress(data)
+
+    def start(self):
+        """
+        The beginning of the body, the header row of a CSV export.
+        """
+        if self.format != "csv":
+            return ""
+        return self.compress(self.csv_rows([self.fields]))
+
+    def encode(self, docs):
+        """
+        The part of the body holding a batch of documents. Compressed output may
+            be held back by the compressor until a later batch or finish.
+        """
+        if self.format == "csv":
+            return self.compress(self.csv_rows([[csv_value(doc.get(field), self.json_default)
+                for field in self.fields] for doc in docs]))
+        return self.compress("".join(json.dumps(doc, default=self.json_default) + "\n"
+            for doc in docs))
+
+    def finish(self):
+        """
+        The end of the body, whatever the compressor still holds.
+        """
+        if self.compressor is None:
+            return ""
+        return self.compressor.flush()
+
+    def csv_rows(self, rows):
+        buf = StringIO.StringIO()
+        csv.writer(buf, lineterminator="\n").writerows(rows)
+        return buf.getvalue()
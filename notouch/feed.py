@@ -0,0 +1,160 @@
+"""
+Fan-out of a storage changefeed (see notouch.storage) to streaming clients.
+
+Each worker runs at most one changes() feed per table, no matter how many
+clients are watching it, and only while at least one is. New documents are
+matched against each subscriber's filters and appended to that subscriber's
+buffer. Buffers are bounded: a subscriber that doesn't keep up loses its
+oldest undelivered documents instead of holding memory or slowing the feed
+for everyone else, and is told how many it missed.
+"""
+import tornado.gen
+import tornado.locks
+
+import collections
+import logging
+import socket
+import struct
+
+log = logging.getLogger(__name__)
+
+
+def parse_subnet(subnet):
+    """
+    Parse "10.0.0.0/8" into a (network, mask) pair of integers, raising
+        ValueError if it is malformed.
+    """
+    try:
+        address, _, prefixlen = subnet.partition("/")
+        prefixlen = int(prefixlen or 32)
+        network = struct.unpack("!I", socket.inet_aton(address))[0]
+    except (socket.error, struct.error, ValueError):
+        raise ValueError("Invalid subnet: %s" % subnet)
+    if not 0 <= prefixlen <= 32:
+        raise ValueError("Invalid subnet: %s" % subnet)
+    mask = (0xffffffff << (32 - prefixlen)) & 0xffffffff
+    return network & mask, mask
+
+
+def in_subnet(address, subnet):
+    network, mask = subnet
+    try:
+        return struct.unpack("!I", socket.inet_aton(address))[0] & mask == network
+    except (socket.error, TypeError):
+        return False
+
+
+class Subscriber(object):
+    """
+    A client of a ChangeFeed, receiving the documents that match all of its
+        filters into a buffer of at most max_buffer documents.
+
+    filters - field -> value the document must have.
+    subnets - field -> (network, mask) from parse_subnet the document's IP
+        address in that field must be in.
+    """
+    def __init__(self, filters=None, subnets=None, max_buffer=1000):
+        self.filters = filters or {}
+        self.subnets = subnets or {}
+        self.buffer = collections.deque(maxlen=max_buffer)
+        self.dropped = 0
+        self.ready = tornado.locks.Event()
+
+    def matches(self, doc):
+        for field, value in self.filters.items():
+            if doc.get(field) != value:
+                return False
+        for field, subnet in self.subnets.items():
+            if not in_subnet(doc.get(field), subnet):
+                return False
+        return True
+
+    def put(self, doc):
+        if len(self.buffer) == self.buffer.maxlen:
+            self.dropped += 1
+        self.buffer.append(doc)
+        self.ready.set()
+
+    def take(self):
+        """
+        Return the buffered documents and the number dropped since the last
+            call, emptying the buffer.
+        """
+        docs, dropped = list(self.buffer), self.dropped
+        self.buffer.clear()
+        self.dropped = 0
+        self.ready.clear()
+        return docs, dropped
+
+
+class ChangeFeed(object):
+    def __init__(self, application, table, max_backoff=5.0):
+        self.application = application
+        self.table = table
+        self.max_backoff = max_backoff
+
+        self.subscribers = set()
+        self.cursor = None
+        self.running = False
+        self.changes = 0
+        # Set while the changefeed is open and delivering changes.
+        self.active = tornado.locks.Event()
+
+    def subscribe(self, subscriber):
+        self.subscribers.add(subscriber)
+        if not self.running:
+            self.running = True
+            self.run()
+
+    def unsubscribe(self, subscriber):
+        self.subscribers.discard(subscriber)
+        if not self.subscribers and self.cursor is not None:
+            # Nobody is listening, close the feed until someone subscribes.
+            self.cursor.close()
+
+    def publish(self, doc):
+        self.changes += 1
+        for subscriber in list(self.subscribers):
+            if subscriber.matches(doc):
+                subscriber.put(doc)
+
+    @tornado.gen.coroutine
+    def run(self):
+        """
+        Read the table's changefeed while there are subscribers, reopening it
+            with backoff if the feed fails. With rethinkdb the feed holds one
+            connection from the application's pool for as long as it runs.
+        """
+        storage = self.application.storage
+        backoff = 0.1
+        try:
+            while self.subscribers:
+                cursor = None
+                discard = False
+                try:
+                    cursor = self.cursor = yield storage.changes(self.table)
+                    if not self.subscribers:
+                        break
+                    self.active.set()
+                    backoff = 0.1
+                    while True:
+                        docs = yield cursor.fetch()
+                        if not docs:
+                            break
+                        for doc in docs:
+                            self.publish(doc)
+                except Exception as e:
+                    if not self.subscribers:
+                        break
+                    discard = True
+                    log.warning("Changefeed on %s failed (%s), retrying in %.1fs.",
+                        self.table, e, backoff)
+                    yield tornado.gen.sleep(backoff)
+                    backoff = min(backoff * 2, self.max_backoff)
+                finally:
+                    self.active.clear()
+                    self.cursor = None
+                    if cursor is not None:
+                        cursor.close(discard=discard or not self.subscribers)
+        finally:
+            self.running = False
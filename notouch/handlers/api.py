@@ -1,33 +1,265 @@
-import rethinkdb
 import tornado.gen
+import tornado.iostream
+import tornado.web
+
+import datetime
+import json
+
+from .. import export
+from .. import feed
+from .. import hosts
+from .. import rollup
+from ..util import SUBNET_BITS
+from .util import BaseHandler, json_serializer, returnsJSON
+
+# Fields that can be used to filter GET requests, each backed by a
+# "<field>_ts" index in notouch.util.INDEXES.
+ACK_FILTERS = ["chaddr", "xid", "giaddr", "server_identifier"]
+SERVER_STATS_FILTERS = ["server_ip"]
+HOST_FILTERS = ["yiaddr", "hostname", "giaddr"]
+# Fields live ack streams can be filtered on, besides subnet.
+ACK_STREAM_FILTERS = ["chaddr", "giaddr"]
+
+# Acks buffered per stream client before the oldest are dropped.
+ACK_STREAM_BUFFER = 1000
+# Seconds between keepalive comments on idle streams.
+ACK_STREAM_HEARTBEAT = 15
 
-from .util import BaseHandler
 
 class DHCPAckApiV1Handler(BaseHandler):
     """
     DHCP Ack API Handler - Log DHCP ack's from dhcp servers.
+
+    GET arguments:
+        chaddr, xid, giaddr, server_identifier - Filter on one of these fields.
+        subnet - Instead, only return acks leasing an address (yiaddr) in this
+            subnet, e.g. 10.1.0.0/16. Its prefix length must be one of
+            notouch.util.SUBNET_BITS.
+        from, to - Only return acks with from <= ts < to. Timestamps may be
+            given in any form ingest accepts, or as epoch seconds.
+        limit - Maximum number of acks to return.
+        order - asc (oldest first, the default) or desc.
+        cursor - Cursor from a previous response to fetch the next page.
+        stream - ndjson or json to stream every matching ack (up to limit, if
+            given) instead of returning a single page.
     """
 
+    @tornado.gen.coroutine
     def get(self):
-        pass
+        subnet = self.get_argument("subnet", None)
+        if subnet is None:
+            yield self.get_range("dhcpack", "ts", "ts", ACK_FILTERS)
+            return
+
+        field, _ = self.get_filter(ACK_FILTERS)
+        if field is not None:
+            raise tornado.web.HTTPError(400, "subnet can't be combined with %s.", field)
+        try:
+            network, mask = feed.parse_subnet(subnet)
+        except ValueError as e:
+            raise tornado.web.HTTPError(400, "%s", e)
+        bits = bin(mask).count("1")
+        if bits not in SUBNET_BITS:
+            raise tornado.web.HTTPError(400, "subnet prefix length must be one of %s.",
+                ", ".join(str(length) for length in SUBNET_BITS))
+        yield self.get_range("dhcpack", "ts", "yiaddr_subnet_ts", [],
+            prefix=[bits, network])
 
     @tornado.gen.coroutine
     def post(self):
-        conn = yield self.application.conn
-        yield rethinkdb.table("dhcpack").insert(rethinkdb.json(self.request.body)).run(
-            conn)
+        docs = yield self.load_documents("dhcpack")
+        yield self.insert("dhcpack", docs)
+        host_docs = hosts.hosts(docs)
+        if host_docs:
+            yield self.upsert(hosts.TABLE, host_docs)
+
+
+class DHCPAckExportApiV1Handler(BaseHandler):
+    """
+    DHCP Ack Export API Handler - Bulk export of acks, see notouch.export.
+
+    GET arguments:
+        from, to - Only export acks with from <= ts < to.
+        format - ndjson (the default) or csv, either optionally followed by .gz
+            for a gzip compressed export.
+        chaddr, xid, giaddr, server_identifier - Filter on one of these fields.
+        after_ts, after_id - Resume an interrupted export after the ack with
+            this ts and id, the last complete row received.
+        limit, order - As for DHCPAckApiV1Handler, though limit is optional.
+
+    Acks are streamed off the ts (or filter) index in batches, so memory use
+    doesn't depend on the size of the export.
+    """
+
+    @tornado.gen.coroutine
+    def get(self):
+        try:
+            exporter = export.Exporter(self.get_argument("format", "ndjson"), "dhcpack",
+                json_default=json_serializer)
+        except ValueError as e:
+            raise tornado.web.HTTPError(400, "%s", e)
+        range_args, _ = self.get_range_args("ts", ACK_FILTERS, max_limit=None)
+
+        after_ts = self.get_time_argument("after_ts")
+        after_id = self.get_argument("after_id", None)
+        if (after_ts is None) != (after_id is None):
+            raise tornado.web.HTTPError(400, "after_ts and after_id must be given together.")
+        if after_ts is not None:
+            if range_args["cursor"] is not None:
+                raise tornado.web.HTTPError(400, "after_ts can't be combined with cursor.")
+            range_args["cursor"] = [after_ts, after_id]
+        yield self.export_query("dhcpack", range_args, exporter)
+
+
+class DHCPAckStreamApiV1Handler(BaseHandler):
+    """
+    DHCP Ack Stream API Handler - Acks as they are ingested, as server-sent
+        events.
+
+    GET arguments:
+        chaddr, giaddr - Only send acks with these field values.
+        subnet - Only send acks leasing an address (yiaddr) in this subnet,
+            e.g. 10.1.0.0/16.
+
+    Each ack is sent as one event with the ack as JSON data. A client that
+    falls behind by more than ACK_STREAM_BUFFER acks misses the oldest ones,
+    and is sent a "dropped" event with the number missed.
+    """
+
+    def initialize(self):
+        self.subscriber = None
+        self.closed = False
+
+    @tornado.gen.coroutine
+    def get(self):
+        filters = {}
+        for field in ACK_STREAM_FILTERS:
+            if self.get_argument(field, None) is not None:
+                filters[field] = self.get_argument(field)
+        subnets = {}
+        if self.get_argument("subnet", None) is not None:
+            try:
+                subnets["yiaddr"] = feed.parse_subnet(self.get_argument("subnet"))
+            except ValueError as e:
+                raise tornado.web.HTTPError(400, "%s", e)
+
+        self.set_header("Content-Type", "text/event-stream")
+        self.set_header("Cache-Control", "no-cache")
+        self.subscriber = feed.Subscriber(filters, subnets, max_buffer=ACK_STREAM_BUFFER)
+        ack_feed = self.application.feeds["dhcpack"]
+        ack_feed.subscribe(self.subscriber)
+        heartbeat = datetime.timedelta(seconds=ACK_STREAM_HEARTBEAT)
+        try:
+            # Let the client know once acks will actually be delivered.
+            try:
+                yield ack_feed.active.wait(timeout=heartbeat)
+            except tornado.gen.TimeoutError:
+                pass
+            self.write(": connected\n\n")
+            yield self.flush()
+            while not self.closed:
+                try:
+                    yield self.subscriber.ready.wait(timeout=heartbeat)
+                except tornado.gen.TimeoutError:
+                    self.write(": keepalive\n\n")
+                    yield self.flush()
+                    continue
+                docs, dropped = self.subscriber.take()
+                chunk = []
+                if dropped:
+                    chunk.append("event: dropped\ndata: %d\n\n" % dropped)
+                for doc in docs:
+                    chunk.append("data: %s\n\n" % json.dumps(doc, default=json_serializer))
+                if chunk:
+                    self.write("".join(chunk))
+                    yield self.flush()
+        except tornado.iostream.StreamClosedError:
+            pass
+        finally:
+            ack_feed.unsubscribe(self.subscriber)
+
+    def on_connection_close(self):
+        self.closed = True
+        if self.subscriber is not None:
+            self.subscriber.ready.set()
 
 
 class DHCPServerStatsApiV1Handler(BaseHandler):
     """
     DHCP Server Stats API Handler - Log aggregated server stats.
+
+    GET arguments are the same as for DHCPAckApiV1Handler, filtering on
+    server_ip with from/to applying to timestamp_start.
+
+    Posted snapshots are also folded into per-minute/hour/day rollups, see
+    notouch.rollup and DHCPServerStatsRollupApiV1Handler.
     """
 
+    @tornado.gen.coroutine
     def get(self):
-        pass
+        yield self.get_range("dhcpserverstats", "timestamp_start", "timestamp_start",
+            SERVER_STATS_FILTERS)
 
     @tornado.gen.coroutine
     def post(self):
-        conn = yield self.application.conn
-        yield rethinkdb.table("dhcpserverstats").insert(rethinkdb.json(self.request.body)).run(
-            conn)
\ No newline at end of file
+        docs = yield self.load_documents("dhcpserverstats")
+        yield self.insert("dhcpserverstats", docs)
+        rollups = rollup.rollups(docs)
+        if rollups:
+            yield self.upsert(rollup.TABLE, rollups)
+
+
+class DHCPServerStatsRollupApiV1Handler(BaseHandler):
+    """
+    DHCP Server Stats Rollup API Handler - Per-server stats aggregated into
+        minute, hour or day buckets.
+
+    GET arguments:
+        resolution - minute, hour or day (required).
+        server_ip - Only return rollups for this server.
+        from, to - Only return buckets starting from <= bucket < to.
+        limit, order, cursor, stream - As for DHCPAckApiV1Handler.
+        clients - 1 to include the list of distinct clients in each minute
+            bucket, otherwise only client_count is returned.
+    """
+
+    @tornado.gen.coroutine
+    def get(self):
+        resolution = self.get_argument("resolution")
+        if resolution not in rollup.RESOLUTIONS:
+            raise tornado.web.HTTPError(400, "resolution must be one of %s.",
+                ", ".join(sorted(rollup.RESOLUTIONS)))
+        without = ["client_sketch"]
+        if self.get_argument("clients", "0") != "1":
+            without.append("clients")
+        yield self.get_range(rollup.TABLE, "bucket", "bucket", SERVER_STATS_FILTERS,
+            prefix=[resolution], without=without)
+
+
+class HostsApiV1Handler(BaseHandler):
+    """
+    Hosts API Handler - The latest lease of each client, see notouch.hosts.
+
+    GET arguments:
+        yiaddr, hostname, giaddr - Filter on one of these fields.
+        from, to - Only return hosts last seen from <= last_seen < to.
+        limit, order, cursor, stream - As for DHCPAckApiV1Handler.
+    """
+
+    @tornado.gen.coroutine
+    def get(self):
+        yield self.get_range(hosts.TABLE, "last_seen", "last_seen", HOST_FILTERS)
+
+
+class HostApiV1Handler(BaseHandler):
+    """
+    Host API Handler - The latest lease of the client with a MAC address.
+    """
+
+    @returnsJSON
+    @tornado.gen.coroutine
+    def get(self, mac):
+        host = yield self.application.storage.get(hosts.TABLE, mac.lower())
+        if host is None:
+            raise tornado.web.HTTPError(404, "No host with MAC address %s.", mac)
+        raise tornado.gen.Return(host)
@@ -0,0 +1,68 @@
+import tornado.concurrent
+import tornado.gen
+import tornado.ioloop
+
+
+class WriteBuffer(object):
+    """
+    Coalesce documents inserted into one table across requests.
+
+    Documents added by concurrent requests are merged into a single pending batch
+    which is written with one insert when it holds max_docs documents, or
+    max_delay seconds after the first document was added, whichever comes first.
+    The future returned by add resolves only once the insert containing those
+    documents has committed, so handlers can acknowledge the client safely.
+
+    A buffer belongs to an application and is only used from the IOLoop of the
+    worker process that owns it.
+    """
+    def __init__(self, application, table, max_docs=1000, max_delay=0.05,
+            durability="hard"):
+        self.application = application
+        self.table = table
+        self.max_docs = max_docs
+        self.max_delay = max_delay
+        self.durability = durability
+
+        self.docs = []
+        self.waiters = []
+        self.timeout = None
+
+    def add(self, docs):
+        """
+        Add a list of documents to the pending batch. Returns a Future resolved
+            when the batch is committed, or failed with the insert error.
+        """
+        future = tornado.concurrent.Future()
+        self.docs.extend(docs)
+        self.waiters.append(future)
+
+        if len(self.docs) >= self.max_docs:
+            self.flush()
+        elif self.timeout is None:
+            self.timeout = tornado.ioloop.IOLoop.current().call_later(
+                self.max_delay, self.flush)
+        return future
+
+    @tornado.gen.coroutine
+    def flush(self):
+        """
+        Write the pending batch now and resolve the futures waiting on it.
+        """
+        if self.timeout is not None:
+            tornado.ioloop.IOLoop.current().remove_timeout(self.timeout)
+            self.timeout = None
+
+        docs, waiters = self.docs, self.waiters
+        self.docs, self.waiters = [], []
+        if not waiters:
+            return
+
+        try:
+            yield self.application.storage.insert(self.table, docs, self.durability)
+        except Exception as e:
+            for waiter in waiters:
+                waiter.set_exception(e)
+        else:
+            for waiter in waiters:
+                waiter.set_result(None)
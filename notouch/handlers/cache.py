@@ -0,0 +1,180 @@
+import collections
+import hashlib
+import time
+
+
+class Invalidator(object):
+    """
+    Permanent ChangeFeed subscriber (see notouch.feed) invalidating cached
+        queries on a table as documents are written to it by any worker.
+    """
+    def __init__(self, cache, table):
+        self.cache = cache
+        self.table = table
+
+    def matches(self, doc):
+        return True
+
+    def put(self, doc):
+        self.cache.invalidate(self.table, [doc])
+
+
+class QueryCache(object):
+    """
+    Bounded LRU cache of serialized query responses with a TTL.
+
+    Entries are keyed on the request path and its normalized arguments, and
+    tagged with the table they read and the filter (field, value) they were
+    limited to, if any. Writing documents to a table invalidates its unfiltered
+    entries and the filtered entries whose value matches a written document.
+    Writes in this worker invalidate directly; writes in other workers arrive
+    through the table's changefeed. Until that feed is open the table's
+    queries bypass the cache. A write invalidated while a page is being read
+    may not be in it, so every invalidation also bumps the table's generation,
+    and a page read across a change of generation isn't cached (see put).
+    Entries can still be served stale until the feed delivers a write from
+    another worker, and the TTL bounds staleness from anything else, like rows
+    removed by retention.
+
+    The cache subscribes to the application's changefeed of each table it
+    caches (see notouch.feed), which then stays open for as long as the worker
+    runs. With rethinkdb each open feed holds a connection from the worker's
+    pool, up to one per table in notouch.util.TABLES, so pool_max_size has to
+    leave that many connections besides those used by queries and ack streams.
+
+    A cache belongs to an application and is only used from the IOLoop of the
+    worker process that owns it.
+    """
+    def __init__(self, application, max_entries=1024, ttl=5.0):
+        self.application = application
+        self.max_entries = max_entries
+        self.ttl = ttl
+
+        self.entries = collections.OrderedDict()
+        self.tags = {}
+        self.subscribed = set()
+        # Table -> number of invalidations so far.
+        self.generations = collections.Counter()
+
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.expirations = 0
+        self.invalidations = 0
+
+    @staticmethod
+    def key(request):
+        """
+        Cache key of a request: its path and sorted arguments.
+        """
+        arguments = tuple(sorted((name, tuple(values))
+            for name, values in request.query_arguments.items()))
+        return request.path, arguments
+
+    def enabled(self, table):
+        """
+        Whether queries on table can be cached, subscribing to its changefeed
+            the first time it is asked.
+        """
+        feed = self.application.feeds.get(table)
+        if self.max_entries <= 0 or feed is None:
+            return False
+        if table not in self.subscribed:
+            self.subscribed.add(table)
+            feed.subscribe(Invalidator(self, table))
+        return feed.active.is_set()
+
+    def get(self, key):
+        """
+        Return the cached (body, etag) for key, or None.
+        """
+        entry = self.entries.get(key)
+        if entry is None:
+            self.misses += 1
+            return None
+        expires, tag, body, etag = entry
+        if expires < time.time():
+            self.expirations += 1
+            self.misses += 1
+            self._remove(key)
+            return None
+        self.hits += 1
+        # Move to the most recently used end.
+        del self.entries[key]
+        self.entries[key] = entry
+        return body, etag
+
+    def generation(self, table):
+        """
+        The table's generation, to be passed to put along with a response read
+            after asking for it.
+        """
+        return self.generations[table]
+
+    def put(self, key, body, table, field=None, value=None, generation=None):
+        """
+        Cache a response body read from table, optionally filtered to rows with
+            field == value. Returns its ETag. Given the table's generation from
+            before the read, the body isn't cached if the table has been
+            invalidated since, as it may predate the write.
+        """
+        etag = '"%s"' % hashlib.sha1(body).hexdigest()
+        if generation is not None and generation != self.generations[table]:
+            return etag
+        if key in self.entries:
+            self._remove(key)
+        while len(self.entries) >= self.max_entries:
+            self._remove(next(iter(self.entries)))
+            self.evictions += 1
+        tag = (table, field, value)
+        self.entries[key] = (time.time() + self.ttl, tag, body, etag)
+        self.tags.setdefault(tag, set()).add(key)
+        return etag
+
+    def _remove(self, key):
+        _, tag, _, _ = self.entries.pop(key)
+        keys = self.tags[tag]
+        keys.discard(key)
+        if not keys:
+            del self.tags[tag]
+
+    def invalidate(self, table, docs):
+        """
+        Drop the entries on table that documents written to it may change.
+        """
+        self.generations[table] += 1
+        if not self.tags:
+            return
+        keys = set(self.tags.get((table, None, None), ()))
+        fields = set(field for tag_table, field, _ in self.tags
+            if tag_table == table and field is not None)
+        for field in fields:
+            values = set()
+            for doc in docs:
+                if field not in doc:
+                    # Filters on derived values (like options) can't be matched.
+                    values = None
+                    break
+                values.add(doc[field])
+            if values is None:
+                for tag, tag_keys in self.tags.items():
+                    if tag[0] == table and tag[1] == field:
+                        keys.update(tag_keys)
+            else:
+                for value in values:
+                    keys.update(self.tags.get((table, field, value), ()))
+        for key in keys:
+            self._remove(key)
+        self.invalidations += len(keys)
+
+    def stats(self):
+        return {
+            "entries": len(self.entries),
+            "max_entries": self.max_entries,
+            "ttl": self.ttl,
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+            "expirations": self.expirations,
+            "invalidations": self.invalidations,
+        }
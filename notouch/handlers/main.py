@@ -1,6 +1,7 @@
-import rethinkdb
 import tornado.gen
+import tornado.web
 
+from ..storage import StorageError
 from .util import BaseHandler, returnsJSON
 
 class MainHandler(BaseHandler):
@@ -8,5 +9,48 @@ class MainHandler(BaseHandler):
     @returnsJSON
     @tornado.gen.coroutine
     def get(self):
-        conn = yield self.application.conn
-        yield rethinkdb.db_list().run(conn)
\ No newline at end of file
+        try:
+            yield self.application.storage.ping()
+        except StorageError as e:
+            raise tornado.web.HTTPError(503, "%s", e)
+
+
+class MetricsHandler(BaseHandler):
+    """
+    Metrics of all workers in the Prometheus text format, see notouch.metrics.
+    """
+
+    def get(self):
+        self.set_header("Content-Type", "text/plain; version=0.0.4")
+        self.write(self.application.metrics.render())
+
+
+class PoolStatusHandler(BaseHandler):
+    """
+    Connection pool occupancy and checkout wait times for this worker, with
+        the rethinkdb backend.
+    """
+
+    @returnsJSON
+    def get(self):
+        pool = self.application.pool
+        if pool is None:
+            return {"enabled": False}
+        stats = pool.stats()
+        stats["enabled"] = True
+        return stats
+
+
+class CacheStatusHandler(BaseHandler):
+    """
+    Query cache size and hit, miss and eviction counts for this worker.
+    """
+
+    @returnsJSON
+    def get(self):
+        cache = self.application.query_cache
+        if cache is None:
+            return {"enabled": False}
+        stats = cache.stats()
+        stats["enabled"] = True
+        return stats
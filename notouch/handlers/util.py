@@ -1,8 +1,25 @@
+import tornado.gen
+import tornado.iostream
 import tornado.web
-import rethinkdb
 
+import functools
 import json
 
+from .. import codec
+from .. import ingest
+from .. import query
+from ..storage import WriteError
+
+# Content types for streamed responses, see BaseHandler.stream_query.
+STREAM_CONTENT_TYPES = {
+    "ndjson": "application/x-ndjson",
+    "json": "application/json",
+}
+# Rows fetched from the database per cursor batch while streaming.
+STREAM_BATCH_ROWS = 500
+# Bytes of serialized output buffered before each flush to the client.
+STREAM_CHUNK_SIZE = 64 * 1024
+
 
 def json_serializer(obj):
     """
@@ -22,28 +39,346 @@ def returnsJSON(func):
     * Takes return value and calls json.dump with a safe converter for objects
         like datetimes that won't serialize into json.
     * Calls "write" to return data to the client.
+
+    Works for both plain and coroutine handler methods.
     """
+    @functools.wraps(func)
+    @tornado.gen.coroutine
     def dec(self, *args, **kwargs):
-        ret = func(self, *args, **kwargs)
-        self.set_header("Content-Type", "application/json")
-        self.write(json.dumps(ret, default=json_serializer))
-        return None
+        ret = yield tornado.gen.maybe_future(func(self, *args, **kwargs))
+        self.write_json(ret)
     return dec
 
 
 class BaseHandler(tornado.web.RequestHandler):
     """
-    Base class for all handlers which creates a rethinkdb database connection
-    object per application object for multi-processs safety.
+    Base class for all handlers. Queries go through the application's storage
+    backend (see notouch.storage).
     """
-    def initialize(self):
+
+    def write_error(self, status_code, **kwargs):
+        """
+        Return errors as JSON, including the log message of an HTTPError.
+        """
+        message = self._reason
+        if "exc_info" in kwargs:
+            exception = kwargs["exc_info"][1]
+            if isinstance(exception, tornado.web.HTTPError) and exception.log_message:
+                message = exception.log_message % exception.args
+        self.set_header("Content-Type", "application/json")
+        self.finish(json.dumps({"status": status_code, "error": message}))
+
+    @tornado.gen.coroutine
+    def load_documents(self, table):
+        """
+        Decode the request body into a list of documents according to its
+            Content-Type and Content-Encoding (see notouch.codec), validated and
+            normalized for table in the application's ingest pool (see
+            notouch.ingest).
+        """
+        try:
+            docs = yield self.application.ingest.prepare(table, self.request.body,
+                self.request.headers.get("Content-Type"),
+                self.request.headers.get("Content-Encoding"))
+        except codec.UnsupportedMediaType as e:
+            raise tornado.web.HTTPError(415, "%s", e)
+        except codec.BodyTooLarge as e:
+            raise tornado.web.HTTPError(413, "%s", e)
+        except codec.DecodeError as e:
+            raise tornado.web.HTTPError(400, "%s", e)
+        raise tornado.gen.Return(docs)
+
+    @tornado.gen.coroutine
+    def insert(self, table, docs):
+        """
+        Insert documents into a table, through the application's write buffer
+            for that table when coalescing is enabled. Resolves once the
+            documents are committed.
+        """
         app = self.application
-        if app.conn is None:
-            host = app.rethinkdb_host
-            port = app.rethinkdb_port
-            db = app.rethinkdb_db
-            rethinkdb.set_loop_type("tornado")
-            app.conn = rethinkdb.connect(host=host, port=port, db=db)
+        app.metrics.inc("notouch_ingest_documents_total", {"table": table}, len(docs))
+        app.metrics.observe("notouch_ingest_body_bytes", {"table": table},
+            len(self.request.body))
+        try:
+            if table in app.write_buffers:
+                yield app.write_buffers[table].add(docs)
+            else:
+                yield app.storage.insert(table, docs, app.durability)
+        except WriteError as e:
+            raise tornado.web.HTTPError(500, "%s", e)
+        self.invalidate(table, docs)
+
+    @tornado.gen.coroutine
+    def upsert(self, table, docs):
+        """
+        Merge documents into a table (see notouch.storage.base.Storage.upsert)
+            and invalidate the cached queries they change.
+        """
+        try:
+            yield self.application.storage.upsert(table, docs, self.application.durability)
+        except WriteError as e:
+            raise tornado.web.HTTPError(500, "%s", e)
+        self.invalidate(table, docs)
+
+    def invalidate(self, table, docs):
+        """
+        Drop cached queries on table that documents written to it may change.
+        """
+        if self.application.query_cache is not None:
+            self.application.query_cache.invalidate(table, docs)
+
+    def get_filter(self, filters):
+        """
+        Return the (field, value) of the one field in filters given as an
+            argument, or (None, None) if there is none. MAC addresses are
+            lowercased, as they are stored (see notouch.ingest).
+        """
+        given = [field for field in filters if self.get_argument(field, None) is not None]
+        if len(given) > 1:
+            raise tornado.web.HTTPError(400, "Only one of %s may be given.", ", ".join(given))
+        if not given:
+            return None, None
+        field, value = given[0], self.get_argument(given[0])
+        if field in ingest.ACK_MAC_FIELDS:
+            value = value.lower()
+        return field, value
+
+    def get_range_args(self, time_index, filters, max_limit=query.MAX_LIMIT, prefix=None,
+            without=None):
+        """
+        Build the arguments of a range read (see notouch.storage.base.Storage.range)
+            from the request arguments and return them along with the row limit.
+
+        At most one of the fields in filters may be given as an argument, in which
+        case the "<field>_ts" index is used, otherwise time_index is read. The
+        from/to arguments bound the time range (see get_time_argument), and
+        cursor/limit/order control paging. With max_limit None the limit
+        argument is optional and unbounded, and the returned limit is None when
+        it isn't given.
+
+        prefix - Leading index values every row must match, ahead of the filter
+            value (e.g. the resolution of rollups).
+        without - Fields to leave out of the returned rows.
+        """
+        index = time_index
+        prefix = list(prefix or [])
+        field, value = self.get_filter(filters)
+        if field is not None:
+            index = "%s_ts" % field
+            prefix.append(value)
+
+        limit = self.get_argument("limit", query.DEFAULT_LIMIT if max_limit else None)
+        if limit is not None:
+            try:
+                limit = int(limit)
+            except ValueError:
+                raise tornado.web.HTTPError(400, "limit must be an integer.")
+            if limit < 1 or (max_limit and limit > max_limit):
+                raise tornado.web.HTTPError(400, "limit must be between 1 and %d.", max_limit)
+
+        order = self.get_argument("order", "asc")
+        if order not in ("asc", "desc"):
+            raise tornado.web.HTTPError(400, "order must be asc or desc.")
+
+        cursor = self.get_argument("cursor", None)
+        if cursor is not None:
+            try:
+                cursor = query.decode_cursor(cursor)
+            except ValueError as e:
+                raise tornado.web.HTTPError(400, "%s", e)
+
+        range_args = {
+            "index": index,
+            "prefix": prefix,
+            "start": self.get_time_argument("from"),
+            "end": self.get_time_argument("to"),
+            "cursor": cursor,
+            "limit": limit,
+            "descending": order == "desc",
+            "without": without,
+        }
+        return range_args, limit
+
+    def get_time_argument(self, name):
+        """
+        A timestamp argument, in any form ingest accepts (see
+            notouch.ingest.parse_time) or as epoch seconds, rewritten in the
+            form stored times compare in. None if it isn't given.
+        """
+        value = self.get_argument(name, None)
+        if value is None:
+            return None
+        try:
+            value = float(value)
+        except ValueError:
+            pass
+        try:
+            return ingest.parse_time(value)
+        except ValueError:
+            raise tornado.web.HTTPError(400, "%s is not a timestamp.", name)
+
+    @tornado.gen.coroutine
+    def query_page(self, table, time_field, time_index, filters, prefix=None, without=None):
+        """
+        Run a paginated range query from the request arguments and return a
+            page dict from query.page. See get_range_args for the arguments.
+        """
+        range_args, limit = self.get_range_args(time_index, filters, prefix=prefix,
+            without=without)
+        rows = yield self.application.storage.range(table, **range_args)
+        raise tornado.gen.Return(query.page(rows, time_field, limit))
+
+    @tornado.gen.coroutine
+    def get_range(self, table, time_field, time_index, filters, prefix=None, without=None):
+        """
+        Serve a GET of a range query. By default a single page is returned as
+            JSON; with a stream=ndjson|json argument the whole range (or up to
+            limit rows) is streamed instead. See get_range_args for the
+            remaining arguments.
+
+        Pages are served from the application's query cache when it is
+        enabled, see notouch.handlers.cache.
+        """
+        stream_format = self.get_argument("stream", None)
+        if stream_format is None:
+            cache = self.application.query_cache
+            if cache is None or not cache.enabled(table):
+                page = yield self.query_page(table, time_field, time_index, filters, prefix,
+                    without)
+                self.write_json(page)
+                return
+
+            key = cache.key(self.request)
+            cached = cache.get(key)
+            if cached is None:
+                generation = cache.generation(table)
+                page = yield self.query_page(table, time_field, time_index, filters, prefix,
+                    without)
+                body = json.dumps(page, default=json_serializer)
+                field, value = self.get_filter(filters)
+                etag = cache.put(key, body, table, field, value, generation)
+            else:
+                body, etag = cached
+            self.write_cached(body, etag)
+            return
+
+        if stream_format not in STREAM_CONTENT_TYPES:
+            raise tornado.web.HTTPError(400, "stream must be one of %s.",
+                ", ".join(sorted(STREAM_CONTENT_TYPES)))
+        range_args, _ = self.get_range_args(time_index, filters, max_limit=None,
+            prefix=prefix, without=without)
+        yield self.stream_query(table, range_args, stream_format)
+
+    def write_cached(self, body, etag):
+        """
+        Write a serialized JSON body with its ETag, or only a 304 if the client
+            already has it (If-None-Match).
+        """
+        self.set_header("Content-Type", "application/json")
+        self.set_header("Etag", etag)
+        if self.check_etag_header():
+            self.set_status(304)
+            return
+        self.write(body)
+
+    def write_json(self, obj):
+        """
+        Write obj as the JSON response body.
+        """
+        self.set_header("Content-Type", "application/json")
+        self.write(json.dumps(obj, default=json_serializer))
+
+    @tornado.gen.coroutine
+    def stream_query(self, table, range_args, stream_format="ndjson"):
+        """
+        Read a range (see get_range_args) and stream its rows to the client as
+            NDJSON (one document per line) or as a single JSON array.
+
+        Documents are read from the storage cursor in batches of at most
+        STREAM_BATCH_ROWS, serialized into chunks of about STREAM_CHUNK_SIZE bytes,
+        and each chunk is flushed to the client before more is read. Memory use
+        is bounded by one cursor batch plus one chunk regardless of the size of
+        the result, and the first bytes go out as soon as the first batch arrives.
+        """
+        self.set_header("Content-Type", STREAM_CONTENT_TYPES[stream_format])
+        separator = "\n" if stream_format == "ndjson" else ","
+        chunk = ["["] if stream_format == "json" else []
+        chunk_size = 0
+        count = 0
+
+        cursor = yield self.application.storage.stream(table, batch_rows=STREAM_BATCH_ROWS,
+            **range_args)
+        try:
+            while True:
+                docs = yield cursor.fetch()
+                if not docs:
+                    break
+                for doc in docs:
+                    doc = json.dumps(doc, default=json_serializer)
+                    if count and stream_format == "json":
+                        chunk.append(separator)
+                    chunk.append(doc)
+                    if stream_format == "ndjson":
+                        chunk.append(separator)
+                    chunk_size += len(doc) + 1
+                    count += 1
+                if chunk_size >= STREAM_CHUNK_SIZE:
+                    self.write("".join(chunk))
+                    chunk = []
+                    chunk_size = 0
+                    yield self.flush()
+            if stream_format == "json":
+                chunk.append("]")
+            self.write("".join(chunk))
+        except tornado.iostream.StreamClosedError:
+            # The client went away, stop reading from the database.
+            pass
+        finally:
+            cursor.close()
+
+    @tornado.gen.coroutine
+    def export_query(self, table, range_args, exporter):
+        """
+        Read a range (see get_range_args) and stream every row to the client
+            through an exporter (see notouch.export).
+
+        Like stream_query, memory is bounded by one cursor batch, and each batch
+        is flushed before the next is read. Between batches the handler also
+        gives way to the IOLoop, so a long export served from rows the driver
+        already holds doesn't delay other requests on the worker.
+        """
+        self.set_header("Content-Type", exporter.content_type)
+        self.set_header("Content-Disposition", "attachment; filename=%s.%s" % (
+            table, exporter.extension))
+
+        cursor = yield self.application.storage.stream(table, batch_rows=STREAM_BATCH_ROWS,
+            **range_args)
+        try:
+            self.write(exporter.start())
+            while True:
+                docs = yield cursor.fetch()
+                if not docs:
+                    break
+                self.write(exporter.encode(docs))
+                yield self.flush()
+                yield tornado.gen.moment
+            self.write(exporter.finish())
+        except tornado.iostream.StreamClosedError:
+            # The client went away, it resumes with a new export.
+            pass
+        finally:
+            cursor.close()
 
     def on_finish(self):
-        pass
\ No newline at end of file
+        """
+        Record the request in the application's metrics, see notouch.metrics.
+        """
+        app = self.application
+        labels = {
+            "route": app.routes.get(type(self), "unmatched"),
+            "method": self.request.method,
+        }
+        app.metrics.observe("notouch_http_request_duration_seconds", labels,
+            self.request.request_time())
+        labels["code"] = self.get_status()
+        app.metrics.inc("notouch_http_requests_total", labels)
\ No newline at end of file
@@ -0,0 +1,104 @@
+"""
+Latest lease per client, materialized from ingested acks.
+
+Every ack posted to the server is also folded into the hosts table, keyed on
+the client's chaddr, so "what is host X's current address" is a primary key
+lookup instead of an ordered scan of dhcpack. Host documents look like:
+
+{
+    "id": "00:00:00:00:00:00",
+    "chaddr": "00:00:00:00:00:00",
+    "yiaddr": "10.X.X.X",
+    "hostname": "<hostname>",
+    "domainname": "<domainname>",
+    "fname": "/<filename>",
+    "giaddr": "10.X.X.X",
+    "server_identifier": "10.X.X.X",
+    "first_seen": "2015-01-01 00:00:00.000000",
+    "last_seen": "2015-01-03 00:00:00.000000"
+}
+
+The lease fields always come from the newest ack seen for the client, even
+when acks arrive out of order. Options missing from that ack are "".
+"""
+import rethinkdb
+
+TABLE = "hosts"
+
+# Option number -> host field taken from the ack's options.
+OPTION_FIELDS = {
+    12: "hostname",
+    15: "domainname",
+    54: "server_identifier",
+}
+
+# Fields copied from the ack as they are.
+ACK_FIELDS = ["chaddr", "yiaddr", "fname", "giaddr"]
+
+
+def host(ack):
+    """
+    The host document for a single ack.
+    """
+    doc = dict((field, ack.get(field)) for field in ACK_FIELDS)
+    for field in OPTION_FIELDS.values():
+        doc[field] = ""
+    for option in reversed(ack.get("options") or []):
+        field = OPTION_FIELDS.get(option.get("op"))
+        if field is not None:
+            doc[field] = option.get("data")
+    doc["id"] = doc["chaddr"]
+    doc["first_seen"] = doc["last_seen"] = ack["ts"]
+    return doc
+
+
+def hosts(acks):
+    """
+    Reduce a batch of acks to one host document per client, built from the
+        newest ack and spanning the times of all of them.
+    """
+    docs = {}
+    for ack in acks:
+        if not ack.get("chaddr") or not isinstance(ack.get("ts"), basestring):
+            continue
+        doc = host(ack)
+        existing = docs.get(doc["id"])
+        if existing is None:
+            docs[doc["id"]] = doc
+            continue
+        first_seen = min(existing["first_seen"], doc["first_seen"])
+        if doc["last_seen"] >= existing["last_seen"]:
+            existing = docs[doc["id"]] = doc
+        existing["first_seen"] = first_seen
+    return docs.values()
+
+
+def merge_docs(existing, new):
+    """
+    Merge a host document from hosts() into the stored one.
+    """
+    first_seen = min(existing["first_seen"], new["first_seen"])
+    doc = dict(new if new["last_seen"] >= existing["last_seen"] else existing)
+    doc["first_seen"] = first_seen
+    return doc
+
+
+def merge(existing, new):
+    """
+    RQL merging a host document from hosts() into the stored one.
+    """
+    first_seen = rethinkdb.branch(new["first_seen"] < existing["first_seen"],
+        new["first_seen"], existing["first_seen"])
+    return rethinkdb.branch(new["last_seen"] >= existing["last_seen"],
+        new.merge({"first_seen": first_seen}),
+        existing.merge({"first_seen": first_seen}))
+
+
+def upsert(docs, durability="hard"):
+    """
+    Build a single query upserting host documents from hosts().
+    """
+    table = rethinkdb.table(TABLE)
+    return rethinkdb.expr(docs).for_each(lambda doc: table.get(doc["id"]).replace(
+        lambda existing: rethinkdb.branch(existing.eq(None), doc, merge(existing, doc)),
+        durability=durability))
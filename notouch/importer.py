@@ -0,0 +1,267 @@
+"""
+Bulk import of saved dhcpdump output and agent NDJSON dumps.
+
+notouch-import loads acks into storage directly, for backfilling a site from
+its saved captures rather than replaying them through the agent:
+
+> notouch-import --storage rethinkdb --rethinkdb_host localhost \
+        /var/log/dhcpdump/*.log.gz dumps/*.ndjson
+
+Each input file (optionally gzip compressed) is either dhcpdump text output,
+parsed with the agent's own parser (notouch.dhcpdump), or NDJSON with an ack,
+or a list of acks, per line.
+Files are cut into chunks of whole entries which are parsed and normalized
+(see notouch.ingest) by a pool of processes, while the main process writes the
+parsed acks in large batches with a bounded number of writes in flight.
+Parsing keeps every core busy and the writes keep the database busy, rather
+than one core doing both in turn as the agent does.
+
+Acks are folded into the hosts table as they are written, like acks posted to
+the server. Acks without an id are given one derived from their contents and
+written with replace, so importing the same file twice doesn't duplicate it.
+Documents that fail validation are counted and skipped.
+"""
+import argparse
+import collections
+import gzip
+import json
+import logging
+import time
+import uuid
+
+import tornado.gen
+import tornado.ioloop
+import tornado.locks
+
+from . import dhcpdump
+from . import hosts
+from . import ingest
+from .storage import RethinkDBStorage, SQLiteStorage, WriteError
+
+try:
+    from concurrent import futures
+except ImportError:
+    futures = None
+
+log = logging.getLogger("notouch.importer")
+
+# Namespace of the ids given to imported acks.
+ID_NAMESPACE = uuid.UUID("8d4fb5d9-6c4c-4f3a-9d1c-3c1bbf2a6e0e")
+
+
+def open_input(path):
+    if path.endswith(".gz"):
+        return gzip.open(path, "rb")
+    return open(path, "rb")
+
+
+def file_format(path):
+    """
+    "ndjson" if the first non-blank line of a file is JSON, else "dhcpdump".
+    """
+    with open_input(path) as input_file:
+        for line in input_file:
+            line = line.strip()
+            if line:
+                return "ndjson" if line[0] in "{[" else "dhcpdump"
+    return "dhcpdump"
+
+
+def read_chunks(path, input_format, chunk_lines):
+    """
+    Yield lists of at least chunk_lines lines of a file (fewer for the last),
+        cut only between dhcpdump entries.
+    """
+    chunk = []
+    with open_input(path) as input_file:
+        for line in input_file:
+            chunk.append(line)
+            if len(chunk) >= chunk_lines and (input_format == "ndjson" or
+                    line.strip() == dhcpdump.EntrySplitter.SEPARATOR):
+                yield chunk
+                chunk = []
+    if chunk:
+        yield chunk
+
+
+def ack_id(ack):
+    return str(uuid.uuid5(ID_NAMESPACE, json.dumps(ack, sort_keys=True)))
+
+
+def parse_chunk(input_format, lines):
+    """
+    Parse a chunk of a file into normalized acks. Returns the acks and the
+        number of documents that failed validation. Runs in an import process.
+    """
+    if input_format == "ndjson":
+        docs = []
+        for line in lines:
+            line = line.strip()
+            if not line:
+                continue
+            try:
+                doc = json.loads(line)
+            except ValueError:
+                docs.append(None)
+                continue
+            docs.extend(doc if isinstance(doc, list) else [doc])
+    else:
+        docs = []
+        for entry in dhcpdump.split_entries(lines):
+            try:
+                packet = dhcpdump.parse_entry(entry)
+            except (ValueError, IndexError):
+                # A truncated or corrupt entry.
+                docs.append(None)
+                continue
+            if packet.opname == "dhcpack":
+                docs.append(packet.to_dict())
+
+    acks = []
+    invalid = 0
+    for doc in docs:
+        try:
+            if not isinstance(doc, dict):
+                raise ValueError("not a document")
+            ack = ingest.normalize_ack(doc)
+        except ValueError:
+            invalid += 1
+            continue
+        if not ack.get("id"):
+            ack["id"] = ack_id(ack)
+        acks.append(ack)
+    return acks, invalid
+
+
+class Importer(object):
+    def __init__(self, storage, workers=4, chunk_lines=20000, batch_size=5000,
+            concurrency=4, durability="soft", progress_interval=10.0):
+        """
+        storage - Storage backend to write to, see notouch.storage.
+        workers - Processes parsing chunks.
+        chunk_lines - Lines of input per chunk handed to a process.
+        batch_size - Acks per write.
+        concurrency - Writes in flight at once.
+        durability - Durability of the writes, "hard" or "soft".
+        progress_interval - Seconds between progress reports.
+        """
+        if futures is None:
+            raise ValueError("notouch-import requires the futures package.")
+        self.storage = storage
+        self.workers = workers
+        self.chunk_lines = chunk_lines
+        self.batch_size = batch_size
+        self.concurrency = concurrency
+        self.durability = durability
+        self.progress_interval = progress_interval
+        self.writes = tornado.locks.Semaphore(concurrency)
+
+        self.started = None
+        self.reported = None
+        self.files = 0
+        self.parsed = 0
+        self.invalid = 0
+        self.written = 0
+        self.errors = []
+
+    @tornado.gen.coroutine
+    def run(self, paths):
+        """
+        Import every file in paths and wait for the last write.
+        """
+        self.started = self.reported = time.time()
+        executor = futures.ProcessPoolExecutor(self.workers)
+        # Chunks parsing ahead of the writes, so every process stays busy
+        # without reading whole files into memory.
+        parsing = collections.deque()
+        try:
+            for path in paths:
+                input_format = file_format(path)
+                for chunk in read_chunks(path, input_format, self.chunk_lines):
+                    parsing.append(executor.submit(parse_chunk, input_format, chunk))
+                    if len(parsing) >= 2 * self.workers:
+                        yield self.write_chunk(parsing.popleft())
+                self.files += 1
+            while parsing:
+                yield self.write_chunk(parsing.popleft())
+        finally:
+            executor.shutdown(wait=False)
+        # Wait for the writes still in flight.
+        for _ in range(self.concurrency):
+            yield self.writes.acquire()
+        self.report()
+
+    @tornado.gen.coroutine
+    def write_chunk(self, parse_future):
+        acks, invalid = yield parse_future
+        self.parsed += len(acks) + invalid
+        self.invalid += invalid
+        for i in range(0, len(acks), self.batch_size):
+            yield self.writes.acquire()
+            tornado.ioloop.IOLoop.current().spawn_callback(self.write,
+                acks[i:i + self.batch_size])
+        if time.time() - self.reported >= self.progress_interval:
+            self.report()
+
+    @tornado.gen.coroutine
+    def write(self, acks):
+        try:
+            yield self.storage.replace("dhcpack", acks, self.durability)
+            yield self.storage.upsert(hosts.TABLE, hosts.hosts(acks), self.durability)
+            self.written += len(acks)
+        except WriteError as e:
+            log.error("Failed to write %d acks: %s", len(acks), e)
+            self.errors.append(e)
+        finally:
+            self.writes.release()
+
+    def report(self):
+        self.reported = time.time()
+        elapsed = max(self.reported - self.started, 0.001)
+        log.info("%d files, %d acks parsed (%d invalid), %d written, %.0f acks/s.",
+            self.files, self.parsed, self.invalid, self.written, self.written / elapsed)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Import saved dhcpdump output and agent "
+        "NDJSON dumps into notouch.")
+    parser.add_argument("paths", metavar="FILE", nargs="+",
+        help="dhcpdump output or NDJSON file, optionally gzip compressed (.gz).")
+    parser.add_argument("--storage", dest="storage", type=str, default="rethinkdb",
+        choices=["rethinkdb", "sqlite"], help="Storage backend to import into.")
+    parser.add_argument("--rethinkdb_host", dest="rethinkdb_host", type=str,
+        default="localhost", help="Hostname for the rethinkdb server to use.")
+    parser.add_argument("--rethinkdb_port", dest="rethinkdb_port", type=int, default=28015,
+        help="Port that the rethinkdb server runs on.")
+    parser.add_argument("--rethinkdb_db", dest="rethinkdb_db", type=str, default="notouch",
+        help="Database to import into.")
+    parser.add_argument("--sqlite_path", dest="sqlite_path", type=str, default="notouch.db",
+        help="Database file of the sqlite backend.")
+    parser.add_argument("--workers", dest="workers", type=int, default=4,
+        help="Processes parsing input.")
+    parser.add_argument("--chunk_lines", dest="chunk_lines", type=int, default=20000,
+        help="Lines of input parsed per chunk.")
+    parser.add_argument("--batch_size", dest="batch_size", type=int, default=5000,
+        help="Acks written per batch.")
+    parser.add_argument("--concurrency", dest="concurrency", type=int, default=4,
+        help="Batches written at once.")
+    parser.add_argument("--durability", dest="durability", type=str, default="soft",
+        choices=["hard", "soft"], help="Write durability.")
+    parser.add_argument("--progress_interval", dest="progress_interval", type=float,
+        default=10.0, help="Seconds between progress reports.")
+
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.INFO, format="%(message)s")
+
+    if args.storage == "sqlite":
+        storage = SQLiteStorage(args.sqlite_path)
+    else:
+        storage = RethinkDBStorage(args.rethinkdb_host, args.rethinkdb_port,
+            args.rethinkdb_db, min_size=1, max_size=args.concurrency)
+    storage.create()
+    importer = Importer(storage, workers=args.workers, chunk_lines=args.chunk_lines,
+        batch_size=args.batch_size, concurrency=args.concurrency,
+        durability=args.durability, progress_interval=args.progress_interval)
+    tornado.ioloop.IOLoop.current().run_sync(lambda: importer.run(args.paths))
+    if importer.errors:
+        parser.exit(1, "%d batches failed to write.\n" % len(importer.errors))
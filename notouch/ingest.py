@@ -0,0 +1,298 @@
+"""
+Validation and normalization of ingested documents.
+
+Every posted body is decoded (see notouch.codec), checked against the schema of
+the table it is posted to and normalized before it is written:
+
+* MAC addresses are lowercased, so lookups don't depend on the agent.
+* Timestamps are parsed and rewritten as "YYYY-MM-DD HH:MM:SS.ffffff" UTC,
+    the form every time index and rollup compares as a string. Epoch seconds
+    and ISO 8601 ("T" separated, optionally ending in "Z") are accepted.
+* Options without data are dropped.
+* Handshake latency histograms in server stats are checked against the
+    buckets of notouch.latency.
+* The client sketch of server stats from agents run with --max_clients is
+    checked to be an encoded HyperLogLog (see notouch.sketch).
+
+Acks also get typed copies of fields that are strings on the wire, next to
+the originals, so they can be indexed and compared as numbers:
+
+* <field>_int - The IPv4 addresses yiaddr, giaddr, ciaddr and siaddr as
+    integers, or None if the field isn't a dotted quad. yiaddr_int backs the
+    subnet index (see notouch.util.SUBNET_BITS).
+* lease_time, renewal_time, rebinding_time - The lease time, T1 and T2
+    options (51, 58, 59), which dhcpdump prints like "3d12h", in seconds.
+
+Acks stored before these fields existed are given them by notouch-migrate.
+
+A batch with any invalid document is rejected as a whole, with the problems of
+its first few invalid documents in the error.
+
+Decoding and normalizing a large batch takes long enough to hold up every
+other request on a worker's IOLoop, so bodies larger than inline_bytes are
+handed to a pool of ingest processes instead (see IngestPool). The process pool
+requires concurrent.futures, part of the standard library on Python 3 and the
+futures package on Python 2.
+"""
+import datetime
+import numbers
+import os
+import re
+import socket
+import struct
+
+import tornado.gen
+
+from . import codec
+from . import latency
+from .sketch import HyperLogLog
+
+try:
+    from concurrent import futures
+except ImportError:
+    futures = None
+
+TIME_FORMAT = "%Y-%m-%d %H:%M:%S.%f"
+# Accepted timestamp formats, tried in order.
+TIME_FORMATS = [
+    "%Y-%m-%d %H:%M:%S.%f",
+    "%Y-%m-%d %H:%M:%S",
+    "%Y-%m-%dT%H:%M:%S.%f",
+    "%Y-%m-%dT%H:%M:%S",
+]
+
+# Batches with more documents than this are rejected outright.
+MAX_DOCUMENTS = 100000
+# Invalid documents described in the error of a rejected batch.
+MAX_ERRORS = 10
+
+ACK_MAC_FIELDS = ["chaddr", "mac_src", "mac_dst"]
+ACK_IP_FIELDS = ["yiaddr", "giaddr", "ciaddr", "siaddr"]
+# Option number -> ack field holding its duration in seconds.
+DURATION_OPTIONS = {
+    51: "lease_time",
+    58: "renewal_time",
+    59: "rebinding_time",
+}
+DURATION_UNITS = {"w": 7 * 86400, "d": 86400, "h": 3600, "m": 60, "s": 1}
+DURATION_RE = re.compile(r"^(?:\d+[wdhms])+$")
+COUNT_FIELDS = ["dhcpack_count", "dhcpdiscover_count", "dhcpoffer_count",
+    "dhcprequest_count", "client_count"]
+
+
+class ValidationError(codec.DecodeError):
+    """
+    The body decoded but holds documents that don't fit the table's schema.
+    """
+
+
+def parse_time(value):
+    """
+    Parse a timestamp string or epoch seconds into the canonical form, raising
+        ValueError if it isn't one.
+    """
+    if isinstance(value, numbers.Real) and not isinstance(value, bool):
+        try:
+            return datetime.datetime.utcfromtimestamp(value).strftime(TIME_FORMAT)
+        except (OverflowError, ValueError):
+            raise ValueError("out of range")
+    if not isinstance(value, basestring):
+        raise ValueError("not a timestamp")
+    value = value.strip()
+    if value.endswith("Z"):
+        value = value[:-1]
+    for time_format in TIME_FORMATS:
+        try:
+            return datetime.datetime.strptime(value, time_format).strftime(TIME_FORMAT)
+        except ValueError:
+            continue
+    raise ValueError("not a timestamp")
+
+
+def ip_to_int(address):
+    """
+    An IPv4 address in dotted quad form as an integer, or None.
+    """
+    if not isinstance(address, basestring) or address.count(".") != 3:
+        return None
+    try:
+        return struct.unpack("!I", socket.inet_aton(address))[0]
+    except (socket.error, UnicodeError):
+        return None
+
+
+def parse_duration(data):
+    """
+    A duration like "3d12h", or a number of seconds, in seconds, or None.
+    """
+    if isinstance(data, (int, long)) and not isinstance(data, bool):
+        return data
+    if not isinstance(data, basestring):
+        return None
+    data = data.strip().lower()
+    if data.isdigit():
+        return int(data)
+    if not DURATION_RE.match(data):
+        return None
+    return sum(int(number) * DURATION_UNITS[unit]
+        for number, unit in re.findall(r"(\d+)([wdhms])", data))
+
+
+def type_ack(ack):
+    """
+    Add the typed copies of an ack's fields, see the module docstring.
+    """
+    for field in ACK_IP_FIELDS:
+        ack[field + "_int"] = ip_to_int(ack.get(field))
+    for field in DURATION_OPTIONS.values():
+        ack[field] = None
+    for option in ack.get("options") or []:
+        field = DURATION_OPTIONS.get(option.get("op")) if isinstance(option, dict) else None
+        if field is not None:
+            ack[field] = parse_duration(option.get("data"))
+    return ack
+
+
+def require_string(doc, field):
+    value = doc.get(field)
+    if not isinstance(value, basestring) or not value:
+        raise ValueError("%s is required" % field)
+    return value
+
+
+def normalize_time(doc, field, required=True):
+    if field not in doc and not required:
+        return
+    if field not in doc:
+        raise ValueError("%s is required" % field)
+    try:
+        doc[field] = parse_time(doc[field])
+    except ValueError as e:
+        raise ValueError("%s is %s" % (field, e))
+
+
+def normalize_ack(ack):
+    require_string(ack, "chaddr")
+    for field in ACK_MAC_FIELDS:
+        if isinstance(ack.get(field), basestring):
+            ack[field] = ack[field].lower()
+    normalize_time(ack, "ts")
+    if "xid" in ack and not isinstance(ack["xid"], basestring):
+        raise ValueError("xid must be a string")
+
+    options = ack.get("options")
+    if options is None:
+        options = []
+    if not isinstance(options, list):
+        raise ValueError("options must be a list")
+    for option in options:
+        if not isinstance(option, dict) or not isinstance(option.get("op"), (int, long)):
+            raise ValueError("options must be objects with an integer op")
+    ack["options"] = [option for option in options
+        if option.get("data") is not None and option.get("data") != ""]
+    return type_ack(ack)
+
+
+def normalize_server_stats(stats):
+    require_string(stats, "server_ip")
+    normalize_time(stats, "timestamp_start")
+    normalize_time(stats, "timestamp_end", required=False)
+    for field in COUNT_FIELDS:
+        value = stats.get(field)
+        if value is not None and (not isinstance(value, (int, long)) or value < 0):
+            raise ValueError("%s must be a non-negative integer" % field)
+
+    clients = stats.get("clients")
+    if clients is not None:
+        if not isinstance(clients, dict):
+            raise ValueError("clients must be an object")
+        stats["clients"] = dict((mac.lower(), seen) for mac, seen in clients.items())
+    if "client_sketch" in stats:
+        try:
+            HyperLogLog.decode(stats["client_sketch"])
+        except ValueError:
+            raise ValueError("client_sketch must be an encoded HyperLogLog")
+    latency.normalize(stats)
+    return stats
+
+
+# Table -> function validating and normalizing one of its documents in place,
+# raising ValueError describing the first problem found.
+NORMALIZERS = {
+    "dhcpack": normalize_ack,
+    "dhcpserverstats": normalize_server_stats,
+}
+
+
+def normalize(table, docs):
+    """
+    Validate and normalize a batch of documents for table, raising
+        ValidationError if any of them is invalid.
+    """
+    if len(docs) > MAX_DOCUMENTS:
+        raise ValidationError("Batch of %d documents is larger than the maximum of %d." % (
+            len(docs), MAX_DOCUMENTS))
+    normalizer = NORMALIZERS.get(table)
+    if normalizer is None:
+        return docs
+
+    errors = []
+    for i, doc in enumerate(docs):
+        try:
+            normalizer(doc)
+        except ValueError as e:
+            errors.append("document %d: %s" % (i, e))
+            if len(errors) == MAX_ERRORS:
+                break
+    if errors:
+        raise ValidationError("Invalid documents, %s." % "; ".join(errors))
+    return docs
+
+
+def prepare(table, body, content_type=None, content_encoding=None):
+    """
+    Decode, validate and normalize an ingest body for table. Raises DecodeError
+        (or one of its subclasses, including ValidationError).
+    """
+    return normalize(table, codec.decode_documents(body, content_type, content_encoding))
+
+
+class IngestPool(object):
+    def __init__(self, workers=0, inline_bytes=64 * 1024):
+        """
+        workers - Ingest processes per server worker. 0 prepares every body
+            inline on the IOLoop.
+        inline_bytes - Bodies up to this size are prepared inline, where the
+            round trip to a process would cost more than it saves.
+        """
+        if workers > 0 and futures is None:
+            raise ValueError("Ingest workers require the futures package.")
+        self.workers = workers
+        self.inline_bytes = inline_bytes
+
+        self.pid = None
+        self.executor = None
+        self.inline = 0
+        self.offloaded = 0
+
+    def _ensure_started(self):
+        if self.pid == os.getpid():
+            return
+        # Created per worker on first use, an executor doesn't survive fork.
+        self.pid = os.getpid()
+        self.executor = futures.ProcessPoolExecutor(self.workers)
+
+    @tornado.gen.coroutine
+    def prepare(self, table, body, content_type=None, content_encoding=None):
+        """
+        Prepare a body (see notouch.ingest.prepare) and return its documents,
+            in an ingest process if it is large.
+        """
+        if self.workers <= 0 or len(body) <= self.inline_bytes:
+            self.inline += 1
+            raise tornado.gen.Return(prepare(table, body, content_type, content_encoding))
+        self._ensure_started()
+        self.offloaded += 1
+        docs = yield self.executor.submit(prepare, table, body, content_type,
+            content_encoding)
+        raise tornado.gen.Return(docs)
@@ -0,0 +1,96 @@
+"""
+DHCP handshake latency histograms, as reported in server_stats.
+
+Agents time each phase of the DISCOVER/OFFER/REQUEST/ACK handshakes they see
+(see scripts/dhcp_handshake.py) and report, per interval:
+
+{
+    "latency": {"offer": [...], "request": [...], "ack": [...], "handshake": [...]},
+    "relay_latency": {"10.X.X.X": [...], ...},
+    "handshakes_failed": {"no_offer": 0, "no_request": 2, "no_ack": 0, "nak": 1}
+}
+
+Each histogram counts the latencies up to each of LATENCY_BUCKETS_MS in turn,
+with a last count for those above it. Histograms add up bucket by bucket, so
+rollups (see notouch.rollup) sum them the same way they sum message counts,
+and a slow relay or an overloaded server shows up in the buckets of its row.
+"""
+LATENCY_BUCKETS_MS = [1, 2, 5, 10, 20, 50, 100, 200, 500, 1000, 2000, 5000, 10000, 30000]
+PHASES = ["offer", "request", "ack", "handshake"]
+FAILURES = ["no_offer", "no_request", "no_ack", "nak"]
+HISTOGRAM_SIZE = len(LATENCY_BUCKETS_MS) + 1
+
+
+def empty_histogram():
+    return [0] * HISTOGRAM_SIZE
+
+
+def is_count(value):
+    return isinstance(value, (int, long)) and not isinstance(value, bool) and value >= 0
+
+
+def check_histogram(name, histogram):
+    if (not isinstance(histogram, list) or len(histogram) != HISTOGRAM_SIZE or
+            not all(is_count(count) for count in histogram)):
+        raise ValueError("%s must be a list of %d non-negative integers" % (
+            name, HISTOGRAM_SIZE))
+
+
+def normalize(stats):
+    """
+    Validate the latency fields of a server_stats snapshot, if it has any,
+        filling in missing phases and failures. Raises ValueError.
+    """
+    if "latency" not in stats:
+        return
+    latency = stats["latency"]
+    if not isinstance(latency, dict):
+        raise ValueError("latency must be an object")
+    for phase in PHASES:
+        latency.setdefault(phase, empty_histogram())
+        check_histogram("latency.%s" % phase, latency[phase])
+
+    relays = stats.setdefault("relay_latency", {})
+    if not isinstance(relays, dict):
+        raise ValueError("relay_latency must be an object")
+    for relay, histogram in relays.items():
+        check_histogram("relay_latency.%s" % relay, histogram)
+
+    failures = stats.setdefault("handshakes_failed", {})
+    if not isinstance(failures, dict):
+        raise ValueError("handshakes_failed must be an object")
+    for failure in FAILURES:
+        failures.setdefault(failure, 0)
+        if not is_count(failures[failure]):
+            raise ValueError("handshakes_failed.%s must be a non-negative integer" % failure)
+
+
+def empty():
+    """
+    The latency fields of a rollup that hasn't seen any.
+    """
+    return {
+        "latency": dict((phase, empty_histogram()) for phase in PHASES),
+        "relay_latency": {},
+        "handshakes_failed": dict((failure, 0) for failure in FAILURES),
+    }
+
+
+def add_histograms(a, b):
+    return [x + y for x, y in zip(a, b)]
+
+
+def add(doc, stats):
+    """
+    Add the latency fields of stats (a snapshot or rollup) into those of doc.
+    """
+    if "latency" not in stats:
+        return
+    for phase in PHASES:
+        doc["latency"][phase] = add_histograms(doc["latency"][phase], stats["latency"][phase])
+    for relay, histogram in stats["relay_latency"].items():
+        doc["relay_latency"][relay] = add_histograms(
+            doc["relay_latency"].get(relay, empty_histogram()), histogram)
+    for failure in FAILURES:
+        doc["handshakes_failed"][failure] += stats["handshakes_failed"][failure]
+
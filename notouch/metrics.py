@@ -0,0 +1,190 @@
+"""
+Request, database and ingest metrics in the Prometheus text format.
+
+Each worker records into its own Metrics registry. Tornado forks the workers,
+so to report on the whole server every worker periodically writes a snapshot
+of its registry to <metrics_dir>/<pid>.json, and /metrics merges the
+snapshots of all live workers (its own taken fresh) before rendering them.
+Without a metrics_dir, as in an unforked server, only the local registry is
+reported.
+
+Counters and histograms only, with latencies in seconds and sizes in bytes:
+
+    notouch_http_requests_total{route, method, code}
+    notouch_http_request_duration_seconds{route, method}
+    notouch_db_query_duration_seconds{query}
+        query is the storage operation (insert, upsert, replace, get, delete,
+        range, stream, changes or ping), named alike by every backend.
+    notouch_ingest_documents_total{table}
+    notouch_ingest_body_bytes{table}
+"""
+import tornado.ioloop
+
+import errno
+import json
+import logging
+import os
+
+log = logging.getLogger(__name__)
+
+LATENCY_BUCKETS = [0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0]
+SIZE_BUCKETS = [256, 1024, 4096, 16384, 65536, 262144, 1048576, 4194304, 16777216]
+
+# name -> (type, help, histogram buckets)
+METRICS = {
+    "notouch_http_requests_total": ("counter", "HTTP requests served.", None),
+    "notouch_http_request_duration_seconds": ("histogram",
+        "Time from receiving an HTTP request to finishing the response.", LATENCY_BUCKETS),
+    "notouch_db_query_duration_seconds": ("histogram",
+        "Round trip time of database queries.", LATENCY_BUCKETS),
+    "notouch_ingest_documents_total": ("counter", "Documents ingested.", None),
+    "notouch_ingest_body_bytes": ("histogram",
+        "Size of ingest request bodies as received.", SIZE_BUCKETS),
+}
+
+
+def labels_key(labels):
+    return tuple(sorted(labels.items()))
+
+
+class Metrics(object):
+    def __init__(self, metrics_dir=None, dump_interval=5.0):
+        """
+        metrics_dir - Directory shared by all workers for their snapshots.
+        dump_interval - Seconds between snapshots of this worker's metrics.
+        """
+        self.metrics_dir = metrics_dir
+        self.dump_interval = dump_interval
+        self.pid = None
+        self.dumper = None
+        self._reset()
+
+    def _reset(self):
+        # name -> labels key -> value (counters) or [bucket counts..., +Inf, sum]
+        # (histograms).
+        self.values = dict((name, {}) for name in METRICS)
+
+    def _ensure_started(self):
+        if self.pid == os.getpid():
+            return
+        # First use in this process, drop anything inherited through fork.
+        self.pid = os.getpid()
+        self._reset()
+        if self.metrics_dir is not None:
+            self.dumper = tornado.ioloop.PeriodicCallback(self.dump, self.dump_interval * 1000)
+            self.dumper.start()
+
+    def inc(self, name, labels, value=1):
+        self._ensure_started()
+        key = labels_key(labels)
+        values = self.values[name]
+        values[key] = values.get(key, 0) + value
+
+    def observe(self, name, labels, value):
+        self._ensure_started()
+        key = labels_key(labels)
+        values = self.values[name]
+        buckets = METRICS[name][2]
+        histogram = values.get(key)
+        if histogram is None:
+            histogram = values[key] = [0] * (len(buckets) + 2)
+        for i, bound in enumerate(buckets):
+            if value <= bound:
+                histogram[i] += 1
+                break
+        else:
+            histogram[len(buckets)] += 1
+        histogram[-1] += value
+
+    def snapshot(self):
+        return dict((name, [[list(key), value] for key, value in values.items()])
+            for name, values in self.values.items())
+
+    def dump(self):
+        """
+        Write this worker's snapshot for the other workers to read.
+        """
+        path = os.path.join(self.metrics_dir, "%d.json" % os.getpid())
+        try:
+            with open(path + ".tmp", "w") as snapshot_file:
+                json.dump(self.snapshot(), snapshot_file)
+            os.rename(path + ".tmp", path)
+        except (IOError, OSError) as e:
+            log.warning("Couldn't write metrics snapshot %s: %s", path, e)
+
+    def snapshots(self):
+        """
+        Snapshots of every live worker, this one's taken now.
+        """
+        self._ensure_started()
+        snapshots = [self.snapshot()]
+        if self.metrics_dir is None:
+            return snapshots
+        for name in os.listdir(self.metrics_dir):
+            if not name.endswith(".json") or name == "%d.json" % self.pid:
+                continue
+            try:
+                os.kill(int(name[:-len(".json")]), 0)
+            except ValueError:
+                continue
+            except OSError as e:
+                if e.errno == errno.ESRCH:
+                    # The worker is gone (tornado restarts dead workers).
+                    continue
+            try:
+                with open(os.path.join(self.metrics_dir, name)) as snapshot_file:
+                    snapshots.append(json.load(snapshot_file))
+            except (IOError, ValueError):
+                continue
+        return snapshots
+
+    def render(self):
+        """
+        Render the metrics of all workers in the Prometheus text format.
+        """
+        merged = dict((name, {}) for name in METRICS)
+        for snapshot in self.snapshots():
+            for name, values in snapshot.items():
+                if name not in merged:
+                    continue
+                for key, value in values:
+                    key = tuple(tuple(label) for label in key)
+                    if isinstance(value, list):
+                        total = merged[name].setdefault(key, [0] * len(value))
+                        for i, count in enumerate(value):
+                            total[i] += count
+                    else:
+                        merged[name][key] = merged[name].get(key, 0) + value
+
+        lines = []
+        for name in sorted(METRICS):
+            metric_type, help_text, buckets = METRICS[name]
+            lines.append("# HELP %s %s" % (name, help_text))
+            lines.append("# TYPE %s %s" % (name, metric_type))
+            for key, value in sorted(merged[name].items()):
+                if metric_type == "counter":
+                    lines.append("%s%s %s" % (name, format_labels(key), format_value(value)))
+                    continue
+                cumulative = 0
+                for bound, count in zip(buckets + ["+Inf"], value[:-1]):
+                    cumulative += count
+                    lines.append("%s_bucket%s %d" % (name,
+                        format_labels(key + (("le", format_value(bound)),)), cumulative))
+                lines.append("%s_sum%s %s" % (name, format_labels(key), format_value(value[-1])))
+                lines.append("%s_count%s %d" % (name, format_labels(key), cumulative))
+        return "\n".join(lines) + "\n"
+
+
+def format_value(value):
+    if isinstance(value, basestring):
+        return value
+    if isinstance(value, float):
+        return repr(value)
+    return str(value)
+
+
+def format_labels(key):
+    if not key:
+        return ""
+    return "{%s}" % ",".join('%s="%s"' % (label, unicode(value).replace("\\", "\\\\")
+        .replace("\"", "\\\"").replace("\n", "\\n")) for label, value in key)
@@ -0,0 +1,112 @@
+"""
+Backfill of fields added to the document schema.
+
+Documents ingested before a field was added to a table's schema (see
+notouch.ingest) don't have it, so they are missing from the indexes built on
+it. notouch-migrate creates any missing tables and indexes, then walks each
+table in MIGRATIONS along its [time, id] index, batch_size rows at a time,
+and rewrites the documents that need it. Documents that are already current
+are left alone, so the migration can be interrupted and run again.
+
+Writes are rate limited to max_rate documents per second so that it can run
+next to a live server. Rewritten documents go through the tables' changefeeds
+like any other write.
+
+> notouch-migrate --storage rethinkdb --rethinkdb_host localhost --rethinkdb_db notouch
+"""
+import argparse
+import logging
+
+import tornado.gen
+import tornado.ioloop
+
+from . import ingest
+from .storage import RethinkDBStorage, SQLiteStorage
+
+log = logging.getLogger("notouch.migrate")
+
+
+def migrate_ack(ack):
+    """
+    The ack with the typed fields of notouch.ingest.type_ack, or None if it
+        already has them.
+    """
+    migrated = ingest.type_ack(dict(ack))
+    if migrated == ack:
+        return None
+    return migrated
+
+
+# Table -> the [time, id] index and time field to walk it by, and a function
+# returning the migrated version of a document, or None if it is current.
+MIGRATIONS = {
+    "dhcpack": {"index": "ts", "time_field": "ts", "migrate": migrate_ack},
+}
+
+
+@tornado.gen.coroutine
+def migrate(storage, table, config, batch_size=500, max_rate=2000):
+    """
+    Migrate the documents of one table, returning how many were read and how
+        many rewritten.
+    """
+    cursor = None
+    scanned = migrated = 0
+    while True:
+        rows = yield storage.range(table, config["index"], cursor=cursor, limit=batch_size)
+        if not rows:
+            break
+        docs = [doc for doc in (config["migrate"](row) for row in rows) if doc is not None]
+        yield storage.replace(table, docs, durability="soft")
+        scanned += len(rows)
+        migrated += len(docs)
+        cursor = [rows[-1][config["time_field"]], rows[-1]["id"]]
+
+        if len(rows) < batch_size:
+            break
+        if max_rate and docs:
+            yield tornado.gen.sleep(float(len(docs)) / max_rate)
+    raise tornado.gen.Return((scanned, migrated))
+
+
+@tornado.gen.coroutine
+def migrate_all(storage, tables, batch_size, max_rate):
+    for table in tables:
+        scanned, migrated = yield migrate(storage, table, MIGRATIONS[table], batch_size,
+            max_rate)
+        log.info("Migrated %d of %d documents in %s.", migrated, scanned, table)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Migrate stored notouch documents to the "
+        "current schema.")
+    parser.add_argument("--storage", dest="storage", type=str, default="rethinkdb",
+        choices=["rethinkdb", "sqlite"], help="Storage backend to migrate.")
+    parser.add_argument("--rethinkdb_host", dest="rethinkdb_host", type=str,
+        default="localhost", help="Hostname for the rethinkdb server to use.")
+    parser.add_argument("--rethinkdb_port", dest="rethinkdb_port", type=int, default=28015,
+        help="Port that the rethinkdb server runs on.")
+    parser.add_argument("--rethinkdb_db", dest="rethinkdb_db", type=str, default="notouch",
+        help="Database to migrate.")
+    parser.add_argument("--sqlite_path", dest="sqlite_path", type=str, default="notouch.db",
+        help="Database file of the sqlite backend.")
+    parser.add_argument("--table", dest="tables", action="append",
+        choices=sorted(MIGRATIONS), help="Table to migrate, may be repeated. Defaults to "
+            "all of them.")
+    parser.add_argument("--batch_size", dest="batch_size", type=int, default=500,
+        help="Documents read and rewritten per batch.")
+    parser.add_argument("--rate", dest="rate", type=int, default=2000,
+        help="Maximum documents rewritten per second, 0 for no limit.")
+
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.INFO, format="%(message)s")
+
+    if args.storage == "sqlite":
+        storage = SQLiteStorage(args.sqlite_path)
+    else:
+        storage = RethinkDBStorage(args.rethinkdb_host, args.rethinkdb_port,
+            args.rethinkdb_db, min_size=1, max_size=1)
+    storage.create()
+    tables = args.tables or sorted(MIGRATIONS)
+    tornado.ioloop.IOLoop.current().run_sync(lambda: migrate_all(storage, tables,
+        args.batch_size, args.rate))
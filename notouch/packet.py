@@ -0,0 +1,58 @@
+"""
+Compact record for a captured DHCP packet.
+
+Both the dhcpdump text parser (notouch.dhcpdump.parse_entry) and the agent's
+native decoder (scripts/dhcp_pcap.py) produce Packet records. A record uses __slots__ and
+keeps options as (op, name, data) tuples, so busy agents hold far less per
+packet than the equivalent dicts. Packets are turned into the JSON document
+schema with to_dict only when a batch is sent.
+"""
+
+
+class Packet(object):
+    __slots__ = (
+        "ts", "ip_src", "mac_src", "ip_dst", "mac_dst", "op", "opname", "htype", "hlen",
+        "hops", "xid", "secs", "flags", "ciaddr", "yiaddr", "siaddr", "giaddr", "chaddr",
+        "sname", "fname", "options",
+    )
+
+    def __init__(self):
+        self.ts = ""
+        self.ip_src = ""
+        self.mac_src = ""
+        self.ip_dst = ""
+        self.mac_dst = ""
+        self.op = -1
+        self.opname = ""
+        self.htype = -1
+        self.hlen = -1
+        self.hops = -1
+        self.xid = ""
+        self.secs = -1
+        self.flags = ""
+        self.ciaddr = ""
+        self.yiaddr = ""
+        self.siaddr = ""
+        self.giaddr = ""
+        self.chaddr = ""
+        self.sname = ""
+        self.fname = ""
+        self.options = []
+
+    def option(self, op, default=None):
+        """
+        Return the data of the first option with the given number.
+        """
+        for option_op, _, data in self.options:
+            if option_op == op:
+                return data
+        return default
+
+    def to_dict(self):
+        """
+        Convert to the JSON document form sent to the notouch server.
+        """
+        doc = dict((field, getattr(self, field)) for field in self.__slots__)
+        doc["options"] = [{"op": op, "name": name, "data": data}
+            for op, name, data in self.options]
+        return doc
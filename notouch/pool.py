@@ -0,0 +1,314 @@
+"""
+Asynchronous rethinkdb connection pool for tornado.
+
+Each worker process keeps between min_size and max_size open connections.
+Handlers check a connection out for the duration of a query instead of sharing
+one socket, so a slow query only ties up its own connection. Idle connections
+are pinged periodically, dead ones are replaced, and new connections are
+opened with exponential backoff while the database is unreachable.
+
+The pool is created with the Application before tornado forks its workers, so
+it opens no sockets and touches no IOLoop until it is first used in a worker.
+If it finds itself in a different process than the one that started it, all
+inherited state is discarded.
+"""
+import rethinkdb
+import rethinkdb.net_tornado as net_tornado
+import tornado.concurrent
+import tornado.gen
+import tornado.ioloop
+
+import collections
+import datetime
+import logging
+import os
+import time
+
+log = logging.getLogger(__name__)
+
+
+class PoolTimeout(Exception):
+    """
+    Raised when no connection could be checked out within the checkout timeout.
+    """
+
+
+class ConnectionPool(object):
+    def __init__(self, host="localhost", port=28015, db="notouch", min_size=2, max_size=10,
+            checkout_timeout=5.0, health_check_interval=30.0, connect_timeout=5.0,
+            max_backoff=5.0, metrics=None):
+        """
+        host, port, db - rethinkdb server and default database.
+        min_size - Connections opened at warm up and kept open while idle.
+        max_size - Maximum number of connections open at once.
+        checkout_timeout - Default seconds to wait for a free connection.
+        health_check_interval - Seconds between pings of idle connections.
+        connect_timeout - Seconds to wait for a single connection attempt.
+        max_backoff - Maximum seconds to sleep between reconnect attempts.
+        metrics - notouch.metrics.Metrics recording query round trip times.
+        """
+        self.host = host
+        self.port = port
+        self.db = db
+        self.min_size = min_size
+        self.max_size = max_size
+        self.checkout_timeout = checkout_timeout
+        self.health_check_interval = health_check_interval
+        self.connect_timeout = connect_timeout
+        self.max_backoff = max_backoff
+        self.metrics = metrics
+
+        self.pid = None
+        self._reset()
+
+    def _reset(self):
+        self.idle = collections.deque()
+        self.waiters = collections.deque()
+        self.size = 0
+        self.in_use = 0
+        self.health_check = None
+
+        self.checkouts = 0
+        self.checkout_timeouts = 0
+        self.wait_time_total = 0.0
+        self.wait_time_max = 0.0
+        self.connects = 0
+        self.connect_failures = 0
+        self.discarded = 0
+
+    def _ensure_started(self):
+        if self.pid == os.getpid():
+            return
+        # First use in this process, drop anything inherited through fork.
+        self._reset()
+        self.pid = os.getpid()
+        self.health_check = tornado.ioloop.PeriodicCallback(
+            self._check_idle, self.health_check_interval * 1000)
+        self.health_check.start()
+
+    @tornado.gen.coroutine
+    def warm(self):
+        """
+        Open connections until the pool holds min_size of them.
+        """
+        self._ensure_started()
+        opening = []
+        while self.size < self.min_size:
+            self.size += 1
+            opening.append(self._open())
+        for future in opening:
+            try:
+                conn = yield future
+            except Exception:
+                log.exception("Unable to warm rethinkdb connection pool.")
+            else:
+                self._put(conn)
+
+    def _connect(self):
+        # Build tornado connections directly rather than through
+        # rethinkdb.set_loop_type, which would switch every other rethinkdb
+        # connection in the process (e.g. notouch.util's) to tornado as well.
+        conn = net_tornado.Connection(self.host, self.port, self.db, "", self.connect_timeout,
+            {})
+        return conn.reconnect(timeout=self.connect_timeout)
+
+    @tornado.gen.coroutine
+    def _open(self, deadline=None):
+        """
+        Open a new connection for a slot already counted in self.size, retrying
+            with exponential backoff until deadline. The slot is released if no
+            connection could be made.
+        """
+        backoff = 0.1
+        while True:
+            try:
+                conn = yield self._connect()
+            except rethinkdb.ReqlDriverError:
+                self.connect_failures += 1
+                if deadline is None or time.time() + backoff > deadline:
+                    self.size -= 1
+                    self._wake()
+                    raise
+                log.warning("rethinkdb connect to %s:%s failed, retrying in %.1fs.",
+                    self.host, self.port, backoff)
+                yield tornado.gen.sleep(backoff)
+                backoff = min(backoff * 2, self.max_backoff)
+            else:
+                self.connects += 1
+                raise tornado.gen.Return(conn)
+
+    def _put(self, conn):
+        """
+        Hand a connection to the oldest live waiter, or park it as idle.
+        """
+        while self.waiters:
+            waiter = self.waiters.popleft()
+            if not waiter.done():
+                self.in_use += 1
+                waiter.set_result(conn)
+                return
+        self.idle.append((conn, time.time()))
+
+    def _wake(self):
+        """
+        Let the oldest waiter retry after a slot has been freed.
+        """
+        while self.waiters:
+            waiter = self.waiters.popleft()
+            if not waiter.done():
+                waiter.set_result(None)
+                return
+
+    def _discard(self, conn):
+        self.size -= 1
+        self.discarded += 1
+        if conn.is_open():
+            conn.close(noreply_wait=False)
+        self._wake()
+
+    @tornado.gen.coroutine
+    def acquire(self, timeout=None):
+        """
+        Check out a connection, waiting at most timeout seconds (defaulting to
+            checkout_timeout). Raises PoolTimeout if none became available.
+        """
+        self._ensure_started()
+        start = time.time()
+        deadline = start + (self.checkout_timeout if timeout is None else timeout)
+
+        conn = None
+        while conn is None:
+            if self.idle:
+                conn, _ = self.idle.pop()
+                if not conn.is_open():
+                    self._discard(conn)
+                    conn = None
+                    continue
+                self.in_use += 1
+            elif self.size < self.max_size:
+                self.size += 1
+                conn = yield self._open(deadline)
+                self.in_use += 1
+            else:
+                waiter = tornado.concurrent.Future()
+                self.waiters.append(waiter)
+                try:
+                    conn = yield tornado.gen.with_timeout(deadline, waiter)
+                except tornado.gen.TimeoutError:
+                    if not waiter.done():
+                        # Finished waiters are skipped when the queue is drained.
+                        waiter.set_result(None)
+                    elif waiter.result() is not None:
+                        # A connection was handed over as the timeout fired.
+                        self.release(waiter.result())
+                    else:
+                        self._wake()
+                    self.checkout_timeouts += 1
+                    raise PoolTimeout("No rethinkdb connection available after %.1fs." %
+                        (time.time() - start))
+
+        wait = time.time() - start
+        self.checkouts += 1
+        self.wait_time_total += wait
+        self.wait_time_max = max(self.wait_time_max, wait)
+        raise tornado.gen.Return(conn)
+
+    def release(self, conn, discard=False):
+        """
+        Return a checked out connection. Closed connections, or any connection
+            when discard is set, are closed and their slot freed.
+        """
+        self.in_use -= 1
+        if discard or not conn.is_open():
+            self._discard(conn)
+        else:
+            self._put(conn)
+
+    @tornado.gen.coroutine
+    def run(self, operation, query, timeout=None, retry=True, **kwargs):
+        """
+        Run a query on a pooled connection and return its result. Queries
+            returning cursors should use acquire/release instead, since the
+            connection must stay checked out while the cursor is read.
+
+        operation - The storage operation the query is for, see timed.
+
+        If the connection turns out to be broken the query is retried once on a
+        fresh connection, unless retry is False (e.g. for non-idempotent writes).
+        """
+        attempts = 2 if retry else 1
+        for attempt in range(attempts):
+            conn = yield self.acquire(timeout)
+            try:
+                result = yield self.timed(operation, query.run(conn, **kwargs))
+            except rethinkdb.ReqlDriverError:
+                self.release(conn, discard=True)
+                if attempt == attempts - 1:
+                    raise
+            except Exception:
+                self.release(conn)
+                raise
+            else:
+                self.release(conn)
+                raise tornado.gen.Return(result)
+
+    @tornado.gen.coroutine
+    def timed(self, operation, future):
+        """
+        Wait for the result of a query, recording the round trip labelled with
+            the storage operation it was for ("insert", "range", ...), which
+            every backend labels its queries with alike.
+        """
+        start = time.time()
+        try:
+            result = yield future
+        finally:
+            if self.metrics is not None:
+                self.metrics.observe("notouch_db_query_duration_seconds",
+                    {"query": operation}, time.time() - start)
+        raise tornado.gen.Return(result)
+
+    @tornado.gen.coroutine
+    def _check_idle(self):
+        """
+        Ping connections idle for longer than the health check interval, drop
+            the ones that fail, and top the pool back up to min_size.
+        """
+        now = time.time()
+        for _ in range(len(self.idle)):
+            conn, last_used = self.idle.popleft()
+            if now - last_used < self.health_check_interval:
+                self.idle.append((conn, last_used))
+                continue
+            self.in_use += 1
+            try:
+                yield tornado.gen.with_timeout(datetime.timedelta(seconds=self.connect_timeout),
+                    rethinkdb.expr(1).run(conn))
+            except Exception:
+                log.warning("Dropping unhealthy rethinkdb connection.")
+                self.release(conn, discard=True)
+            else:
+                self.release(conn)
+        if self.size < self.min_size:
+            yield self.warm()
+
+    def stats(self):
+        """
+        Occupancy and wait time counters for sizing the pool.
+        """
+        return {
+            "min_size": self.min_size,
+            "max_size": self.max_size,
+            "size": self.size,
+            "idle": len(self.idle),
+            "in_use": self.in_use,
+            "waiting": len([waiter for waiter in self.waiters if not waiter.done()]),
+            "checkouts": self.checkouts,
+            "checkout_timeouts": self.checkout_timeouts,
+            "wait_time_total": self.wait_time_total,
+            "wait_time_avg": self.wait_time_total / self.checkouts if self.checkouts else 0.0,
+            "wait_time_max": self.wait_time_max,
+            "connects": self.connects,
+            "connect_failures": self.connect_failures,
+            "discarded": self.discarded,
+        }
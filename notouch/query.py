@@ -0,0 +1,85 @@
+"""
+Indexed range queries with keyset (cursor) pagination.
+
+Every range index in notouch.util.INDEXES has the form [prefix..., time, id].
+A page is a single contiguous read of that index, and the cursor handed back
+to the client is the [time, id] key of the last row on the page. The next page
+starts strictly after that key, so fetching page N costs the same as page 1 no
+matter how many rows the table holds.
+"""
+import base64
+import json
+
+import rethinkdb
+
+DEFAULT_LIMIT = 100
+MAX_LIMIT = 1000
+
+
+def encode_cursor(key):
+    """
+    Encode a [time, id] index key into an opaque url-safe cursor string.
+    """
+    return base64.urlsafe_b64encode(json.dumps(key))
+
+
+def decode_cursor(cursor):
+    """
+    Decode a cursor created by encode_cursor, raising ValueError if the cursor
+        is malformed.
+    """
+    try:
+        key = json.loads(base64.urlsafe_b64decode(str(cursor)))
+    except (TypeError, ValueError):
+        raise ValueError("Invalid cursor: %s" % cursor)
+    if not isinstance(key, list) or len(key) != 2:
+        raise ValueError("Invalid cursor: %s" % cursor)
+    return key
+
+
+def range_query(table, index, prefix=None, start=None, end=None, cursor=None,
+        limit=DEFAULT_LIMIT, descending=False):
+    """
+    Build a query reading one page from a compound [prefix..., time, id] index.
+
+    table - A rethinkdb table term.
+    index - Name of the index to read.
+    prefix - List of leading index values to match exactly (e.g. [chaddr]).
+    start, end - Optional time bounds, start inclusive and end exclusive.
+    cursor - Optional decoded cursor key to resume after.
+    limit - Maximum number of rows to return, or None for no limit.
+    descending - Return the newest rows first.
+    """
+    prefix = list(prefix or [])
+    lower = prefix + [rethinkdb.minval if start is None else start]
+    upper = prefix + [rethinkdb.maxval if end is None else end]
+    left_bound = "closed"
+    right_bound = "open"
+
+    if cursor is not None:
+        if descending:
+            upper = prefix + list(cursor)
+        else:
+            lower = prefix + list(cursor)
+            left_bound = "open"
+
+    order = rethinkdb.desc(index) if descending else rethinkdb.asc(index)
+    rql = table.between(lower, upper, index=index, left_bound=left_bound,
+        right_bound=right_bound).order_by(index=order)
+    if limit is not None:
+        rql = rql.limit(limit)
+    return rql
+
+
+def page(rows, time_field, limit):
+    """
+    Wrap a list of rows returned by range_query into a response page with the
+        cursor for the following page, or None if this is the last page.
+    """
+    cursor = None
+    if len(rows) == limit:
+        cursor = encode_cursor([rows[-1][time_field], rows[-1]["id"]])
+    return {
+        "results": rows,
+        "cursor": cursor,
+    }
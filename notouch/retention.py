@@ -0,0 +1,117 @@
+"""
+Periodic retention task moving expired rows into archives.
+
+Every interval the task walks the tables configured in notouch.util.RETENTION
+oldest first along their [time, id] index. Rows older than the table's
+retention period are read batch_size at a time, appended to the archive (see
+notouch.archive) and only then deleted, so a row is never deleted without
+being archived. If a run is interrupted between the two steps the rows are
+archived again on the next run; archives are at-least-once.
+
+Deletes are rate limited to max_rate rows per second so that expiring a large
+backlog doesn't compete with ingest. The task runs on the IOLoop of a single
+worker, see notouch.server.
+"""
+import datetime
+import logging
+
+import tornado.gen
+import tornado.ioloop
+
+from . import archive
+from .handlers.util import json_serializer
+from .util import RETENTION
+
+log = logging.getLogger("notouch.retention")
+
+TIME_FORMAT = "%Y-%m-%d %H:%M:%S.%f"
+
+
+def cutoff(days, now=None):
+    """
+    The time before which rows kept for days are expired.
+    """
+    now = now or datetime.datetime.utcnow()
+    return (now - datetime.timedelta(days=days)).strftime(TIME_FORMAT)
+
+
+class Retention(object):
+    def __init__(self, application, archive_dir, interval=3600, batch_size=500,
+            max_rate=2000, retention=None):
+        """
+        application - Application whose storage the task uses.
+        archive_dir - Directory expired rows are archived to.
+        interval - Seconds between retention runs.
+        batch_size - Rows archived and deleted per query.
+        max_rate - Maximum rows deleted per second.
+        retention - Per table retention config, defaults to RETENTION.
+        """
+        self.application = application
+        self.archive_dir = archive_dir
+        self.interval = interval
+        self.batch_size = batch_size
+        self.max_rate = max_rate
+        self.retention = RETENTION if retention is None else retention
+
+        self.running = False
+        self.callback = None
+        self.archived = dict((table, 0) for table in self.retention)
+
+    def start(self):
+        """
+        Run now and then every interval seconds on the current IOLoop.
+        """
+        self.callback = tornado.ioloop.PeriodicCallback(self.run, self.interval * 1000)
+        self.callback.start()
+        tornado.ioloop.IOLoop.current().add_callback(self.run)
+
+    def stop(self):
+        if self.callback is not None:
+            self.callback.stop()
+            self.callback = None
+
+    @tornado.gen.coroutine
+    def run(self):
+        """
+        Archive and delete the expired rows of every configured table.
+        """
+        if self.running:
+            return
+        self.running = True
+        try:
+            for table, config in sorted(self.retention.items()):
+                try:
+                    count = yield self.expire(table, config)
+                except Exception:
+                    log.exception("Retention of %s failed.", table)
+                else:
+                    if count:
+                        log.info("Archived %d expired rows of %s.", count, table)
+        finally:
+            self.running = False
+
+    @tornado.gen.coroutine
+    def expire(self, table, config):
+        """
+        Archive and delete the rows of table older than its retention period,
+            returning how many were removed.
+        """
+        end = cutoff(config["days"])
+        time_field = config["time_field"]
+        storage = self.application.storage
+        count = 0
+        while True:
+            rows = yield storage.range(table, config["index"], end=end, limit=self.batch_size)
+            if not rows:
+                break
+
+            archive.write(self.archive_dir, table, time_field, rows, json_serializer)
+            yield storage.delete(table, [row["id"] for row in rows], durability="soft")
+            count += len(rows)
+            self.archived[table] += len(rows)
+
+            if len(rows) < self.batch_size:
+                break
+            if self.max_rate:
+                yield tornado.gen.sleep(float(len(rows)) / self.max_rate)
+        raise tornado.gen.Return(count)
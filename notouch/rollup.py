@@ -0,0 +1,152 @@
+"""
+Time-bucketed rollups of DHCP server stats snapshots.
+
+Agents post a server_stats snapshot every few seconds. As they are ingested the
+snapshots are folded into one document per server per minute, hour and day in
+the dhcpserverstats_rollup table, holding the summed message counts, the
+distinct clients seen in that bucket and the summed handshake latency
+histograms (see notouch.latency). A dashboard covering a week at hourly
+resolution reads 168 rows per server instead of every snapshot.
+
+Distinct clients are counted with a HyperLogLog (see notouch.sketch), stored
+compressed in client_sketch. Snapshots from agents run with --max_clients,
+whose clients are only the noisiest, carry the agent's sketch of all of them,
+which is merged in instead. A bucket stays the
+same few KB however many clients a busy server sees in a day, and merging
+a snapshot into it doesn't depend on their number either. Only minute buckets
+also keep the list of clients.
+
+Rollup documents look like:
+
+{
+    "id": ["10.X.X.X", "hour", "2015-01-01 13:00:00.000000"],
+    "server_ip": "10.X.X.X",
+    "server_hostname": "dhcp1",
+    "resolution": "hour",
+    "bucket": "2015-01-01 13:00:00.000000",
+    "snapshots": 360,
+    "dhcpack_count": 1520,
+    "dhcpdiscover_count": 1877,
+    "dhcpoffer_count": 1610,
+    "dhcprequest_count": 1533,
+    "client_sketch": "eJzt...",
+    "client_count": 1312,
+    "latency": {"offer": [...], "request": [...], "ack": [...], "handshake": [...]},
+    "relay_latency": {"10.X.X.X": [...], ...},
+    "handshakes_failed": {"no_offer": 0, "no_request": 12, "no_ack": 0, "nak": 3},
+    "timestamp_end": "2015-01-01 13:59:58.000123"
+}
+"""
+from . import latency
+from .sketch import HyperLogLog
+
+TABLE = "dhcpserverstats_rollup"
+
+# Resolution -> function truncating a timestamp in ingest.TIME_FORMAT to the
+# start of its bucket, in the same format.
+RESOLUTIONS = {
+    "minute": lambda ts: ts[:16] + ":00.000000",
+    "hour": lambda ts: ts[:13] + ":00:00.000000",
+    "day": lambda ts: ts[:10] + " 00:00:00.000000",
+}
+
+COUNTS = ["dhcpack_count", "dhcpdiscover_count", "dhcpoffer_count", "dhcprequest_count"]
+
+# Resolutions whose buckets keep the list of clients as well as the sketch.
+CLIENT_LIST_RESOLUTIONS = frozenset(["minute"])
+
+
+def client_sketch(doc):
+    """
+    The HyperLogLog of the clients of a snapshot or rollup, built from its
+        clients if it doesn't have one (as rollups stored before they did).
+    """
+    if "client_sketch" in doc:
+        return HyperLogLog.decode(doc["client_sketch"])
+    sketch = HyperLogLog()
+    for client in doc.get("clients") or ():
+        sketch.add(client)
+    return sketch
+
+
+def finish(doc, sketch):
+    """
+    Store the client sketch of a rollup and the count it estimates.
+    """
+    doc["client_sketch"] = sketch.encode()
+    doc["client_count"] = max(sketch.count(), len(doc.get("clients", ())))
+
+
+def rollups(snapshots):
+    """
+    Aggregate a list of server_stats snapshots into one partial rollup
+        document per (server, resolution, bucket) they touch.
+    """
+    docs = {}
+    for snapshot in snapshots:
+        server_ip = snapshot.get("server_ip")
+        ts = snapshot.get("timestamp_start")
+        if not server_ip or not isinstance(ts, basestring) or len(ts) < 16:
+            continue
+        clients = snapshot.get("clients") or {}
+        snapshot_sketch = client_sketch(snapshot)
+        for resolution, truncate in RESOLUTIONS.items():
+            bucket = truncate(ts)
+            key = (server_ip, resolution, bucket)
+            doc = docs.get(key)
+            if doc is None:
+                doc = docs[key] = {
+                    "id": list(key),
+                    "server_ip": server_ip,
+                    "server_hostname": snapshot.get("server_hostname"),
+                    "resolution": resolution,
+                    "bucket": bucket,
+                    "snapshots": 0,
+                    "clients": set(),
+                    "client_sketch": HyperLogLog(),
+                    "timestamp_end": snapshot.get("timestamp_end", ts),
+                }
+                for count in COUNTS:
+                    doc[count] = 0
+                doc.update(latency.empty())
+            doc["snapshots"] += 1
+            for count in COUNTS:
+                doc[count] += snapshot.get(count) or 0
+            latency.add(doc, snapshot)
+            doc["client_sketch"].update(snapshot_sketch)
+            if resolution in CLIENT_LIST_RESOLUTIONS:
+                doc["clients"].update(clients)
+            doc["timestamp_end"] = max(doc["timestamp_end"], snapshot.get("timestamp_end", ts))
+
+    for doc in docs.values():
+        if doc["resolution"] in CLIENT_LIST_RESOLUTIONS:
+            doc["clients"] = sorted(doc["clients"])
+        else:
+            del doc["clients"]
+        finish(doc, doc["client_sketch"])
+    return docs.values()
+
+
+def merge_docs(existing, new):
+    """
+    Merge a partial rollup into the stored document for its bucket.
+    """
+    doc = dict(existing)
+    doc["server_hostname"] = new["server_hostname"]
+    doc["snapshots"] = existing["snapshots"] + new["snapshots"]
+    sketch = client_sketch(existing)
+    sketch.update(client_sketch(new))
+    if "clients" in new:
+        doc["clients"] = sorted(set(existing.get("clients", ())) | set(new["clients"]))
+    else:
+        # Rollups stored before, of every resolution, kept the list.
+        doc.pop("clients", None)
+    finish(doc, sketch)
+    doc["timestamp_end"] = max(existing["timestamp_end"], new["timestamp_end"])
+    for count in COUNTS:
+        doc[count] = existing[count] + new[count]
+    doc.update(latency.empty())
+    latency.add(doc, existing)
+    latency.add(doc, new)
+    return doc
+
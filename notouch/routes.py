@@ -3,8 +3,16 @@ from .handlers import main
 
 HANDLERS = [
     (r"/", main.MainHandler),
+    (r"/metrics", main.MetricsHandler),
 
     # v1 API Handlers
     (r"/api/v1/dhcp/ack", api.DHCPAckApiV1Handler),
+    (r"/api/v1/dhcp/ack/export", api.DHCPAckExportApiV1Handler),
+    (r"/api/v1/dhcp/ack/stream", api.DHCPAckStreamApiV1Handler),
     (r"/api/v1/dhcp/server_stats", api.DHCPServerStatsApiV1Handler),
+    (r"/api/v1/dhcp/server_stats/rollup", api.DHCPServerStatsRollupApiV1Handler),
+    (r"/api/v1/hosts", api.HostsApiV1Handler),
+    (r"/api/v1/hosts/([0-9A-Fa-f:]+)", api.HostApiV1Handler),
+    (r"/api/v1/status/pool", main.PoolStatusHandler),
+    (r"/api/v1/status/cache", main.CacheStatusHandler),
 ]
\ No newline at end of file
@@ -4,9 +4,12 @@ Physical machine installer automation.
 import tornado.web
 import tornado.ioloop
 import tornado.httpserver
+import tornado.process
 
 import argparse
 import json
+import shutil
+import tempfile
 
 from .app import Application
 
@@ -21,12 +24,53 @@ def main():
         help="Address to run the server on.")
     parser.add_argument("--workers", dest="workers", type=int, default=4,
         help="Number of tornado workers to spawn.")
+    parser.add_argument("--storage", dest="storage", type=str, default="rethinkdb",
+        choices=["rethinkdb", "sqlite"], help="Storage backend: a rethinkdb server, or an "
+             "embedded sqlite database for single node deployments.")
+    parser.add_argument("--sqlite_path", dest="sqlite_path", type=str, default="notouch.db",
+        help="Database file for the sqlite backend, created if missing.")
+    parser.add_argument("--sqlite_poll_interval", dest="sqlite_poll_interval", type=float,
+        default=0.25, help="Seconds between polls for writes by other workers while the "
+             "sqlite backend follows a table's changes.")
     parser.add_argument("--rethinkdb_host", dest="rethinkdb_host", type=str, default="localhost",
         help="Hostname for the rethinkdb server to use.")
     parser.add_argument("--rethinkdb_port", dest="rethinkdb_port", type=int, default=28015,
         help="Port that the rethinkdb server runs on.")
     parser.add_argument("--rethinkdb_db", dest="rethinkdb_db", type=str, default="notouch",
         help="Default database to use for rethinkdb.")
+    parser.add_argument("--pool_min_size", dest="pool_min_size", type=int, default=2,
+        help="Minimum number of rethinkdb connections kept open per worker.")
+    parser.add_argument("--pool_max_size", dest="pool_max_size", type=int, default=10,
+        help="Maximum number of rethinkdb connections open per worker.")
+    parser.add_argument("--pool_checkout_timeout", dest="pool_checkout_timeout", type=float,
+        default=5.0, help="Seconds a query waits for a free rethinkdb connection.")
+    parser.add_argument("--write_buffer_size", dest="write_buffer_size", type=int, default=0,
+        help="Coalesce ingested documents across requests into inserts of this many "
+             "documents. 0 disables coalescing.")
+    parser.add_argument("--write_buffer_delay", dest="write_buffer_delay", type=int, default=50,
+        help="Maximum milliseconds a document waits in the write buffer before a flush.")
+    parser.add_argument("--durability", dest="durability", type=str, default="hard",
+        choices=["hard", "soft"], help="Write durability for ingested documents.")
+    parser.add_argument("--ingest_workers", dest="ingest_workers", type=int, default=2,
+        help="Processes per worker that decode and validate large ingest bodies off the "
+             "IOLoop. 0 handles every body inline.")
+    parser.add_argument("--cache_size", dest="cache_size", type=int, default=1024,
+        help="Query responses cached per worker. 0 disables the cache.")
+    parser.add_argument("--cache_ttl", dest="cache_ttl", type=float, default=5.0,
+        help="Maximum seconds a cached query response is served for.")
+    parser.add_argument("--archive_dir", dest="archive_dir", type=str,
+        help="Archive rows older than their table's retention period (see "
+             "notouch.util.RETENTION) to this directory and delete them. Retention is "
+             "disabled without it.")
+    parser.add_argument("--retention_interval", dest="retention_interval", type=int,
+        default=3600, help="Seconds between retention runs.")
+    parser.add_argument("--retention_batch_size", dest="retention_batch_size", type=int,
+        default=500, help="Rows archived and deleted per retention batch.")
+    parser.add_argument("--retention_rate", dest="retention_rate", type=int, default=2000,
+        help="Maximum rows deleted per second by retention.")
+    parser.add_argument("--metrics_dir", dest="metrics_dir", type=str,
+        help="Directory where workers share metrics snapshots for /metrics. Defaults to a "
+             "temporary directory removed on exit.")
     parser.add_argument("--debug", dest="debug", action="store_true", default=False,
         help="Run the tornado web server in debug mode.")
 
@@ -36,10 +80,31 @@ def main():
         "debug": args.debug,
     }
 
+    metrics_dir = args.metrics_dir
+    if metrics_dir is None:
+        metrics_dir = tempfile.mkdtemp(prefix="notouch-metrics-")
+
     app = Application(tornado_kwargs,
+        storage=args.storage,
         rethinkdb_host=args.rethinkdb_host,
         rethinkdb_port=args.rethinkdb_port,
-        rethinkdb_db=args.rethinkdb_db
+        rethinkdb_db=args.rethinkdb_db,
+        sqlite_path=args.sqlite_path,
+        sqlite_poll_interval=args.sqlite_poll_interval,
+        write_buffer_size=args.write_buffer_size,
+        write_buffer_delay=args.write_buffer_delay,
+        durability=args.durability,
+        pool_min_size=args.pool_min_size,
+        pool_max_size=args.pool_max_size,
+        pool_checkout_timeout=args.pool_checkout_timeout,
+        archive_dir=args.archive_dir,
+        retention_interval=args.retention_interval,
+        retention_batch_size=args.retention_batch_size,
+        retention_rate=args.retention_rate,
+        cache_size=args.cache_size,
+        cache_ttl=args.cache_ttl,
+        metrics_dir=metrics_dir,
+        ingest_workers=args.ingest_workers
     )
 
     print "Starting notouch server on {}:{}...".format(args.address, args.port)
@@ -51,8 +116,15 @@ def main():
         args.workers = 1
     try:
         server.start(args.workers)
+        # Each forked worker opens its own connections before serving.
+        tornado.ioloop.IOLoop.current().add_callback(app.storage.warm)
+        # Retention runs in the first worker only (task_id is None unforked).
+        if app.retention is not None and tornado.process.task_id() in (None, 0):
+            app.retention.start()
         tornado.ioloop.IOLoop.current().start()
     except KeyboardInterrupt:
         tornado.ioloop.IOLoop.instance().stop()
     finally:
         print "Quitting..."
+        if args.metrics_dir is None and tornado.process.task_id() is None:
+            shutil.rmtree(metrics_dir, ignore_errors=True)
@@ -0,0 +1,76 @@
+"""
+Counting distinct DHCP clients in bounded memory.
+
+A HyperLogLog estimates the number of distinct keys (chaddrs) added to it,
+within about 2% at the default precision, in 4KB of registers whatever the
+number of keys. Sketches of the same precision merge by keeping the larger of
+each register, so the sketch of a union of intervals or of agents is the merge
+of theirs. Agents run with --max_clients send theirs in server_stats (see
+scripts/dhcp_sketch.py) and rollups (see notouch.rollup) keep one per bucket.
+"""
+import base64
+import hashlib
+import math
+import struct
+import zlib
+
+
+class HyperLogLog(object):
+    def __init__(self, precision=12):
+        self.precision = precision
+        self.size = 1 << precision
+        self.registers = bytearray(self.size)
+
+    def add(self, key):
+        value = struct.unpack("<Q", hashlib.md5(key).digest()[:8])[0]
+        register = value & (self.size - 1)
+        rest = value >> self.precision
+        # Position of the lowest set bit of the remaining 64 - precision bits.
+        rank = 1
+        while rest & 1 == 0 and rank <= 64 - self.precision:
+            rest >>= 1
+            rank += 1
+        if rank > self.registers[register]:
+            self.registers[register] = rank
+
+    def count(self):
+        alpha = 0.7213 / (1 + 1.079 / self.size)
+        estimate = alpha * self.size ** 2 / sum(2.0 ** -register
+            for register in self.registers)
+        zeros = self.registers.count("\x00")
+        if estimate <= 2.5 * self.size and zeros:
+            # Linear counting is more accurate for small cardinalities.
+            estimate = self.size * math.log(float(self.size) / zeros)
+        return int(round(estimate))
+
+    def update(self, other):
+        """
+        Add the keys counted by another HyperLogLog of the same precision.
+        """
+        self.registers = bytearray(max(a, b) for a, b in zip(self.registers, other.registers))
+
+    def encode(self):
+        """
+        The registers, compressed and base64 encoded to be sent as JSON.
+        """
+        return base64.b64encode(zlib.compress(str(self.registers)))
+
+    @classmethod
+    def decode(cls, data, precision=12):
+        """
+        The HyperLogLog encoded as data, raising ValueError if it isn't one.
+        """
+        size = 1 << precision
+        # Registers compress to at most about their size, longer data can only
+        # be something else.
+        if not isinstance(data, basestring) or len(data) > 2 * size:
+            raise ValueError("not an encoded HyperLogLog")
+        try:
+            registers = bytearray(zlib.decompress(base64.b64decode(data)))
+        except (TypeError, zlib.error):
+            raise ValueError("not an encoded HyperLogLog")
+        if len(registers) != size or max(registers) > 65 - precision:
+            raise ValueError("not an encoded HyperLogLog of precision %d" % precision)
+        sketch = cls(precision)
+        sketch.registers = registers
+        return sketch
@@ -0,0 +1,9 @@
+"""
+Storage backends, see notouch.storage.base for the interface.
+
+rethinkdb - The default, for deployments with a rethinkdb cluster.
+sqlite - An embedded database file, for single node deployments and tests.
+"""
+from .base import Cursor, Storage, StorageError, WriteError
+from .rethink import RethinkDBStorage
+from .sqlite import SQLiteStorage
@@ -0,0 +1,135 @@
+"""
+The interface every storage backend implements.
+
+Handlers, the write buffers, changefeeds and the retention task only talk to
+the application's Storage, never to a database driver. All tables are those in
+notouch.util.TABLES and all indexes are the compound [prefix..., time, id]
+range indexes of notouch.util.INDEXES, referred to by name.
+
+Methods documented as coroutines return Futures. A backend is created with the
+Application before tornado forks its workers, so it must not open connections
+or touch an IOLoop until it is first used in a worker.
+"""
+
+
+class StorageError(Exception):
+    """
+    Raised when the storage backend fails a request.
+    """
+
+
+class WriteError(StorageError):
+    """
+    Raised when some or all documents of a write were rejected.
+    """
+
+
+class Cursor(object):
+    """
+    Documents read in batches, from a range (see Storage.stream) or as they are
+        written (see Storage.changes).
+    """
+
+    def fetch(self):
+        """
+        Coroutine returning the next non-empty list of documents, or an empty
+            list once the cursor is exhausted or closed.
+        """
+        raise NotImplementedError()
+
+    def close(self, discard=False):
+        """
+        Stop reading and free the cursor's resources. Closing twice is harmless.
+
+        discard - The cursor failed, don't reuse its connection.
+        """
+        raise NotImplementedError()
+
+
+class Storage(object):
+
+    def create(self):
+        """
+        Create any missing tables and indexes.
+        """
+        raise NotImplementedError()
+
+    def clean(self):
+        """
+        Delete every document of every table. Only meant for tests.
+        """
+        raise NotImplementedError()
+
+    def warm(self):
+        """
+        Coroutine opening connections ahead of the first request.
+        """
+        raise NotImplementedError()
+
+    def ping(self):
+        """
+        Coroutine raising StorageError if the backend can't serve queries.
+        """
+        raise NotImplementedError()
+
+    def insert(self, table, docs, durability="hard"):
+        """
+        Coroutine inserting a batch of documents in a single write, assigning
+            an "id" to those without one. Raises WriteError if any were
+            rejected.
+
+        durability - "hard" to wait for the write to reach disk, or "soft".
+        """
+        raise NotImplementedError()
+
+    def upsert(self, table, docs, durability="hard"):
+        """
+        Coroutine merging documents into the stored documents with the same id,
+            or inserting them, using the table's merge (the hosts and rollup
+            tables, see notouch.hosts and notouch.rollup).
+        """
+        raise NotImplementedError()
+
+    def replace(self, table, docs, durability="hard"):
+        """
+        Coroutine writing whole documents over the stored documents with the
+            same id, as when rewriting them in a migration.
+        """
+        raise NotImplementedError()
+
+    def get(self, table, id):
+        """
+        Coroutine returning the document with a primary key, or None.
+        """
+        raise NotImplementedError()
+
+    def delete(self, table, ids, durability="hard"):
+        """
+        Coroutine deleting the documents with these primary keys.
+        """
+        raise NotImplementedError()
+
+    def range(self, table, index, prefix=None, start=None, end=None, cursor=None,
+            limit=None, descending=False, without=None):
+        """
+        Coroutine returning the rows of one page of a range index, as for
+            notouch.query.range_query.
+
+        without - Fields to leave out of the returned rows.
+        """
+        raise NotImplementedError()
+
+    def stream(self, table, index, prefix=None, start=None, end=None, cursor=None,
+            limit=None, descending=False, without=None, batch_rows=500):
+        """
+        Coroutine returning a Cursor over the same rows as range, read from the
+            database at most batch_rows at a time.
+        """
+        raise NotImplementedError()
+
+    def changes(self, table):
+        """
+        Coroutine returning a Cursor over the documents written to table from
+            now on, in every worker. It never ends until it is closed.
+        """
+        raise NotImplementedError()
@@ -0,0 +1,211 @@
+"""
+RethinkDB storage, queried through a per-worker connection pool (see
+notouch.pool) with the tables and indexes created by notouch.util.
+"""
+import rethinkdb
+import tornado.gen
+
+from .. import hosts
+from .. import query
+from .. import rollup
+from ..pool import ConnectionPool
+from ..util import clean_database, create_database
+from .base import Cursor, Storage, StorageError, WriteError
+
+# Table -> function building the query that upserts a list of its documents.
+UPSERTS = {
+    hosts.TABLE: hosts.upsert,
+}
+
+# Table -> function merging an upserted document into the stored one, for the
+# tables merged here rather than in a query, as in the SQLite backend.
+MERGES = {
+    rollup.TABLE: rollup.merge_docs,
+}
+
+# Attempts at merging a document another worker keeps changing meanwhile.
+MERGE_ATTEMPTS = 5
+CONFLICT = "Document changed since it was read."
+
+
+def check_write(result):
+    """
+    Raise a WriteError if a rethinkdb write result reports any errors.
+    """
+    if result["errors"]:
+        raise WriteError("Write failed for %d documents: %s" % (
+            result["errors"], result.get("first_error")))
+
+
+class RethinkDBCursor(Cursor):
+    """
+    A rethinkdb cursor holding a pooled connection until it is closed.
+
+    transform - Function mapping each item of the cursor to a document, or to
+        None to skip it.
+    """
+    def __init__(self, pool, conn, cursor, transform=None):
+        self.pool = pool
+        self.conn = conn
+        self.cursor = cursor
+        self.transform = transform
+
+    @tornado.gen.coroutine
+    def fetch(self):
+        docs = []
+        while not docs:
+            if self.conn is None or not (yield self.cursor.fetch_next()):
+                break
+            # Take whatever the driver already holds without waiting for more.
+            while True:
+                item = yield self.cursor.next()
+                if self.transform is not None:
+                    item = self.transform(item)
+                if item is not None:
+                    docs.append(item)
+                if not self.cursor.items:
+                    break
+        raise tornado.gen.Return(docs)
+
+    def close(self, discard=False):
+        if self.conn is None:
+            return
+        conn, self.conn = self.conn, None
+        try:
+            self.cursor.close()
+        finally:
+            self.pool.release(conn, discard=discard)
+
+
+def new_value(change):
+    return change.get("new_val")
+
+
+class RethinkDBStorage(Storage):
+    def __init__(self, host="localhost", port=28015, db="notouch", min_size=2,
+            max_size=10, checkout_timeout=5.0, metrics=None):
+        """
+        host, port, db - rethinkdb server and database.
+        min_size, max_size, checkout_timeout, metrics - See notouch.pool.
+        """
+        self.host = host
+        self.port = port
+        self.db = db
+        # Connections are opened per worker on first use, see notouch.pool.
+        self.pool = ConnectionPool(host, port, db, min_size=min_size, max_size=max_size,
+            checkout_timeout=checkout_timeout, metrics=metrics)
+
+    def create(self):
+        create_database(self.host, self.port, self.db).close()
+
+    def clean(self):
+        conn = rethinkdb.connect(host=self.host, port=self.port, db=self.db)
+        try:
+            clean_database(conn, self.db, testing=True)
+        finally:
+            conn.close()
+
+    def warm(self):
+        return self.pool.warm()
+
+    @tornado.gen.coroutine
+    def ping(self):
+        try:
+            yield self.pool.run("ping", rethinkdb.db_list())
+        except rethinkdb.ReqlError as e:
+            raise StorageError(str(e))
+
+    @tornado.gen.coroutine
+    def insert(self, table, docs, durability="hard"):
+        if not docs:
+            return
+        result = yield self.pool.run("insert", rethinkdb.table(table).insert(
+            docs, durability=durability), retry=False)
+        check_write(result)
+
+    @tornado.gen.coroutine
+    def upsert(self, table, docs, durability="hard"):
+        if not docs:
+            return
+        if table in MERGES:
+            yield [self.merge(table, doc, durability) for doc in docs]
+            return
+        result = yield self.pool.run("upsert", UPSERTS[table](docs, durability),
+            retry=False)
+        check_write(result)
+
+    @tornado.gen.coroutine
+    def merge(self, table, doc, durability):
+        """
+        Merge a document into the stored one with the table's merge in MERGES,
+            writing the result only if no other worker changed the stored
+            document since it was read, and trying again otherwise.
+        """
+        for _ in range(MERGE_ATTEMPTS):
+            existing = yield self.get(table, doc["id"])
+            new = doc if existing is None else MERGES[table](existing, doc)
+            query = rethinkdb.table(table).get(doc["id"]).replace(
+                lambda current: rethinkdb.branch(current.eq(existing), new,
+                    rethinkdb.error(CONFLICT)), durability=durability)
+            result = yield self.pool.run("upsert", query, retry=False)
+            if not result["errors"] or CONFLICT not in result.get("first_error", ""):
+                check_write(result)
+                return
+        raise WriteError("Write failed for %s: %s" % (doc["id"], CONFLICT))
+
+    @tornado.gen.coroutine
+    def replace(self, table, docs, durability="hard"):
+        if not docs:
+            return
+        result = yield self.pool.run("replace", rethinkdb.table(table).insert(
+            docs, conflict="replace", durability=durability), retry=False)
+        check_write(result)
+
+    def get(self, table, id):
+        return self.pool.run("get", rethinkdb.table(table).get(id))
+
+    @tornado.gen.coroutine
+    def delete(self, table, ids, durability="hard"):
+        if not ids:
+            return
+        result = yield self.pool.run("delete", rethinkdb.table(table).get_all(*ids).delete(
+            durability=durability), retry=False)
+        check_write(result)
+
+    def range_query(self, table, index, prefix=None, start=None, end=None, cursor=None,
+            limit=None, descending=False, without=None):
+        rql = query.range_query(rethinkdb.table(table), index, prefix=prefix, start=start,
+            end=end, cursor=cursor, limit=limit, descending=descending)
+        if without:
+            rql = rql.without(*without)
+        return rql
+
+    def range(self, table, index, **kwargs):
+        return self.pool.run("range",
+            self.range_query(table, index, **kwargs).coerce_to("array"))
+
+    @tornado.gen.coroutine
+    def stream(self, table, index, batch_rows=500, **kwargs):
+        rql = self.range_query(table, index, **kwargs)
+        cursor = yield self.run_cursor("stream", rql, max_batch_rows=batch_rows)
+        raise tornado.gen.Return(cursor)
+
+    @tornado.gen.coroutine
+    def changes(self, table):
+        cursor = yield self.run_cursor("changes", rethinkdb.table(table).changes(),
+            transform=new_value)
+        raise tornado.gen.Return(cursor)
+
+    @tornado.gen.coroutine
+    def run_cursor(self, operation, rql, transform=None, **kwargs):
+        """
+        Run a query returning a cursor on a connection checked out for as long
+            as the cursor is open.
+        """
+        conn = yield self.pool.acquire()
+        try:
+            cursor = yield self.pool.timed(operation, rql.run(conn, **kwargs))
+        except Exception as e:
+            self.pool.release(conn, discard=isinstance(e, rethinkdb.ReqlDriverError))
+            raise
+        raise tornado.gen.Return(RethinkDBCursor(self.pool, conn, cursor, transform))
@@ -0,0 +1,479 @@
+"""
+Embedded SQLite storage for single node deployments and tests.
+
+Everything lives in one database file in WAL mode, so readers in any worker
+never block the writer or each other. Each table stores its documents as JSON
+next to a column per indexed field, with one SQLite index per range index of
+notouch.util.INDEXES:
+
+    <table>(seq INTEGER PRIMARY KEY AUTOINCREMENT, id UNIQUE, <fields...>, doc)
+
+A batch is written in a single transaction, and an upsert reads and replaces
+its documents inside that transaction, so concurrent workers can't interleave.
+Each worker runs its queries one at a time on a database thread that owns its
+connection, so a write waiting up to busy_timeout for another worker's
+transaction, or for an fsync, holds up that worker's queries but not its
+IOLoop.
+
+Every write (including a replaced document) takes a new seq, which is how
+changes() follows writes from every worker: it polls for rows past the last
+seq it has seen.
+"""
+import json
+import os
+import sqlite3
+import sys
+import time
+import uuid
+
+import tornado.gen
+from concurrent import futures
+
+from .. import hosts
+from .. import rollup
+from ..util import SUBNET_BITS, TABLES
+from .base import Cursor, Storage, StorageError, WriteError
+
+def subnet_index(column, time_field):
+    """
+    The columns of a subnet index, per prefix length of notouch.util.SUBNET_BITS.
+    """
+    return dict((bits, ["%s_net%d" % (column, bits), time_field]) for bits in SUBNET_BITS)
+
+
+# Leading fields of each range index in notouch.util.INDEXES, ending with the
+# time field. Every index is followed by the primary key. Where rethinkdb has
+# a multi index over subnets, there is one SQLite index per prefix length, and
+# the first prefix value of a read (the length) picks which.
+INDEXES = {
+    "dhcpack": {
+        "ts": ["ts"],
+        "chaddr_ts": ["chaddr", "ts"],
+        "xid_ts": ["xid", "ts"],
+        "giaddr_ts": ["giaddr", "ts"],
+        "server_identifier_ts": ["server_identifier", "ts"],
+        "yiaddr_subnet_ts": subnet_index("yiaddr", "ts"),
+    },
+    "dhcpserverstats": {
+        "timestamp_start": ["timestamp_start"],
+        "server_ip_ts": ["server_ip", "timestamp_start"],
+    },
+    "hosts": {
+        "last_seen": ["last_seen"],
+        "yiaddr_ts": ["yiaddr", "last_seen"],
+        "hostname_ts": ["hostname", "last_seen"],
+        "giaddr_ts": ["giaddr", "last_seen"],
+    },
+    "dhcpserverstats_rollup": {
+        "bucket": ["resolution", "bucket"],
+        "server_ip_ts": ["resolution", "server_ip", "bucket"],
+    },
+}
+
+
+def server_identifier(ack):
+    """
+    The server identifier option (54) of an ack. Where rethinkdb indexes every
+        such option, only the first is indexed here; acks carry one.
+    """
+    for option in ack.get("options") or []:
+        if isinstance(option, dict) and option.get("op") == 54:
+            return option.get("data")
+    return None
+
+
+def network(field, bits):
+    """
+    Function computing the network of an integer address field at a prefix
+        length.
+    """
+    size = 2 ** (32 - bits)
+
+    def network_of(doc):
+        address = doc.get(field)
+        if not isinstance(address, (int, long)):
+            return None
+        return address - address % size
+    return network_of
+
+
+# Columns computed from the document instead of copied from a field.
+DERIVED_COLUMNS = {
+    "dhcpack": dict([("server_identifier", server_identifier)] +
+        [("yiaddr_net%d" % bits, network("yiaddr_int", bits)) for bits in SUBNET_BITS]),
+}
+
+# Table -> function merging an upserted document into the stored one.
+MERGES = {
+    hosts.TABLE: hosts.merge_docs,
+    rollup.TABLE: rollup.merge_docs,
+}
+
+# Rows read per poll of a changes cursor, and ids per DELETE statement.
+CHANGES_BATCH = 500
+DELETE_BATCH = 500
+
+
+def sqlite_indexes(table):
+    """
+    (SQLite index name, columns) of every index of a table.
+    """
+    for index, index_columns in sorted(INDEXES[table].items()):
+        if isinstance(index_columns, dict):
+            for bits, subnet_columns in sorted(index_columns.items()):
+                yield "%s_%s_%d" % (table, index, bits), subnet_columns
+        else:
+            yield "%s_%s" % (table, index), index_columns
+
+
+def columns(table):
+    """
+    The indexed columns of a table, in a stable order.
+    """
+    names = []
+    for _, index_columns in sqlite_indexes(table):
+        for name in index_columns:
+            if name not in names:
+                names.append(name)
+    return sorted(names)
+
+
+def column_value(value):
+    """
+    The SQLite value of a document field, with lists and objects (like the ids
+        of rollups) stored as JSON.
+    """
+    if isinstance(value, (list, dict)):
+        return json.dumps(value, sort_keys=True)
+    return value
+
+
+class SQLiteRangeCursor(Cursor):
+    """
+    Reads a range batch_rows at a time, each batch a keyset page resuming after
+        the previous one, so no read transaction is held between batches.
+    """
+    def __init__(self, storage, table, index, batch_rows, limit=None, without=None,
+            **kwargs):
+        self.storage = storage
+        self.table = table
+        self.index = index
+        self.batch_rows = batch_rows
+        self.remaining = limit
+        self.without = without
+        self.kwargs = kwargs
+        self.time_field = INDEXES[table][index]
+        if isinstance(self.time_field, dict):
+            self.time_field = self.time_field.values()[0]
+        self.time_field = self.time_field[-1]
+        self.closed = False
+
+    @tornado.gen.coroutine
+    def fetch(self):
+        if self.closed or self.remaining == 0:
+            raise tornado.gen.Return([])
+        limit = self.batch_rows
+        if self.remaining is not None:
+            limit = min(limit, self.remaining)
+            self.remaining -= limit
+        docs = yield self.storage.select(self.table, self.index, limit=limit,
+            operation="stream", **self.kwargs)
+        if len(docs) < limit:
+            self.closed = True
+        if docs:
+            self.kwargs["cursor"] = [docs[-1][self.time_field], docs[-1]["id"]]
+        raise tornado.gen.Return(strip(docs, self.without))
+
+    def close(self, discard=False):
+        self.closed = True
+
+
+class SQLiteChangesCursor(Cursor):
+    def __init__(self, storage, table, seq, poll_interval):
+        self.storage = storage
+        self.table = table
+        self.seq = seq
+        self.poll_interval = poll_interval
+        self.closed = False
+
+    @tornado.gen.coroutine
+    def fetch(self):
+        while not self.closed:
+            start = time.time()
+            rows = yield self.storage.run(lambda conn: conn.execute(
+                "SELECT seq, doc FROM %s WHERE seq > ? ORDER BY seq LIMIT ?" % self.table,
+                (self.seq, CHANGES_BATCH)).fetchall())
+            self.storage.observe("changes", start)
+            if rows:
+                self.seq = rows[-1][0]
+                raise tornado.gen.Return([json.loads(doc) for _, doc in rows])
+            yield tornado.gen.sleep(self.poll_interval)
+        raise tornado.gen.Return([])
+
+    def close(self, discard=False):
+        self.closed = True
+
+
+def strip(docs, without):
+    if without:
+        for doc in docs:
+            for field in without:
+                doc.pop(field, None)
+    return docs
+
+
+class SQLiteStorage(Storage):
+    def __init__(self, path="notouch.db", busy_timeout=5.0, poll_interval=0.25,
+            metrics=None):
+        """
+        path - Database file, created along with its tables if missing.
+        busy_timeout - Seconds a write waits for another worker's transaction.
+        poll_interval - Seconds between polls of an idle changes cursor.
+        metrics - notouch.metrics.Metrics recording query times.
+        """
+        self.path = path
+        self.busy_timeout = busy_timeout
+        self.poll_interval = poll_interval
+        self.metrics = metrics
+
+        self.pid = None
+        self.executor = None
+        self.conn = None
+        self.synchronous = None
+
+    def _connect(self):
+        conn = sqlite3.connect(self.path, timeout=self.busy_timeout, isolation_level=None,
+            check_same_thread=False)
+        conn.execute("PRAGMA journal_mode=WAL")
+        for table in TABLES:
+            conn.execute("CREATE TABLE IF NOT EXISTS %s (seq INTEGER PRIMARY KEY AUTOINCREMENT, "
+                "id NOT NULL UNIQUE, %s, doc TEXT NOT NULL)" % (table, ", ".join(columns(table))))
+            # Columns of indexes added since the table was created start out
+            # NULL, until notouch-migrate rewrites the table's documents.
+            existing = set(row[1] for row in conn.execute("PRAGMA table_info(%s)" % table))
+            for name in columns(table):
+                if name not in existing:
+                    conn.execute("ALTER TABLE %s ADD COLUMN %s" % (table, name))
+            for name, index_columns in sqlite_indexes(table):
+                conn.execute("CREATE INDEX IF NOT EXISTS %s ON %s (%s, id)" % (
+                    name, table, ", ".join(index_columns)))
+        return conn
+
+    def run(self, func, *args):
+        """
+        Call func(conn, *args) on this worker's database thread, returning a
+            Future of its result.
+        """
+        if self.pid != os.getpid():
+            # Never use a connection or a thread inherited through fork.
+            self.pid = os.getpid()
+            self.executor = futures.ThreadPoolExecutor(1)
+            self.conn = None
+            self.synchronous = None
+        return self.executor.submit(self._call, func, args)
+
+    def _call(self, func, args):
+        # Only ever called on the database thread, which opens the connection.
+        if self.conn is None:
+            self.conn = self._connect()
+        return func(self.conn, *args)
+
+    def observe(self, query, start):
+        if self.metrics is not None:
+            self.metrics.observe("notouch_db_query_duration_seconds", {"query": query},
+                time.time() - start)
+
+    def create(self):
+        self._connect().close()
+
+    def clean(self):
+        conn = self._connect()
+        try:
+            for table in TABLES:
+                conn.execute("DELETE FROM %s" % table)
+        finally:
+            conn.close()
+
+    @tornado.gen.coroutine
+    def warm(self):
+        yield self.run(lambda conn: None)
+
+    @tornado.gen.coroutine
+    def ping(self):
+        start = time.time()
+        try:
+            yield self.run(lambda conn: conn.execute("SELECT 1").fetchall())
+        except sqlite3.Error as e:
+            raise StorageError(str(e))
+        finally:
+            self.observe("ping", start)
+
+    @tornado.gen.coroutine
+    def write(self, query, durability, func):
+        """
+        Call func(conn) in a write transaction, committed with fsync for "hard"
+            durability. Raises WriteError, after rolling back, if it fails.
+        """
+        start = time.time()
+        try:
+            yield self.run(self._write, durability, func)
+        finally:
+            self.observe(query, start)
+
+    def _write(self, conn, durability, func):
+        try:
+            synchronous = "FULL" if durability == "hard" else "NORMAL"
+            if synchronous != self.synchronous:
+                conn.execute("PRAGMA synchronous=%s" % synchronous)
+                self.synchronous = synchronous
+            conn.execute("BEGIN IMMEDIATE")
+            try:
+                func(conn)
+            except Exception:
+                error = sys.exc_info()
+                try:
+                    conn.execute("ROLLBACK")
+                except sqlite3.Error:
+                    # SQLite already rolled back after some errors.
+                    pass
+                raise error[0], error[1], error[2]
+            conn.execute("COMMIT")
+        except sqlite3.Error as e:
+            raise WriteError("Write failed: %s" % e)
+
+    def row(self, table, doc):
+        derived = DERIVED_COLUMNS.get(table, {})
+        values = [column_value(doc["id"])]
+        for name in columns(table):
+            if name in derived:
+                values.append(derived[name](doc))
+            else:
+                values.append(column_value(doc.get(name)))
+        values.append(json.dumps(doc))
+        return values
+
+    def insert_sql(self, table, verb="INSERT"):
+        names = ["id"] + columns(table) + ["doc"]
+        return "%s INTO %s (%s) VALUES (%s)" % (verb, table, ", ".join(names),
+            ", ".join("?" * len(names)))
+
+    @tornado.gen.coroutine
+    def insert(self, table, docs, durability="hard"):
+        if not docs:
+            return
+        rows = []
+        for doc in docs:
+            if doc.get("id") is None:
+                doc = dict(doc, id=str(uuid.uuid4()))
+            rows.append(self.row(table, doc))
+        sql = self.insert_sql(table)
+        yield self.write("insert", durability, lambda conn: conn.executemany(sql, rows))
+
+    @tornado.gen.coroutine
+    def upsert(self, table, docs, durability="hard"):
+        if not docs:
+            return
+        merge = MERGES[table]
+        sql = self.insert_sql(table, "INSERT OR REPLACE")
+
+        def upsert_docs(conn):
+            for doc in docs:
+                existing = conn.execute("SELECT doc FROM %s WHERE id = ?" % table,
+                    (column_value(doc["id"]),)).fetchone()
+                if existing is not None:
+                    doc = merge(json.loads(existing[0]), doc)
+                conn.execute(sql, self.row(table, doc))
+        yield self.write("upsert", durability, upsert_docs)
+
+    @tornado.gen.coroutine
+    def replace(self, table, docs, durability="hard"):
+        if not docs:
+            return
+        rows = [self.row(table, doc) for doc in docs]
+        sql = self.insert_sql(table, "INSERT OR REPLACE")
+        yield self.write("replace", durability, lambda conn: conn.executemany(sql, rows))
+
+    @tornado.gen.coroutine
+    def get(self, table, id):
+        start = time.time()
+        row = yield self.run(lambda conn: conn.execute("SELECT doc FROM %s WHERE id = ?" %
+            table, (column_value(id),)).fetchone())
+        self.observe("get", start)
+        raise tornado.gen.Return(None if row is None else json.loads(row[0]))
+
+    @tornado.gen.coroutine
+    def delete(self, table, ids, durability="hard"):
+        if not ids:
+            return
+        keys = [column_value(id) for id in ids]
+
+        def delete_ids(conn):
+            for i in range(0, len(keys), DELETE_BATCH):
+                batch = keys[i:i + DELETE_BATCH]
+                conn.execute("DELETE FROM %s WHERE id IN (%s)" % (table,
+                    ", ".join("?" * len(batch))), batch)
+        yield self.write("delete", durability, delete_ids)
+
+    @tornado.gen.coroutine
+    def select(self, table, index, prefix=None, start=None, end=None, cursor=None,
+            limit=None, descending=False, operation="range"):
+        """
+        Read one page of a range index, see notouch.query.range_query.
+
+        The cursor condition repeats the bound on the time column, so that
+        SQLite seeks straight to the cursor instead of scanning up to it.
+        """
+        index_columns = INDEXES[table][index]
+        sqlite_index = "%s_%s" % (table, index)
+        prefix = list(prefix or [])
+        if isinstance(index_columns, dict):
+            if not prefix or prefix[0] not in index_columns:
+                raise StorageError("%s reads need a prefix length of %s." % (index,
+                    ", ".join(str(bits) for bits in sorted(index_columns))))
+            bits = prefix.pop(0)
+            index_columns = index_columns[bits]
+            sqlite_index = "%s_%d" % (sqlite_index, bits)
+        time_column = index_columns[-1]
+        where = ["%s IS NOT NULL" % time_column]
+        params = []
+        for name, value in zip(index_columns[:-1], prefix):
+            where.append("%s = ?" % name)
+            params.append(column_value(value))
+        if start is not None:
+            where.append("%s >= ?" % time_column)
+            params.append(start)
+        if end is not None:
+            where.append("%s < ?" % time_column)
+            params.append(end)
+        if cursor is not None:
+            op = "<" if descending else ">"
+            where.append("%s %s= ? AND (%s %s ? OR id %s ?)" % (time_column, op,
+                time_column, op, op))
+            params.extend([cursor[0], cursor[0], column_value(cursor[1])])
+
+        direction = "DESC" if descending else "ASC"
+        sql = "SELECT doc FROM %s INDEXED BY %s WHERE %s ORDER BY %s %s, id %s" % (
+            table, sqlite_index, " AND ".join(where), time_column, direction, direction)
+        if limit is not None:
+            sql += " LIMIT ?"
+            params.append(limit)
+
+        start_time = time.time()
+        rows = yield self.run(lambda conn: conn.execute(sql, params).fetchall())
+        self.observe(operation, start_time)
+        raise tornado.gen.Return([json.loads(doc) for doc, in rows])
+
+    @tornado.gen.coroutine
+    def range(self, table, index, without=None, **kwargs):
+        docs = yield self.select(table, index, **kwargs)
+        raise tornado.gen.Return(strip(docs, without))
+
+    @tornado.gen.coroutine
+    def stream(self, table, index, batch_rows=500, **kwargs):
+        raise tornado.gen.Return(SQLiteRangeCursor(self, table, index, batch_rows, **kwargs))
+
+    @tornado.gen.coroutine
+    def changes(self, table):
+        seq, = yield self.run(lambda conn: conn.execute(
+            "SELECT COALESCE(MAX(seq), 0) FROM %s" % table).fetchone())
+        raise tornado.gen.Return(SQLiteChangesCursor(self, table, seq, self.poll_interval))
@@ -1,7 +1,63 @@
 import rethinkdb
 import tornado.gen
 
-TABLES = ["dhcpack", "dhcpserverstats", "hosts"]
+TABLES = ["dhcpack", "dhcpserverstats", "dhcpserverstats_rollup", "hosts"]
+
+# Prefix lengths of the subnets acks are indexed under by leased address
+# (yiaddr_int, see notouch.ingest). The subnet index holds one entry per
+# length, [bits, network, ts, id], so the acks of a subnet of one of these
+# sizes between two times are a single range of it.
+SUBNET_BITS = [8, 16, 24, 32]
+
+# Secondary indexes per table, as name -> (index function, index_create options).
+#
+# Range indexes are compound and end with the time field and primary key so that
+# every entry is unique. That lets a query read a single contiguous index range
+# ordered by time and resume after the last row it returned (keyset pagination),
+# and a lookup on the leading field alone is just a range over its prefix.
+INDEXES = {
+	"dhcpack": {
+		"ts": (lambda ack: [ack["ts"], ack["id"]], {}),
+		"chaddr_ts": (lambda ack: [ack["chaddr"], ack["ts"], ack["id"]], {}),
+		"xid_ts": (lambda ack: [ack["xid"], ack["ts"], ack["id"]], {}),
+		"giaddr_ts": (lambda ack: [ack["giaddr"], ack["ts"], ack["id"]], {}),
+		"server_identifier_ts": (
+			lambda ack: ack["options"].filter({"op": 54}).map(
+				lambda option: [option["data"], ack["ts"], ack["id"]]),
+			{"multi": True}),
+		"yiaddr_subnet_ts": (
+			lambda ack: rethinkdb.expr([[bits, 2 ** (32 - bits)] for bits in SUBNET_BITS]).map(
+				lambda subnet: [subnet[0], ack["yiaddr_int"] - ack["yiaddr_int"].mod(subnet[1]),
+					ack["ts"], ack["id"]]),
+			{"multi": True}),
+	},
+	"dhcpserverstats": {
+		"timestamp_start": (lambda stats: [stats["timestamp_start"], stats["id"]], {}),
+		"server_ip_ts": (
+			lambda stats: [stats["server_ip"], stats["timestamp_start"], stats["id"]], {}),
+	},
+	"hosts": {
+		"last_seen": (lambda host: [host["last_seen"], host["id"]], {}),
+		"yiaddr_ts": (lambda host: [host["yiaddr"], host["last_seen"], host["id"]], {}),
+		"hostname_ts": (lambda host: [host["hostname"], host["last_seen"], host["id"]], {}),
+		"giaddr_ts": (lambda host: [host["giaddr"], host["last_seen"], host["id"]], {}),
+	},
+	# Rollups are always read at one resolution, so it leads every index.
+	"dhcpserverstats_rollup": {
+		"bucket": (lambda rollup: [rollup["resolution"], rollup["bucket"], rollup["id"]], {}),
+		"server_ip_ts": (lambda rollup: [rollup["resolution"], rollup["server_ip"],
+			rollup["bucket"], rollup["id"]], {}),
+	},
+}
+
+# How long rows stay in each table before the retention task (see
+# notouch.retention) archives and deletes them, and the [time, id] index and
+# time field that define their age.
+RETENTION = {
+	"dhcpack": {"days": 30, "index": "ts", "time_field": "ts"},
+	"dhcpserverstats": {"days": 30, "index": "timestamp_start",
+		"time_field": "timestamp_start"},
+}
 
 def create_database(host, port, db):
 	"""
@@ -16,8 +72,15 @@ def create_database(host, port, db):
 		if table not in discovered_tables:
 			rethinkdb.db(db).table_create(table).run(conn)
 
+	for table, indexes in INDEXES.items():
+		discovered_indexes = rethinkdb.db(db).table(table).index_list().run(conn)
+		for name, (index_function, options) in indexes.items():
+			if name not in discovered_indexes:
+				rethinkdb.db(db).table(table).index_create(name, index_function,
+					**options).run(conn)
+		rethinkdb.db(db).table(table).index_wait().run(conn)
+
 	return conn
-	# TODO: Create indexes here.
 
 
 def drop_database(rethinkdb_conn, db, testing=False):
@@ -0,0 +1,74 @@
+"""
+Columnar, dictionary encoded batches of acks.
+
+Acks in a batch share most of their content. Every ack repeats the same field
+names, and usually the same server, relay, router, DNS and NTP addresses and
+the same dozen options. A columnar batch states each of those once and refers
+to them by index:
+
+{
+    "version": 1,
+    "fields": ["ts", "chaddr", "yiaddr", ...],
+    "values": ["2015-01-01 00:00:00.000000", "00:00:00:00:00:00", 2, ...],
+    "options": [[53, "dhcp_message_type", "dhcpack"], [54, "server_identifier",
+        "10.X.X.X"], ...],
+    "rows": [[0, 1, 3, ..., [0, 1, ...]], ...]
+}
+
+fields - The names of the top-level fields, other than options.
+values - Every distinct field value in the batch, strings and numbers alike.
+options - Every distinct (op, name, data) option in the batch.
+rows - One per ack, holding the index in values of each field in fields
+    (null if the ack doesn't have it), followed by the list of indexes in
+    options of the ack's options, in order.
+
+Batches are sent as JSON with Content-Type COLUMNAR_CONTENT_TYPE and can be
+gzip compressed like any other body (see notouch.codec). They are encoded by
+the agent's scripts/dhcp_wire.py, the only encoder. A batch of a version this
+server doesn't know is rejected, so the format can change without new agents
+being misread by old servers.
+"""
+VERSION = 1
+COLUMNAR_CONTENT_TYPE = "application/vnd.notouch.columnar+json"
+
+
+class WireError(ValueError):
+    """
+    A malformed columnar batch.
+    """
+
+
+def decode(batch):
+    """
+    Decode a columnar batch into a list of acks, raising WireError if it is
+        malformed or of an unknown version.
+    """
+    if not isinstance(batch, dict):
+        raise WireError("Columnar batch must be an object.")
+    if batch.get("version") != VERSION:
+        raise WireError("Unsupported columnar batch version: %s" % batch.get("version"))
+    try:
+        fields = batch["fields"]
+        values = batch["values"]
+        options = [{"op": op, "name": name, "data": data}
+            for op, name, data in batch["options"]]
+        rows = batch["rows"]
+    except (KeyError, TypeError, ValueError):
+        raise WireError("Columnar batch must have fields, values, options and rows.")
+
+    width = len(fields)
+    docs = []
+    try:
+        for row in rows:
+            if len(row) != width + 1:
+                raise WireError("Columnar rows must have %d entries." % (width + 1))
+            indexes = [index for index in row[:width] if index is not None]
+            if any(index < 0 for index in indexes + list(row[width])):
+                raise WireError("Columnar row %d has a negative index." % len(docs))
+            doc = dict((field, values[index]) for field, index in zip(fields, row)
+                if index is not None)
+            doc["options"] = [dict(options[index]) for index in row[width]]
+            docs.append(doc)
+    except (IndexError, TypeError):
+        raise WireError("Columnar row %d refers to a missing value or option." % len(docs))
+    return docs
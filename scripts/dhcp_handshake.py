@@ -0,0 +1,175 @@
+"""
+DHCP Handshake - Per-phase latency of DHCP handshakes, tracked by xid.
+
+A client's DISCOVER, the server's OFFER, the client's REQUEST and the server's
+ACK share an xid. HandshakeTracker follows each (xid, chaddr) through them and
+times every phase:
+
+offer - DISCOVER to OFFER, the server (and relay) answering.
+request - OFFER to REQUEST, the client choosing the offer.
+ack - REQUEST to ACK, the server (and relay) committing the lease. Renewals,
+    which start at the REQUEST, are timed from there.
+handshake - DISCOVER to ACK, the whole exchange an installer waits for.
+
+Each interval's server_stats carry a histogram per phase (counts of latencies
+up to each of LATENCY_BUCKETS_MS, and above the last), a histogram per relay
+(giaddr) of the offer and ack phases, where the server is answering through
+that relay, and the handshakes that failed:
+
+no_offer, no_request, no_ack - Handshakes that got no further than the
+    previous phase within the timeout, or were evicted to keep the table
+    under max_handshakes.
+nak - Handshakes the server refused.
+
+The table of handshakes in flight is bounded and expires entries, so a storm
+of DISCOVERs that are never answered costs at most max_handshakes entries. The
+bucket bounds, phases and failures are notouch.latency's, which the server
+validates the histograms with.
+"""
+import bisect
+import calendar
+import collections
+import time
+
+from notouch.latency import FAILURES, LATENCY_BUCKETS_MS, PHASES
+
+# Phase a handshake is in -> the failure counted if it goes no further.
+PHASE_FAILURES = {
+    "discover": "no_offer",
+    "offer": "no_request",
+    "request": "no_ack",
+}
+
+# Epoch seconds of the dates seen in packet timestamps.
+day_seconds = {}
+
+
+def parse_ts(ts):
+    """
+    Epoch seconds of a "YYYY-MM-DD HH:MM:SS.ffffff" packet timestamp,
+    raising ValueError if it isn't one.
+    """
+    day = day_seconds.get(ts[:10])
+    if day is None:
+        if len(day_seconds) > 16:
+            day_seconds.clear()
+        day = day_seconds[ts[:10]] = calendar.timegm(time.strptime(ts[:10], "%Y-%m-%d"))
+    return day + int(ts[11:13]) * 3600 + int(ts[14:16]) * 60 + float(ts[17:])
+
+
+def new_histogram():
+    return [0] * (len(LATENCY_BUCKETS_MS) + 1)
+
+
+class LatencyStats(object):
+    """
+    The latency histograms and failures of one interval.
+    """
+    def __init__(self):
+        self.phases = dict((phase, new_histogram()) for phase in PHASES)
+        self.relays = {}
+        self.failures = dict((failure, 0) for failure in FAILURES)
+
+    def record(self, phase, seconds, relay=None):
+        bucket = bisect.bisect_left(LATENCY_BUCKETS_MS, max(seconds, 0) * 1000)
+        self.phases[phase][bucket] += 1
+        if relay is not None and phase in ("offer", "ack"):
+            histogram = self.relays.get(relay)
+            if histogram is None:
+                histogram = self.relays[relay] = new_histogram()
+            histogram[bucket] += 1
+
+    def fail(self, failure):
+        self.failures[failure] += 1
+
+    def summary(self):
+        """
+        The server_stats fields of the interval.
+        """
+        return {
+            "latency": self.phases,
+            "relay_latency": self.relays,
+            "handshakes_failed": self.failures,
+        }
+
+
+class Handshake(object):
+    __slots__ = ("started", "phase", "last", "relay", "full")
+
+    def __init__(self, started, phase, relay):
+        self.started = started
+        self.phase = phase
+        self.last = started
+        self.relay = relay
+        # Started at the DISCOVER, rather than at a renewal's REQUEST.
+        self.full = phase == "discover"
+
+
+class HandshakeTracker(object):
+    def __init__(self, timeout=60.0, max_handshakes=10000):
+        """
+        timeout - Seconds after which a handshake in flight counts as failed.
+        max_handshakes - Handshakes tracked at once, the oldest is counted as
+            failed to make room for a new one.
+        """
+        self.timeout = timeout
+        self.max_handshakes = max_handshakes
+        # (xid, chaddr) -> Handshake, oldest first.
+        self.handshakes = collections.OrderedDict()
+
+    def add(self, packet, stats):
+        """
+        Follow a packet's handshake, recording latencies and failures in a
+        LatencyStats.
+        """
+        opname = packet.opname
+        if opname not in ("dhcpdiscover", "dhcpoffer", "dhcprequest", "dhcpack", "dhcpnak"):
+            return
+        try:
+            ts = parse_ts(packet.ts)
+        except ValueError:
+            return
+        self.expire(ts, stats)
+
+        key = (packet.xid, packet.chaddr)
+        handshake = self.handshakes.get(key)
+        if handshake is None:
+            # Retransmitted DISCOVERs keep timing from the first.
+            if opname == "dhcpdiscover":
+                self.start(key, Handshake(ts, "discover", packet.giaddr), stats)
+            elif opname == "dhcprequest":
+                self.start(key, Handshake(ts, "request", packet.giaddr), stats)
+            return
+
+        if opname == "dhcpoffer" and handshake.phase == "discover":
+            stats.record("offer", ts - handshake.last, handshake.relay)
+            handshake.phase, handshake.last = "offer", ts
+        elif opname == "dhcprequest" and handshake.phase == "offer":
+            stats.record("request", ts - handshake.last)
+            handshake.phase, handshake.last = "request", ts
+        elif opname == "dhcpack" and handshake.phase == "request":
+            stats.record("ack", ts - handshake.last, handshake.relay)
+            if handshake.full:
+                stats.record("handshake", ts - handshake.started)
+            del self.handshakes[key]
+        elif opname == "dhcpnak":
+            stats.fail("nak")
+            del self.handshakes[key]
+
+    def start(self, key, handshake, stats):
+        if len(self.handshakes) >= self.max_handshakes:
+            _, oldest = self.handshakes.popitem(last=False)
+            stats.fail(PHASE_FAILURES[oldest.phase])
+        self.handshakes[key] = handshake
+
+    def expire(self, now, stats):
+        """
+        Count the handshakes started over timeout seconds before now as failed.
+        """
+        while self.handshakes:
+            key = next(iter(self.handshakes))
+            handshake = self.handshakes[key]
+            if handshake.started > now - self.timeout:
+                break
+            del self.handshakes[key]
+            stats.fail(PHASE_FAILURES[handshake.phase])
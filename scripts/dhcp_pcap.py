@@ -0,0 +1,420 @@
+"""
+DHCP Pcap Decoder - Decode raw BOOTP/DHCP packets without dhcpdump.
+
+Packets are read either from a pcap capture file (or a pcap stream such as the
+output of `tcpdump -i eth0 -w - udp port 67 or udp port 68`) or from a raw
+AF_PACKET socket bound to an interface, and decoded with struct into the same
+Packet records produced by notouch.dhcpdump.parse_entry.
+
+Unlike the dhcpdump text output nothing is truncated: chaddr uses the full
+hardware address length from the packet and every option is kept, with values
+formatted the way dhcpdump prints them (dotted IPs, "3d12h" durations, message
+type names) so stored documents look the same whichever source produced them.
+
+Offline mode makes the decoder easy to test and benchmark:
+
+> python dhcp_pcap.py capture.pcap
+"""
+import ctypes
+import datetime
+import errno
+import fcntl
+import json
+import socket
+import struct
+import sys
+import time
+
+from notouch.packet import Packet
+
+PCAP_HEADER = struct.Struct("<IHHiIII")
+PCAP_MAGIC_MICROSECONDS = 0xa1b2c3d4
+PCAP_MAGIC_NANOSECONDS = 0xa1b23c4d
+
+LINKTYPE_ETHERNET = 1
+LINKTYPE_RAW = 101
+LINKTYPE_LINUX_SLL = 113
+LINKTYPE_IPV4 = 228
+
+ETHERTYPE_IPV4 = 0x0800
+ETHERTYPE_VLAN = (0x8100, 0x88a8)
+ETH_P_IP = 0x0800
+SIOCGIFADDR = 0x8915
+SO_ATTACH_FILTER = 26
+IPPROTO_UDP = 17
+DHCP_PORTS = (67, 68)
+
+ETHERNET_HEADER = struct.Struct("!6s6sH")
+SLL_HEADER = struct.Struct("!HHH8sH")
+IPV4_HEADER = struct.Struct("!BBHHHBBH4s4s")
+UDP_HEADER = struct.Struct("!HHHH")
+BOOTP_HEADER = struct.Struct("!BBBBIHH4s4s4s4s16s64s128s")
+MAC_ADDRESS = struct.Struct("6B")
+
+# Classic BPF program, as (code, jt, jf, k), accepting the Ethernet frames of
+# unfragmented IPv4 UDP datagrams from or to port 67 or 68: the IPv4 part of
+# `tcpdump udp port 67 or udp port 68`. Attached to the capture socket, the
+# kernel drops every other frame instead of copying it to the agent to be
+# thrown away after decoding.
+DHCP_FILTER = [
+    (0x28, 0, 0, 12),           # ldh [12]            ethertype
+    (0x15, 0, 12, ETH_P_IP),    # jeq #0x800          else drop
+    (0x30, 0, 0, 23),           # ldb [23]            IP protocol
+    (0x15, 0, 10, IPPROTO_UDP), # jeq #17             else drop
+    (0x28, 0, 0, 20),           # ldh [20]            flags and fragment offset
+    (0x45, 8, 0, 0x1fff),       # jset #0x1fff        drop
+    (0xb1, 0, 0, 14),           # ldxb 4*([14]&0xf)   IP header length
+    (0x48, 0, 0, 14),           # ldh [x + 14]        source port
+    (0x15, 4, 0, 67),           # jeq #67             accept
+    (0x15, 3, 0, 68),           # jeq #68             accept
+    (0x48, 0, 0, 16),           # ldh [x + 16]        destination port
+    (0x15, 1, 0, 67),           # jeq #67             accept
+    (0x15, 0, 1, 68),           # jeq #68             accept, else drop
+    (0x06, 0, 0, 0x40000),      # ret #262144         accept
+    (0x06, 0, 0, 0),            # ret #0              drop
+]
+SOCK_FILTER = struct.Struct("HBBI")
+UINT32 = struct.Struct("!I")
+INTEGERS = {1: struct.Struct("!B"), 2: struct.Struct("!H"), 4: struct.Struct("!i")}
+DHCP_MAGIC_COOKIE = "\x63\x82\x53\x63"
+
+MESSAGE_TYPES = {
+    1: "dhcpdiscover",
+    2: "dhcpoffer",
+    3: "dhcprequest",
+    4: "dhcpdecline",
+    5: "dhcpack",
+    6: "dhcpnak",
+    7: "dhcprelease",
+    8: "dhcpinform",
+}
+
+# Option names as printed by dhcpdump, in the normalized form parse_entry
+# stores, along with how their data is formatted.
+OPTIONS = {
+    1: ("subnet_mask", "ip"),
+    2: ("time_offset", "int"),
+    3: ("routers", "ip"),
+    4: ("time_server", "ip"),
+    5: ("name_server", "ip"),
+    6: ("dns_server", "ip"),
+    7: ("log_server", "ip"),
+    12: ("host_name", "string"),
+    13: ("boot_file_size", "int"),
+    15: ("domainname", "string"),
+    17: ("root_path", "string"),
+    26: ("interface_mtu", "int"),
+    28: ("broadcast_address", "ip"),
+    33: ("static_route", "ip"),
+    40: ("nis_domain", "string"),
+    42: ("ntp_servers", "ip"),
+    43: ("vendor_specific_info", "hex"),
+    44: ("netbios_name_server", "ip"),
+    50: ("request_ip_address", "ip"),
+    51: ("ip_address_leasetime", "duration"),
+    53: ("dhcp_message_type", "message_type"),
+    54: ("server_identifier", "ip"),
+    56: ("message", "string"),
+    58: ("t1", "duration"),
+    59: ("t2", "duration"),
+    60: ("vendor_class_identifier", "string"),
+    61: ("client-identifier", "hex"),
+    66: ("tftp_server_name", "string"),
+    67: ("bootfile_name", "string"),
+    81: ("client_fqdn", "hex"),
+    82: ("relay_agent_information", "hex"),
+    119: ("domain_search", "hex"),
+    121: ("classless_static_route", "hex"),
+}
+
+# Options parse_entry leaves out of the packet.
+SKIPPED_OPTIONS = frozenset([55, 57, 93, 94, 97])
+
+
+def format_mac(data):
+    if len(data) == 6:
+        return "%02x:%02x:%02x:%02x:%02x:%02x" % MAC_ADDRESS.unpack(data)
+    return ":".join("%02x" % ord(byte) for byte in data)
+
+
+def format_duration(seconds):
+    """
+    Format a number of seconds the way dhcpdump does, e.g. 302400 -> "3d12h".
+    """
+    parts = []
+    for unit, size in (("d", 86400), ("h", 3600), ("m", 60), ("s", 1)):
+        if seconds >= size:
+            parts.append("%d%s" % (seconds // size, unit))
+            seconds %= size
+    return "".join(parts) or "0s"
+
+
+def format_ip(data):
+    if len(data) == 4:
+        return socket.inet_ntoa(data)
+    return ",".join(socket.inet_ntoa(data[i:i + 4]) for i in range(0, len(data) - 3, 4))
+
+
+def format_duration_option(data):
+    if len(data) != 4:
+        return format_mac(data)
+    return format_duration(UINT32.unpack(data)[0])
+
+
+def format_message_type(data):
+    if len(data) != 1:
+        return format_mac(data)
+    return MESSAGE_TYPES.get(ord(data), str(ord(data)))
+
+
+def format_int(data):
+    if len(data) not in INTEGERS:
+        return format_mac(data)
+    return str(INTEGERS[len(data)].unpack(data)[0])
+
+
+def format_string(data):
+    return data.rstrip("\x00")
+
+
+FORMATTERS = {
+    "ip": format_ip,
+    "duration": format_duration_option,
+    "message_type": format_message_type,
+    "int": format_int,
+    "string": format_string,
+    "hex": format_mac,
+}
+
+# op -> (name, formatter) for every known option.
+OPTION_DECODERS = dict((op, (name, FORMATTERS[kind])) for op, (name, kind) in OPTIONS.items())
+
+
+def format_ts(ts):
+    return datetime.datetime.utcfromtimestamp(ts).strftime("%Y-%m-%d %H:%M:%S.%f")
+
+
+def format_name(data):
+    name = data.split("\x00", 1)[0]
+    return name if name else "."
+
+
+def decode_options(data, offset):
+    """
+    Decode the DHCP options starting at offset into a list of (op, name, data)
+    tuples, as stored in Packet.options.
+    """
+    options = []
+    end = len(data)
+    while offset < end:
+        op = ord(data[offset])
+        if op == 0:
+            offset += 1
+            continue
+        if op == 255 or offset + 1 >= end:
+            break
+        length = ord(data[offset + 1])
+        value = data[offset + 2:offset + 2 + length]
+        offset += 2 + length
+        if op in SKIPPED_OPTIONS:
+            continue
+        name, formatter = OPTION_DECODERS.get(op, ("option_%d" % op, format_mac))
+        options.append((op, name, formatter(value)))
+    return options
+
+
+def decode_bootp(payload, ts, ip_src, ip_dst, mac_src, mac_dst):
+    """
+    Decode a BOOTP/DHCP UDP payload into a Packet, or None if the payload
+        is not a valid BOOTP message.
+    """
+    if len(payload) < BOOTP_HEADER.size:
+        return None
+    (op, htype, hlen, hops, xid, secs, flags, ciaddr, yiaddr, siaddr, giaddr, chaddr, sname,
+        fname) = BOOTP_HEADER.unpack_from(payload)
+
+    options = []
+    offset = BOOTP_HEADER.size
+    if payload[offset:offset + 4] == DHCP_MAGIC_COOKIE:
+        options = decode_options(payload, offset + 4)
+
+    packet = Packet()
+    packet.ts = format_ts(ts)
+    packet.ip_src = ip_src
+    packet.mac_src = mac_src
+    packet.ip_dst = ip_dst
+    packet.mac_dst = mac_dst
+    packet.op = op
+    packet.htype = htype
+    packet.hlen = hlen
+    packet.hops = hops
+    packet.xid = "%08x" % xid
+    packet.secs = secs
+    packet.flags = "%04x" % flags
+    packet.ciaddr = socket.inet_ntoa(ciaddr)
+    packet.yiaddr = socket.inet_ntoa(yiaddr)
+    packet.siaddr = socket.inet_ntoa(siaddr)
+    packet.giaddr = socket.inet_ntoa(giaddr)
+    packet.chaddr = format_mac(chaddr[:min(hlen, 16)])
+    packet.sname = format_name(sname)
+    packet.fname = format_name(fname)
+    packet.options = options
+    packet.opname = packet.option(53, "")
+    return packet
+
+
+def decode_frame(linktype, frame, ts):
+    """
+    Decode a captured link layer frame into a Packet, or None if it isn't
+        an IPv4 UDP DHCP packet. Everything else is rejected using the fixed
+        offset headers only, so unrelated traffic is cheap to skip.
+    """
+    mac_src = mac_dst = ""
+    if linktype == LINKTYPE_ETHERNET:
+        if len(frame) < ETHERNET_HEADER.size:
+            return None
+        dst, src, ethertype = ETHERNET_HEADER.unpack_from(frame)
+        offset = ETHERNET_HEADER.size
+        while ethertype in ETHERTYPE_VLAN and len(frame) >= offset + 4:
+            ethertype = struct.unpack_from("!H", frame, offset + 2)[0]
+            offset += 4
+        if ethertype != ETHERTYPE_IPV4:
+            return None
+        mac_src, mac_dst = format_mac(src), format_mac(dst)
+    elif linktype == LINKTYPE_LINUX_SLL:
+        if len(frame) < SLL_HEADER.size:
+            return None
+        _, _, addrlen, addr, ethertype = SLL_HEADER.unpack_from(frame)
+        if ethertype != ETHERTYPE_IPV4:
+            return None
+        mac_src = format_mac(addr[:min(addrlen, 8)])
+        offset = SLL_HEADER.size
+    elif linktype in (LINKTYPE_RAW, LINKTYPE_IPV4):
+        offset = 0
+    else:
+        return None
+
+    if len(frame) < offset + IPV4_HEADER.size:
+        return None
+    (version_ihl, _, _, _, fragment, _, protocol, _, src, dst) = IPV4_HEADER.unpack_from(
+        frame, offset)
+    # Only unfragmented IPv4 UDP, fragments don't carry a complete BOOTP message.
+    if version_ihl >> 4 != 4 or protocol != IPPROTO_UDP or fragment & 0x3fff:
+        return None
+    offset += (version_ihl & 0x0f) * 4
+
+    if len(frame) < offset + UDP_HEADER.size:
+        return None
+    sport, dport, _, _ = UDP_HEADER.unpack_from(frame, offset)
+    if sport not in DHCP_PORTS and dport not in DHCP_PORTS:
+        return None
+
+    return decode_bootp(frame[offset + UDP_HEADER.size:], ts, socket.inet_ntoa(src),
+        socket.inet_ntoa(dst), mac_src, mac_dst)
+
+
+def read_pcap(stream):
+    """
+    Yield (timestamp, linktype, frame) for each record of a pcap file or stream.
+    """
+    header = stream.read(PCAP_HEADER.size)
+    if len(header) < PCAP_HEADER.size:
+        return
+    magic = struct.unpack("<I", header[:4])[0]
+    endian = "<"
+    if magic not in (PCAP_MAGIC_MICROSECONDS, PCAP_MAGIC_NANOSECONDS):
+        endian = ">"
+        magic = struct.unpack(">I", header[:4])[0]
+        if magic not in (PCAP_MAGIC_MICROSECONDS, PCAP_MAGIC_NANOSECONDS):
+            raise ValueError("Not a pcap file (magic %08x)." % magic)
+    scale = 1e-9 if magic == PCAP_MAGIC_NANOSECONDS else 1e-6
+    linktype = struct.unpack(endian + "I", header[20:24])[0] & 0x0fffffff
+
+    record = struct.Struct(endian + "IIII")
+    while True:
+        record_header = stream.read(record.size)
+        if len(record_header) < record.size:
+            return
+        seconds, fraction, captured, _ = record.unpack(record_header)
+        frame = stream.read(captured)
+        if len(frame) < captured:
+            return
+        yield seconds + fraction * scale, linktype, frame
+
+
+def attach_filter(sock, program):
+    """
+    Attach a classic BPF program, a list of (code, jt, jf, k), to a socket.
+    """
+    instructions = ctypes.create_string_buffer(
+        "".join(SOCK_FILTER.pack(*instruction) for instruction in program))
+    # struct sock_fprog, the length and a pointer to the instructions.
+    fprog = struct.pack("HL", len(program), ctypes.addressof(instructions))
+    sock.setsockopt(socket.SOL_SOCKET, SO_ATTACH_FILTER, fprog)
+
+
+def open_socket(interface):
+    """
+    Open a raw AF_PACKET socket receiving the DHCP frames on interface, see
+        DHCP_FILTER. Requires Linux and CAP_NET_RAW.
+    """
+    # Created with no protocol so it receives nothing until bound, by which
+    # time the filter is in place.
+    sock = socket.socket(socket.AF_PACKET, socket.SOCK_RAW, 0)
+    try:
+        attach_filter(sock, DHCP_FILTER)
+        sock.bind((interface, ETH_P_IP))
+    except Exception:
+        sock.close()
+        raise
+    return sock
+
+
+def interface_address(interface):
+    """
+    The IPv4 address of interface, or None if it has none (or this isn't
+        Linux).
+    """
+    sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+    try:
+        request = struct.pack("256s", interface[:15])
+        response = fcntl.ioctl(sock.fileno(), SIOCGIFADDR, request)
+        return socket.inet_ntoa(response[20:24])
+    except (IOError, OSError):
+        return None
+    finally:
+        sock.close()
+
+
+def receive(sock, snaplen=65535, max_frames=1000):
+    """
+    Return (timestamp, linktype, frame) for the frames already waiting on
+        sock, up to max_frames, without blocking.
+    """
+    frames = []
+    while len(frames) < max_frames:
+        try:
+            frame = sock.recv(snaplen, socket.MSG_DONTWAIT)
+        except socket.error as e:
+            if e.errno in (errno.EAGAIN, errno.EWOULDBLOCK, errno.EINTR):
+                break
+            raise
+        frames.append((time.time(), LINKTYPE_ETHERNET, frame))
+    return frames
+
+
+def packets(frames):
+    """
+    Decode (timestamp, linktype, frame) tuples into DHCP Packets,
+        skipping anything that isn't DHCP.
+    """
+    for ts, linktype, frame in frames:
+        packet = decode_frame(linktype, frame, ts)
+        if packet is not None:
+            yield packet
+
+
+if __name__ == "__main__":
+    with open(sys.argv[1], "rb") as pcap:
+        for packet in packets(read_pcap(pcap)):
+            print json.dumps(packet.to_dict())
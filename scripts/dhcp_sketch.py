@@ -0,0 +1,124 @@
+"""
+DHCP Sketch - Per-client packet counts in bounded memory (--max_clients).
+
+By default an agent's server_stats count every opname for every chaddr seen
+in the interval, which during a mass reimage or a broadcast storm means an
+entry, and a line of the upload, for each of thousands of clients.
+ClientCounters instead keeps exact counts for at most max_clients clients,
+meant to be the noisiest, and summarizes everyone else:
+
+* A count-min sketch estimates the packets of clients that aren't tracked,
+  so that one that turns out to be noisier than the quietest tracked client
+  takes its place, as in Space-Saving. The evicted client's counts move to
+  the tail totals.
+* A HyperLogLog (see notouch.sketch) estimates the number of distinct
+  clients.
+* The tail's packets are totalled per opname.
+
+The counts of a tracked client are exact from the packet it started being
+tracked with, which for all but clients promoted out of the tail is its first.
+Memory is bounded by max_clients plus the two sketches, about 36KB.
+"""
+import array
+import heapq
+import zlib
+
+from notouch.sketch import HyperLogLog
+
+OPNAMES = ["dhcpack", "dhcpoffer", "dhcprequest", "dhcpdiscover"]
+
+
+class CountMinSketch(object):
+    def __init__(self, width=2048, depth=4):
+        self.width = width
+        self.depth = depth
+        self.rows = [array.array("i", [0]) * width for _ in range(depth)]
+
+    def add(self, key, count=1):
+        """
+        Count key and return its new estimate. Only the cells holding the
+            current estimate are raised (conservative update), which keeps
+            the estimates of rare keys from growing with everyone else's.
+        """
+        cells = [(row, (zlib.crc32(key, seed) & 0xffffffff) % self.width)
+            for seed, row in enumerate(self.rows)]
+        estimate = min(row[i] for row, i in cells) + count
+        for row, i in cells:
+            if row[i] < estimate:
+                row[i] = estimate
+        return estimate
+
+    def estimate(self, key):
+        return min(row[(zlib.crc32(key, seed) & 0xffffffff) % self.width]
+            for seed, row in enumerate(self.rows))
+
+
+def new_counts():
+    return dict((opname, 0) for opname in OPNAMES)
+
+
+class ClientCounters(object):
+    def __init__(self, max_clients):
+        self.max_clients = max_clients
+        self.clients = {}
+        # Estimated packets of promoted clients from before they were tracked.
+        self.untracked = {}
+        self.tail = new_counts()
+        self.sketch = CountMinSketch()
+        self.distinct = HyperLogLog()
+        # (rank, chaddr) of the tracked clients. Ranks only grow, so an entry
+        # is a lower bound and is refreshed when it reaches the top.
+        self.heap = []
+
+    def rank(self, chaddr):
+        return self.untracked.get(chaddr, 0) + sum(self.clients[chaddr].values())
+
+    def add(self, chaddr, opname):
+        self.distinct.add(chaddr)
+        estimate = self.sketch.add(chaddr)
+        counts = self.clients.get(chaddr)
+        if counts is None:
+            if len(self.clients) >= self.max_clients:
+                if estimate <= self.heap[0][0] or not self.evict(estimate):
+                    self.tail[opname] += 1
+                    return
+                self.untracked[chaddr] = estimate - 1
+            counts = self.clients[chaddr] = new_counts()
+            heapq.heappush(self.heap, (estimate, chaddr))
+        counts[opname] += 1
+
+    def evict(self, estimate):
+        """
+        Stop tracking the quietest client if a client with estimate packets is
+            noisier, moving its counts to the tail.
+        """
+        while True:
+            rank, quietest = self.heap[0]
+            current = self.rank(quietest)
+            if current == rank:
+                break
+            heapq.heapreplace(self.heap, (current, quietest))
+        if estimate <= rank:
+            return False
+        heapq.heappop(self.heap)
+        for opname, count in self.clients.pop(quietest).items():
+            self.tail[opname] += count
+        self.untracked.pop(quietest, None)
+        return True
+
+    def summary(self):
+        """
+        The server_stats fields describing the clients seen.
+
+        clients - Counts per opname of the tracked clients.
+        clients_other - Counts per opname of every other client.
+        client_count - Estimated number of distinct clients.
+        client_sketch - The encoded HyperLogLog of every client, which the
+            server merges into its rollups (see notouch.rollup).
+        """
+        return {
+            "clients": self.clients,
+            "clients_other": self.tail,
+            "client_count": max(self.distinct.count(), len(self.clients)),
+            "client_sketch": self.distinct.encode(),
+        }
@@ -0,0 +1,221 @@
+"""
+DHCP Uploader - Background delivery of agent batches to the notouch server.
+
+The capture loop hands encoded batches to Uploader.submit, which never waits
+on the network: batches go onto a bounded in-memory queue drained by a worker
+thread. The worker posts them over a keep-alive requests.Session, retrying
+failures with exponential backoff. A batch that still can't be delivered, or
+that doesn't fit in the queue, is written to the spool directory, and spooled
+batches are replayed oldest first once the server accepts requests again.
+
+The capture thread spools batches when the queue is full while the worker
+replays them, so the spool and the counters are only touched under a lock.
+"""
+import errno
+import os
+import Queue
+import random
+import threading
+import time
+import uuid
+
+import requests
+
+
+class Uploader(object):
+    def __init__(self, spool_dir=None, queue_size=100, timeout=10.0, max_retries=5,
+            initial_backoff=0.5, max_backoff=30.0, max_spool_bytes=512 * 1024 * 1024):
+        self.spool_dir = spool_dir
+        self.timeout = timeout
+        self.max_retries = max_retries
+        self.initial_backoff = initial_backoff
+        self.max_backoff = max_backoff
+        self.max_spool_bytes = max_spool_bytes
+
+        self.queue = Queue.Queue(queue_size)
+        self.session = requests.Session()
+        adapter = requests.adapters.HTTPAdapter(pool_connections=1, pool_maxsize=2)
+        self.session.mount("http://", adapter)
+        self.session.mount("https://", adapter)
+
+        self.worker = threading.Thread(target=self._run, name="uploader")
+        self.worker.daemon = True
+        # Guards the spool directory and the counters below.
+        self.lock = threading.Lock()
+
+        self.sent = 0
+        self.failed = 0
+        self.spooled = 0
+        self.dropped = 0
+
+        if self.spool_dir is not None and not os.path.isdir(self.spool_dir):
+            os.makedirs(self.spool_dir)
+
+    def start(self):
+        self.worker.start()
+
+    def stop(self, timeout=None):
+        """
+        Deliver what is queued (spooling whatever can't be sent) and stop the
+        worker.
+        """
+        self.queue.put(None)
+        self.worker.join(timeout)
+        self.session.close()
+
+    def submit(self, url, body, headers):
+        """
+        Queue a batch for delivery. Never blocks: when the queue is full the
+        batch goes straight to the spool.
+        """
+        try:
+            self.queue.put_nowait((url, body, headers))
+        except Queue.Full:
+            self._spool(url, body, headers)
+
+    def stats(self):
+        with self.lock:
+            return {
+                "queued": self.queue.qsize(),
+                "sent": self.sent,
+                "failed": self.failed,
+                "spooled": self.spooled,
+                "dropped": self.dropped,
+            }
+
+    def _count(self, counter):
+        with self.lock:
+            setattr(self, counter, getattr(self, counter) + 1)
+
+    def _run(self):
+        while True:
+            item = self.queue.get()
+            try:
+                if item is None:
+                    self._drain()
+                    self._replay()
+                    return
+                url, body, headers = item
+                if self._send(url, body, headers, retries=self.max_retries):
+                    self._replay()
+                else:
+                    self._spool(url, body, headers)
+            except Exception as e:
+                # Keep the worker alive, or nothing would be uploaded again.
+                print "Error uploading batches: %s" % e
+                if item is None:
+                    return
+
+    def _drain(self):
+        # On shutdown make a single attempt per batch and spool the rest.
+        while True:
+            try:
+                item = self.queue.get_nowait()
+            except Queue.Empty:
+                return
+            if item is not None and not self._send(*item, retries=0):
+                self._spool(*item)
+
+    def _send(self, url, body, headers, retries):
+        backoff = self.initial_backoff
+        for attempt in xrange(retries + 1):
+            try:
+                response = self.session.post(url, data=body, headers=headers,
+                    timeout=self.timeout)
+                # Client errors won't succeed on a retry, don't spool them either.
+                if response.status_code < 500:
+                    if response.status_code >= 400:
+                        print "Batch rejected by %s: %s %s" % (
+                            url, response.status_code, response.text[:200])
+                        self._count("dropped")
+                    else:
+                        self._count("sent")
+                    return True
+                error = "HTTP %s" % response.status_code
+            except requests.RequestException as e:
+                error = e
+            self._count("failed")
+            if attempt < retries:
+                print "Error sending batch to %s (%s), retrying in %.1fs." % (
+                    url, error, backoff)
+                time.sleep(backoff * random.uniform(0.5, 1.0))
+                backoff = min(backoff * 2, self.max_backoff)
+        return False
+
+    def _spool_files(self):
+        return sorted(name for name in os.listdir(self.spool_dir) if name.endswith(".batch"))
+
+    def _spool(self, url, body, headers):
+        if self.spool_dir is None:
+            print "Dropping batch for %s, no spool directory configured." % url
+            self._count("dropped")
+            return
+        with self.lock:
+            self._trim_spool(len(body))
+            # Names sort in submission order; the rename makes the file appear whole.
+            name = "%020d-%s.batch" % (int(time.time() * 1000000), uuid.uuid4().hex)
+            path = os.path.join(self.spool_dir, name)
+            with open(path + ".tmp", "wb") as spool_file:
+                spool_file.write("%s\n" % url)
+                for header, value in sorted(headers.items()):
+                    spool_file.write("%s: %s\n" % (header, value))
+                spool_file.write("\n")
+                spool_file.write(body)
+            os.rename(path + ".tmp", path)
+            self.spooled += 1
+
+    def _trim_spool(self, incoming):
+        # Drop the oldest batches to keep the spool under max_spool_bytes.
+        # Called with the lock held.
+        names = self._spool_files()
+        sizes = [os.path.getsize(os.path.join(self.spool_dir, name)) for name in names]
+        total = sum(sizes) + incoming
+        for name, size in zip(names, sizes):
+            if total <= self.max_spool_bytes:
+                break
+            os.unlink(os.path.join(self.spool_dir, name))
+            total -= size
+            self.dropped += 1
+
+    def _read_spooled(self, path):
+        with open(path, "rb") as spool_file:
+            url = spool_file.readline().rstrip("\n")
+            headers = {}
+            while True:
+                line = spool_file.readline().rstrip("\n")
+                if not line:
+                    break
+                header, value = line.split(": ", 1)
+                headers[header] = value
+            return url, spool_file.read(), headers
+
+    def _replay(self):
+        """
+        Send spooled batches, oldest first, stopping at the first failure or
+        when the capture loop has new batches waiting.
+        """
+        if self.spool_dir is None:
+            return
+        with self.lock:
+            names = self._spool_files()
+        for name in names:
+            if not self.queue.empty():
+                return
+            path = os.path.join(self.spool_dir, name)
+            # The lock isn't held while sending, so a full queue never waits
+            # on the network; a batch trimmed meanwhile is just skipped.
+            with self.lock:
+                try:
+                    url, body, headers = self._read_spooled(path)
+                except IOError as e:
+                    if e.errno != errno.ENOENT:
+                        raise
+                    continue
+            if not self._send(url, body, headers, retries=0):
+                return
+            with self.lock:
+                try:
+                    os.unlink(path)
+                except OSError as e:
+                    if e.errno != errno.ENOENT:
+                        raise
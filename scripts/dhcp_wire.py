@@ -0,0 +1,75 @@
+"""
+DHCP Wire - Columnar encoding of ack batches for upload (--format columnar).
+
+Acks in a batch repeat the same field names, options and, mostly, values. The
+columnar form sends each distinct value and option once, with every ack a row
+of indexes into them; see notouch.wire on the server for the format and the
+decoder, which this module has to agree with. This is the only encoder of the
+format. The server rejects batches of a VERSION it doesn't know.
+"""
+import json
+
+VERSION = 1
+CONTENT_TYPE = "application/vnd.notouch.columnar+json"
+
+
+def encode(acks):
+    """
+    Encode a list of ack documents (see Packet.to_dict) as a columnar batch.
+    """
+    fields = []
+    field_set = set(["options"])
+    for ack in acks:
+        for field in ack:
+            if field not in field_set:
+                field_set.add(field)
+                fields.append(field)
+
+    values = []
+    value_indexes = {}
+    options = []
+    option_indexes = {}
+    rows = []
+    for ack in acks:
+        row = []
+        for field in fields:
+            if field not in ack:
+                row.append(None)
+                continue
+            value = ack[field]
+            # Keyed on the type as well, so 1, 1.0 and True stay distinct.
+            key = (type(value), value)
+            try:
+                index = value_indexes.get(key)
+            except TypeError:
+                # Lists and objects aren't shared between rows.
+                key = index = None
+            if index is None:
+                index = len(values)
+                values.append(value)
+                if key is not None:
+                    value_indexes[key] = index
+            row.append(index)
+
+        row_options = []
+        for option in ack.get("options") or []:
+            option = (option.get("op"), option.get("name"), option.get("data"))
+            index = option_indexes.get(option)
+            if index is None:
+                index = option_indexes[option] = len(options)
+                options.append(option)
+            row_options.append(index)
+        row.append(row_options)
+        rows.append(row)
+
+    return {
+        "version": VERSION,
+        "fields": fields,
+        "values": values,
+        "options": options,
+        "rows": rows,
+    }
+
+
+def dumps(acks):
+    return json.dumps(encode(acks), separators=(",", ":"))
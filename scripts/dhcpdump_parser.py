@@ -8,6 +8,10 @@ the text output into structured data (json) and then send
 it to off to an http api endpoint so it can be logged into
 a database.
 
+With --source pcap (or --pcap_file) dhcpdump isn't used at all: packets are
+captured with a raw socket, or read from a pcap file, and decoded natively by
+dhcp_pcap.py into the same JSON form.
+
 DHCP Dump Sample Output:
 
 > dhcpdump -i eth0
@@ -47,7 +51,19 @@ OPTION:  55 ( 11) Parameter Request List      1 (Subnet mask)
 
 ---------------------------------------------------------------------------
 
-DHCP acks and DHCP server stats will be sent up to the notouch server or sent to stdout.
+DHCP acks and DHCP server stats will be sent up to the notouch server or sent to stdout
+every --send_interval seconds, whether or not packets arrive, or sooner once a batch
+reaches --max_batch_packets acks or about --max_batch_bytes of JSON.
+With --interface given several times (e.g. one per VLAN) a single agent captures
+from all of them, one dhcpdump process or raw socket each, read from one select
+loop into the same batch, so the server gets one upload stream and one stats
+document for the whole DHCP server.
+Uploads happen in the background (see dhcp_uploader.py) so a slow or unreachable
+server never holds up capture; with --spool_dir, batches that can't be delivered
+are kept on disk and replayed once the server is back.
+
+The agent parses dhcpdump output with notouch.dhcpdump, so the notouch package
+must be importable too: installed, or with the checkout on PYTHONPATH.
 
 The dhcpdump output is parsed into the following JSON form:
 
@@ -56,7 +72,6 @@ The dhcpdump output is parsed into the following JSON form:
         "mac_dst": "00:00:00:00:00:00",
         "giaddr": "10.X.X.X",
         "htype": 1,
-        "file": "",
         "opname": "dhcpack",
         "ip_src": "10.X.X.X",
         "xid": "0cd0ac2c",
@@ -167,175 +182,318 @@ Additionally server stats will be generated in the following form:
     "timestamp_end": "2015-01-01 00:00:00.000000",
     "dhcprequest_count": 17
 }
+
+The stats also carry per-phase latency histograms of the DISCOVER, OFFER,
+REQUEST and ACK handshakes seen, and counts of handshakes that failed, see
+dhcp_handshake.py.
+
+With --max_clients N, "clients" holds at most the N noisiest clients, and the
+others are summarized in "clients_other" (their counts per opname),
+"client_count" (the estimated number of distinct clients) and "client_sketch"
+(the HyperLogLog of every client, which server rollups count clients with),
+in bounded memory. See dhcp_sketch.py.
 """
+import itertools
+import os
+import select
 import subprocess
 import sys
 import json
 import socket
-import collections
 import time
 import datetime
 import argparse
-import requests
-
-def parse_entry(entry):
-    packet = {
-        "ts": "",
-        "ip_src": "",
-        "mac_src": "",
-        "ip_dst": "",
-        "mac_dst": "",
-        "op": -1,
-        "opname": "",
-        "htype": -1,
-        "hlen" : -1,
-        "hops": -1,
-        "xid": "",
-        "secs": "",
-        "flags": -1,
-        "ciaddr": "",
-        "yiaddr": "",
-        "siaddr": "",
-        "giaddr": "",
-        "chaddr": "",
-        "sname": "",
-        "file": "",
-        "options": [],
-    }
-    for line in entry:
-        if line.startswith("TIME:"):
-            packet["ts"] = line.split(":", 1)[-1].strip()
-        elif line.startswith("IP:"):
-            line = line.split(":", 1)[-1].strip()
-            src, dst = line.split(">")
-            packet["ip_src"] = src.split("(")[0].strip()
-            packet["ip_dst"] = dst.split("(")[0].strip()
-            packet["mac_src"] = src.split("(")[1].strip(' )')
-            packet["mac_dst"] = dst.split("(")[1].strip(')')
-        elif line.startswith("OP:"):
-            packet["op"] = int(line.split(":")[1].split("(")[0].strip())
-        elif line.startswith("HTYPE:"):
-            packet["htype"] = int(line.split(":")[1].split("(")[0].strip())
-        elif line.startswith("HLEN:"):
-            packet["hlen"] = int(line.split(":")[-1].strip())
-        elif line.startswith("HOPS:"):
-            packet["hops"] = int(line.split(":")[-1].strip())
-        elif line.startswith("SECS:"):
-            packet["secs"] = int(line.split(":")[-1].strip())
-        elif line.startswith("FLAGS:"):
-            packet["flags"] = line.split(":")[-1].strip()
-        elif line.startswith("XID:"):
-            packet["xid"] = line.split(":")[-1].strip()
-        elif line.startswith("CIADDR:"):
-            packet["ciaddr"] = line.split(":", 1)[-1].strip()
-        elif line.startswith("YIADDR:"):
-            packet["yiaddr"] = line.split(":", 1)[-1].strip()
-        elif line.startswith("SIADDR:"):
-            packet["siaddr"] = line.split(":", 1)[-1].strip()
-        elif line.startswith("GIADDR:"):
-            packet["giaddr"] = line.split(":", 1)[-1].strip()
-        elif line.startswith("SNAME:"):
-            packet["sname"] = line.split(":", 1)[-1].strip()
-        elif line.startswith("FNAME:"):
-            packet["fname"] = line.split(":", 1)[-1].strip()
-        elif line.startswith("CHADDR:"):
-            packet["chaddr"] = line.split(":", 1)[-1].strip()[0:17]
-        elif line.startswith("OPTION:"):
-            line = line.split(":", 1)[-1].strip()
-            op = int(line.split("(", 1)[0].strip())
-            if op in [55, 57, 93, 94, 97]:
-                continue
-            rest = line.split(")", 1)[-1].strip()
-            name = rest.split("  ")[0].strip()
-            data = rest.split("  ")[-1].strip()
-            if data.endswith(")"):
-                data = data.split("(")[-1].strip(" )").lower()
-            key = name.lower().replace(" ", "_")
-            packet["options"].append({
-                "name": key,
-                "data": data,
-                "op": op,
-            })
-            if op == 53:
-                packet["opname"] = data
-    return packet
-
-
-def reset(my_ip, my_hostname):
-    server_stats = {
-        "dhcpack_count": 0,
-        "dhcpdiscover_count": 0,
-        "dhcpoffer_count": 0,
-        "dhcprequest_count": 0,
-        "server_ip": my_ip,
-        "server_hostname": my_hostname,
-        "timestamp_start": str(datetime.datetime.utcnow()),
-        "timestamp_end": str(datetime.datetime.utcnow()),
-        "clients": {}
-    }
-    return server_stats
+import zlib
+
+import dhcp_pcap
+import dhcp_wire
+from dhcp_handshake import HandshakeTracker, LatencyStats
+from dhcp_sketch import ClientCounters
+from dhcp_uploader import Uploader
+from notouch.dhcpdump import EntrySplitter, parse_entry
+
+try:
+    import msgpack
+except ImportError:
+    msgpack = None
+
+
+# Bytes of dhcpdump output, or packets from other sources, handled per read.
+READ_SIZE = 64 * 1024
+READ_PACKETS = 1000
+
+# Destination of the DISCOVERs and REQUESTs of clients on this server's own
+# segments, which don't have an address yet.
+BROADCAST = "255.255.255.255"
+
+def in_handshake(packet, my_ips):
+    """
+    Whether a packet is part of a handshake with this server: sent to or by
+    it, or broadcast by a client without naming another server (option 54).
+    Other DHCP servers on the segment broadcast their replies too, and a
+    client's REQUEST naming one of them accepts its offer rather than ours.
+    """
+    if packet.ip_src in my_ips or packet.ip_dst in my_ips:
+        return True
+    if packet.ip_dst != BROADCAST:
+        return False
+    server_identifier = packet.option(54)
+    if server_identifier is not None:
+        return server_identifier in my_ips
+    return packet.opname in ("dhcpdiscover", "dhcprequest")
+
+
+# Rough JSON size of a packet with no options, and added per option, used to
+# bound batches by size without encoding every packet as it arrives.
+PACKET_SIZE = 380
+OPTION_SIZE = 30
+
+
+def estimate_size(packet):
+    return PACKET_SIZE + sum(OPTION_SIZE + len(name) + len(data)
+        for _, name, data in packet.options)
+
+
+class Batch(object):
+    """
+    The acks and server stats collected since the last send.
+
+    max_clients - Keep per-client counts for at most this many clients, see
+        dhcp_sketch.py. 0 counts every client.
+    """
+    def __init__(self, my_ip, my_hostname, max_clients=0):
+        self.acks = []
+        self.size = 0
+        self.latency = LatencyStats()
+        self.client_counters = None
+        if max_clients > 0:
+            self.client_counters = ClientCounters(max_clients)
+        self.server_stats = {
+            "dhcpack_count": 0,
+            "dhcpdiscover_count": 0,
+            "dhcpoffer_count": 0,
+            "dhcprequest_count": 0,
+            "server_ip": my_ip,
+            "server_hostname": my_hostname,
+            "timestamp_start": str(datetime.datetime.utcnow()),
+            "timestamp_end": str(datetime.datetime.utcnow()),
+            "clients": {}
+        }
+
+    def add(self, packet):
+        server_stats = self.server_stats
+        if packet.opname in ["dhcpack", "dhcpdiscover", "dhcpoffer", "dhcprequest"]:
+            server_stats[packet.opname + "_count"] += 1
+            if self.client_counters is not None:
+                self.client_counters.add(packet.chaddr, packet.opname)
+            else:
+                if packet.chaddr not in server_stats["clients"]:
+                    server_stats["clients"][packet.chaddr] = {
+                        "dhcpack": 0,
+                        "dhcpoffer": 0,
+                        "dhcprequest": 0,
+                        "dhcpdiscover": 0,
+                    }
+                server_stats["clients"][packet.chaddr][packet.opname] += 1
+        if packet.opname == "dhcpack":
+            self.acks.append(packet)
+            self.size += estimate_size(packet)
+
+    def full(self, max_packets, max_bytes):
+        return len(self.acks) >= max_packets or self.size >= max_bytes
+
+
+def encode(data, body_format="json", compress=True):
+    """
+    Encode data for the notouch ingest endpoints. Returns the request body and
+    headers. Batches of acks repeat the same keys and option names in every
+    packet, so gzip typically shrinks them by 10x or more. The columnar format
+    (see dhcp_wire.py) only applies to lists of acks, anything else is sent
+    as JSON.
+    """
+    if body_format == "msgpack":
+        body = msgpack.packb(data, use_bin_type=True)
+        headers = {"Content-Type": "application/x-msgpack"}
+    elif body_format == "columnar" and isinstance(data, list):
+        body = dhcp_wire.dumps(data)
+        headers = {"Content-Type": dhcp_wire.CONTENT_TYPE}
+    else:
+        body = json.dumps(data, separators=(",", ":"))
+        headers = {"Content-Type": "application/json"}
+    if compress:
+        compressor = zlib.compressobj(6, zlib.DEFLATED, 16 + zlib.MAX_WBITS)
+        body = compressor.compress(body) + compressor.flush()
+        headers["Content-Encoding"] = "gzip"
+    return body, headers
 
 
-def send(nosend, ack_endpoint, stats_endpoint,  packets, server_stats):
+def send(uploader, ack_endpoint, stats_endpoint, batch, body_format="json", compress=True):
     """
-    Send data to notouch or stdout.
+    Send a Batch to notouch, or to stdout when there is no uploader
+    (--nosend). Batches are handed to the uploader, so this never waits on
+    the server.
     """
-    acks = [packet for packet in packets if packet["opname"] == "dhcpack"]
+    acks = [packet.to_dict() for packet in batch.acks]
+    server_stats = batch.server_stats
     server_stats["timestamp_end"] = str(datetime.datetime.utcnow())
-    if nosend:
+    server_stats.update(batch.latency.summary())
+    if batch.client_counters is not None:
+        server_stats.update(batch.client_counters.summary())
+    if uploader is None:
         print json.dumps(acks, indent=4)
         print "-" * 75
         print json.dumps(server_stats, indent=4)
     else:
-        requests.post(ack_endpoint, data=json.dumps(acks))
-        requests.post(stats_endpoint, data=json.dumps(server_stats))
+        body, headers = encode(acks, body_format, compress)
+        uploader.submit(ack_endpoint, body, headers)
+        body, headers = encode(server_stats, body_format, compress)
+        uploader.submit(stats_endpoint, body, headers)
+
+
+class DhcpdumpSource(object):
+    """
+    Packets parsed from the output of a dhcpdump subprocess.
+    """
+    def __init__(self, interface):
+        self.interface = interface
+        try:
+            self.proc = subprocess.Popen(["dhcpdump", "-i", interface], stdout=subprocess.PIPE)
+        except Exception as e:
+            print "Exception running dhcpdump. %s" % e
+            sys.exit(1)
+        self.fd = self.proc.stdout.fileno()
+        self.splitter = EntrySplitter()
+        self.partial = ""
+
+    def fileno(self):
+        return self.fd
+
+    def read_ready(self):
+        """
+        Read the output waiting on the pipe and return the packets it
+        completes, or None once dhcpdump exits.
+        """
+        data = os.read(self.fd, READ_SIZE)
+        if not data:
+            return None
+        lines = (self.partial + data).split("\n")
+        self.partial = lines.pop()
+        return [parse_entry(entry) for entry in self.splitter.feed(lines)]
+
+
+class SocketSource(object):
+    """
+    Packets captured from interface with a raw socket. See dhcp_pcap.py.
+    """
+    def __init__(self, interface):
+        self.interface = interface
+        self.sock = dhcp_pcap.open_socket(interface)
+
+    def fileno(self):
+        return self.sock.fileno()
 
+    def read_ready(self):
+        return list(dhcp_pcap.packets(dhcp_pcap.receive(self.sock, max_frames=READ_PACKETS)))
 
-def main(nosend, server, send_interval):
 
-    # Line seperator for each entry is 75 '-' characters.
-    sep = "-" * 75
-    try:
-        proc = subprocess.Popen(["dhcpdump", "-i", "eth0"], stdout=subprocess.PIPE)
-    except Exception as e:
-        print "Exception running dhcpdump. %s" % e
-        sys.exit(1)
-    my_ip = socket.gethostbyname(socket.getfqdn())
+class MultiSource(object):
+    """
+    Packets from several live sources, one per interface, read as they
+    arrive on any of them from a single select loop. A source that ends
+    (e.g. its dhcpdump exits) is dropped; the MultiSource ends with the last
+    one.
+    """
+    def __init__(self, sources):
+        self.sources = list(sources)
+
+    def read(self, timeout):
+        if not self.sources:
+            return None
+        readable, _, _ = select.select(self.sources, [], [], timeout)
+        packets = []
+        for source in readable:
+            source_packets = source.read_ready()
+            if source_packets is None:
+                print "Capture on %s ended." % source.interface
+                self.sources.remove(source)
+                continue
+            packets.extend(source_packets)
+        if not self.sources:
+            return packets or None
+        return packets
+
+
+class PcapFileSource(object):
+    """
+    Packets decoded from a pcap file ("-" for stdin), read as fast as the
+    file allows.
+    """
+    def __init__(self, pcap_file):
+        stream = sys.stdin if pcap_file == "-" else open(pcap_file, "rb")
+        self.packets = dhcp_pcap.packets(dhcp_pcap.read_pcap(stream))
+
+    def read(self, timeout):
+        packets = list(itertools.islice(self.packets, READ_PACKETS))
+        return packets or None
+
+
+def main(nosend, server, send_interval, body_format="json", compress=True, source="dhcpdump",
+        interfaces=("eth0",), pcap_file=None, my_ip=None, spool_dir=None, queue_size=100,
+        timeout=10.0, max_retries=5, max_batch_packets=5000, max_batch_bytes=4 * 1024 * 1024,
+        extra_ips=(), max_clients=0, handshake_timeout=60.0, max_handshakes=10000):
+
+    if pcap_file is not None:
+        packet_source = PcapFileSource(pcap_file)
+    elif source == "dhcpdump":
+        packet_source = MultiSource(DhcpdumpSource(interface) for interface in interfaces)
+    else:
+        packet_source = MultiSource(SocketSource(interface) for interface in interfaces)
+    if my_ip is None:
+        my_ip = socket.gethostbyname(socket.getfqdn())
+    # A server on several VLANs answers on each with that interface's
+    # address, all of them count as this server.
+    my_ips = set([my_ip]) | set(extra_ips)
+    if pcap_file is None:
+        for interface in interfaces:
+            address = dhcp_pcap.interface_address(interface)
+            if address is not None:
+                my_ips.add(address)
     my_hostname = socket.gethostname()
-    start = time.time()
-    server_stats = reset(my_ip, my_hostname)
-    lines = []
-    packets = []
+    batch = Batch(my_ip, my_hostname, max_clients)
+    # Outlives batches, handshakes span send intervals.
+    tracker = HandshakeTracker(handshake_timeout, max_handshakes)
     ack_endpoint = "%s/api/v1/dhcp/ack" % (server,)
     stats_endpoint = "%s/api/v1/dhcp/server_stats" % (server,)
+    uploader = None
+    if not nosend:
+        uploader = Uploader(spool_dir, queue_size, timeout, max_retries)
+        uploader.start()
 
-    # Main 'event loop' operating on dhcpdump output.
+    # Main event loop. Sends happen every send_interval seconds even when no
+    # packets arrive, and early whenever the batch reaches its size limits.
+    deadline = time.time() + send_interval
     while True:
-        line = proc.stdout.readline().strip()
-        if line == sep:
-            packet = parse_entry(lines)
-            lines = []
+        packets = packet_source.read(max(0, deadline - time.time()))
+        if packets is None:
+            break
+        for packet in packets:
+            if in_handshake(packet, my_ips):
+                tracker.add(packet, batch.latency)
             # Don't record packets where this server is not the client or the server.
-            if packet["ip_src"] == my_ip or packet["ip_dst"] == my_ip:
-                packets.append(packet)
-                if packet["opname"] in ["dhcpack", "dhcpdiscover", "dhcpoffer", "dhcprequest"]:
-                    server_stats[packet["opname"] + "_count"] += 1
-                    if packet["chaddr"] not in server_stats["clients"].keys():
-                        server_stats["clients"][packet["chaddr"]] = {
-                            "dhcpack": 0,
-                            "dhcpoffer": 0,
-                            "dhcprequest": 0,
-                            "dhcpdiscover": 0,
-                        }
-                    server_stats["clients"][packet["chaddr"]][packet["opname"]] += 1
-            offset = time.time() - start
-            if offset >= send_interval:
-                start = time.time()
-                send(nosend, ack_endpoint, stats_endpoint, packets, server_stats)
-                server_stats = reset(my_ip, my_hostname)
-                packets = []
-        elif line != '':
-            lines.append(line)
+            if packet.ip_src in my_ips or packet.ip_dst in my_ips:
+                batch.add(packet)
+                if batch.full(max_batch_packets, max_batch_bytes):
+                    send(uploader, ack_endpoint, stats_endpoint, batch, body_format, compress)
+                    batch = Batch(my_ip, my_hostname, max_clients)
+        if time.time() >= deadline:
+            deadline = time.time() + send_interval
+            send(uploader, ack_endpoint, stats_endpoint, batch, body_format, compress)
+            batch = Batch(my_ip, my_hostname, max_clients)
+
+    # The source ran out (e.g. the end of a pcap file), send what is left.
+    send(uploader, ack_endpoint, stats_endpoint, batch, body_format, compress)
+    if uploader is not None:
+        uploader.stop()
 
 
 if __name__ == "__main__":
@@ -345,5 +503,54 @@ if __name__ == "__main__":
         help="Send statistics to the server on this interval.", default=10)
     parser.add_argument("--nosend", action="store_true", dest="nosend", default=False,
         help="Don't send data to the notouch server, output to stdout.")
+    parser.add_argument("--format", dest="body_format", choices=["json", "msgpack", "columnar"],
+        default="json", help="Encoding for batches sent to the server (msgpack requires the "
+        "msgpack package, columnar a server that supports it).")
+    parser.add_argument("--nocompress", action="store_false", dest="compress", default=True,
+        help="Don't gzip batches sent to the server.")
+    parser.add_argument("--source", dest="source", choices=["dhcpdump", "pcap"],
+        default="dhcpdump", help="Parse dhcpdump output, or decode packets natively from a "
+        "raw socket or --pcap_file.")
+    parser.add_argument("--interface", dest="interfaces", type=str, action="append",
+        help="Interface to capture DHCP packets on, may be repeated to capture from several "
+        "into one batch and one server stats document. Defaults to eth0.")
+    parser.add_argument("--pcap_file", dest="pcap_file", type=str,
+        help="Decode packets from this pcap file ('-' for stdin) instead of capturing live. "
+        "Implies --source pcap.")
+    parser.add_argument("--server_ip", dest="server_ip", type=str,
+        help="IP of the DHCP server whose packets to record, defaults to this host's IP. "
+        "Packets to or from the address of any capture interface are recorded as well.")
+    parser.add_argument("--extra_server_ip", dest="extra_server_ips", type=str,
+        action="append", default=[], help="Another address of this DHCP server whose "
+        "packets to record, may be repeated.")
+    parser.add_argument("--spool_dir", dest="spool_dir", type=str,
+        help="Spool batches the server couldn't take here and replay them when it recovers. "
+        "Without it such batches are dropped.")
+    parser.add_argument("--queue_size", dest="queue_size", type=int, default=100,
+        help="Batches held in memory waiting to be sent before spooling to disk.")
+    parser.add_argument("--timeout", dest="timeout", type=float, default=10.0,
+        help="Timeout in seconds for each request to the server.")
+    parser.add_argument("--max_retries", dest="max_retries", type=int, default=5,
+        help="Retries, with exponential backoff, before a batch is spooled.")
+    parser.add_argument("--max_batch_packets", dest="max_batch_packets", type=int, default=5000,
+        help="Send early once a batch holds this many acks.")
+    parser.add_argument("--max_batch_bytes", dest="max_batch_bytes", type=int,
+        default=4 * 1024 * 1024, help="Send early once a batch's acks reach roughly this many "
+        "bytes of JSON.")
+    parser.add_argument("--max_clients", dest="max_clients", type=int, default=0,
+        help="Keep exact per-client stats for at most this many of the noisiest clients "
+        "per interval, summarizing the rest in fixed-size sketches. 0 counts every client.")
+    parser.add_argument("--handshake_timeout", dest="handshake_timeout", type=float,
+        default=60.0, help="Seconds after which a DHCP handshake in flight counts as failed.")
+    parser.add_argument("--max_handshakes", dest="max_handshakes", type=int, default=10000,
+        help="DHCP handshakes timed at once, see dhcp_handshake.py.")
     args = parser.parse_args()
-    main(args.nosend, args.server, args.send_interval)
+    if args.body_format == "msgpack" and msgpack is None:
+        parser.error("--format msgpack requires the msgpack package.")
+    if args.pcap_file:
+        args.source = "pcap"
+    main(args.nosend, args.server, args.send_interval, args.body_format, args.compress,
+        args.source, args.interfaces or ["eth0"], args.pcap_file, args.server_ip,
+        args.spool_dir, args.queue_size, args.timeout, args.max_retries, args.max_batch_packets,
+        args.max_batch_bytes, args.extra_server_ips, args.max_clients,
+        args.handshake_timeout, args.max_handshakes)
@@ -43,6 +43,9 @@ kwargs = {
     "entry_points": """
        [console_scripts]
        notouch-server=notouch.server:main
+       notouch-archive=notouch.archive:main
+       notouch-migrate=notouch.migrate:main
+       notouch-import=notouch.importer:main
     """,
 }
 
@@ -0,0 +1,78 @@
+from . import util  # Puts scripts/ on sys.path.
+import dhcp_handshake
+import dhcpdump_parser
+from notouch.packet import Packet
+
+
+def packet(opname, seconds, xid="0cd0ac2c", chaddr="00:11:22:33:44:55"):
+    p = Packet()
+    p.opname = opname
+    p.ts = "2015-01-01 00:%02d:%09.6f" % (seconds // 60, seconds % 60)
+    p.xid = xid
+    p.chaddr = chaddr
+    p.giaddr = "10.1.0.1"
+    return p
+
+
+def test_handshake_latencies():
+    tracker = dhcp_handshake.HandshakeTracker(timeout=30)
+    stats = dhcp_handshake.LatencyStats()
+    for opname, seconds in [("dhcpdiscover", 0), ("dhcpdiscover", 0.5), ("dhcpoffer", 0.504),
+            ("dhcprequest", 1.5), ("dhcpack", 1.53)]:
+        tracker.add(packet(opname, seconds), stats)
+    # A renewal, timed from its REQUEST.
+    tracker.add(packet("dhcprequest", 2, xid="1"), stats)
+    tracker.add(packet("dhcpack", 2.003, xid="1"), stats)
+    assert tracker.handshakes == {}
+
+    summary = stats.summary()
+    latency = summary["latency"]
+    # DISCOVER to OFFER is timed from the first DISCOVER, 504ms.
+    assert latency["offer"][9] == 1
+    assert latency["request"][9] == 1
+    assert latency["ack"][5] == 1 and latency["ack"][2] == 1
+    assert latency["handshake"][10] == 1
+    assert sum(latency["handshake"]) == 1
+    assert sum(summary["relay_latency"]["10.1.0.1"]) == 3
+    assert summary["handshakes_failed"] == {"no_offer": 0, "no_request": 0, "no_ack": 0,
+        "nak": 0}
+
+
+def test_handshake_failures():
+    tracker = dhcp_handshake.HandshakeTracker(timeout=30, max_handshakes=2)
+    stats = dhcp_handshake.LatencyStats()
+    tracker.add(packet("dhcpdiscover", 0, xid="1"), stats)
+    tracker.add(packet("dhcpoffer", 0.1, xid="1"), stats)
+    tracker.add(packet("dhcpdiscover", 1, xid="2"), stats)
+    tracker.add(packet("dhcpoffer", 1.1, xid="2"), stats)
+    tracker.add(packet("dhcprequest", 1.2, xid="2"), stats)
+    tracker.add(packet("dhcpnak", 1.3, xid="2"), stats)
+    # Fills the table along with xid 1, then evicts it.
+    tracker.add(packet("dhcpdiscover", 2, xid="3"), stats)
+    tracker.add(packet("dhcpdiscover", 3, xid="4"), stats)
+    assert stats.failures == {"no_offer": 0, "no_request": 1, "no_ack": 0, "nak": 1}
+    # xid 3 and 4 were never offered anything.
+    tracker.add(packet("dhcpdiscover", 40, xid="5"), stats)
+    assert stats.failures["no_offer"] == 2
+    assert list(tracker.handshakes) == [("5", "00:11:22:33:44:55")]
+
+
+def test_in_handshake():
+    my_ips = set(["10.0.0.1"])
+
+    def broadcast(opname, ip_src, server_identifier=None):
+        p = packet(opname, 0)
+        p.ip_src, p.ip_dst = ip_src, dhcpdump_parser.BROADCAST
+        if server_identifier is not None:
+            p.options.append((54, "server_identifier", server_identifier))
+        return p
+
+    assert dhcpdump_parser.in_handshake(broadcast("dhcpdiscover", "0.0.0.0"), my_ips)
+    assert dhcpdump_parser.in_handshake(broadcast("dhcpoffer", "10.0.0.1", "10.0.0.1"), my_ips)
+    assert dhcpdump_parser.in_handshake(broadcast("dhcprequest", "0.0.0.0", "10.0.0.1"), my_ips)
+    # Another server on the segment, and a client accepting its offer.
+    assert not dhcpdump_parser.in_handshake(broadcast("dhcpoffer", "10.0.0.2", "10.0.0.2"),
+        my_ips)
+    assert not dhcpdump_parser.in_handshake(broadcast("dhcpack", "10.0.0.2"), my_ips)
+    assert not dhcpdump_parser.in_handshake(broadcast("dhcprequest", "0.0.0.0", "10.0.0.2"),
+        my_ips)
@@ -0,0 +1,88 @@
+import socket
+import struct
+import StringIO
+import time
+
+import pytest
+
+from . import util  # Puts scripts/ on sys.path.
+import dhcp_pcap
+
+
+def make_ack_frame():
+    options = (
+        "\x63\x82\x53\x63"
+        "\x35\x01\x05"                      # DHCP message type: ack
+        "\x36\x04" + socket.inet_aton("10.0.0.1") +
+        "\x33\x04" + struct.pack("!I", 604800) +
+        "\x3a\x04" + struct.pack("!I", 302400) +
+        "\x0c\x05host1"
+        "\x37\x02\x01\x03"                  # Parameter request list, skipped
+        "\x06\x08" + socket.inet_aton("10.0.0.2") + socket.inet_aton("10.0.0.3") +
+        "\xff"
+    )
+    chaddr = "\x00\x11\x22\x33\x44\x55"
+    bootp = struct.pack("!BBBBIHH4s4s4s4s16s64s128s", 2, 1, 6, 1, 0x0cd0ac2c, 0, 0x8000,
+        socket.inet_aton("0.0.0.0"), socket.inet_aton("10.1.0.5"),
+        socket.inet_aton("10.0.0.1"), socket.inet_aton("10.1.0.1"), chaddr, "",
+        "/pxelinux.0") + options
+    udp = struct.pack("!HHHH", 67, 67, 8 + len(bootp), 0) + bootp
+    ip = struct.pack("!BBHHHBBH4s4s", 0x45, 0, 20 + len(udp), 0, 0, 64, 17, 0,
+        socket.inet_aton("10.0.0.1"), socket.inet_aton("10.1.0.1")) + udp
+    vlan = "\x81\x00\x00\x0a"
+    return "\xaa" * 6 + "\xbb" * 6 + vlan + "\x08\x00" + ip
+
+
+def make_pcap(frames):
+    pcap = struct.pack("<IHHiIII", 0xa1b2c3d4, 2, 4, 0, 0, 65535, 1)
+    for ts, frame in frames:
+        pcap += struct.pack("<IIII", ts, 250000, len(frame), len(frame)) + frame
+    return pcap
+
+
+def test_decode_pcap():
+    arp = "\xff" * 6 + "\xbb" * 6 + "\x08\x06" + "\x00" * 28
+    pcap = make_pcap([(1420070400, arp), (1420070400, make_ack_frame())])
+    packets = list(dhcp_pcap.packets(dhcp_pcap.read_pcap(StringIO.StringIO(pcap))))
+    assert len(packets) == 1
+    packet = packets[0].to_dict()
+
+    assert packet["ts"] == "2015-01-01 00:00:00.250000"
+    assert packet["ip_src"] == "10.0.0.1"
+    assert packet["ip_dst"] == "10.1.0.1"
+    assert packet["mac_src"] == "bb:bb:bb:bb:bb:bb"
+    assert packet["mac_dst"] == "aa:aa:aa:aa:aa:aa"
+    assert packet["opname"] == "dhcpack"
+    assert packet["xid"] == "0cd0ac2c"
+    assert packet["flags"] == "8000"
+    assert packet["yiaddr"] == "10.1.0.5"
+    assert packet["giaddr"] == "10.1.0.1"
+    assert packet["chaddr"] == "00:11:22:33:44:55"
+    assert packet["sname"] == "."
+    assert packet["fname"] == "/pxelinux.0"
+    assert [(option["op"], option["name"], option["data"]) for option in packet["options"]] == [
+        (53, "dhcp_message_type", "dhcpack"),
+        (54, "server_identifier", "10.0.0.1"),
+        (51, "ip_address_leasetime", "7d"),
+        (58, "t1", "3d12h"),
+        (12, "host_name", "host1"),
+        (6, "dns_server", "10.0.0.2,10.0.0.3"),
+    ]
+
+
+def test_socket_filter():
+    try:
+        sock = dhcp_pcap.open_socket("lo")
+    except (socket.error, AttributeError) as e:
+        pytest.skip("Can't open a raw socket: %s" % e)
+    try:
+        sender = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        for port in (67, 9999, 68):
+            sender.sendto("x", ("127.0.0.1", port))
+        sender.close()
+        time.sleep(0.1)
+        frames = dhcp_pcap.receive(sock)
+    finally:
+        sock.close()
+    ports = [struct.unpack("!H", frame[36:38])[0] for _, _, frame in frames]
+    assert ports == [67, 68]
@@ -0,0 +1,46 @@
+from . import util  # Puts scripts/ on sys.path.
+import dhcp_sketch
+import dhcpdump_parser
+from notouch.packet import Packet
+
+
+def mac(i):
+    return "00:00:00:%02x:%02x:%02x" % (i >> 16, (i >> 8) & 0xff, i & 0xff)
+
+
+def test_count_min_sketch():
+    sketch = dhcp_sketch.CountMinSketch()
+    for i in range(0, 20000):
+        sketch.add(mac(i % 5000))
+    assert 4 <= sketch.estimate(mac(0)) <= 10
+
+
+def test_client_counters_keep_noisiest():
+    counters = dhcp_sketch.ClientCounters(max_clients=10)
+    # A storm of distinct clients, with a few noisy ones joining late.
+    for i in range(0, 5000):
+        counters.add(mac(i), "dhcpdiscover")
+        if i >= 1000:
+            counters.add(mac(100000 + i % 3), "dhcpdiscover")
+    summary = counters.summary()
+    assert len(summary["clients"]) == 10
+    for i in range(0, 3):
+        assert summary["clients"][mac(100000 + i)]["dhcpdiscover"] > 1000
+    total = sum(counts["dhcpdiscover"] for counts in summary["clients"].values())
+    assert total + summary["clients_other"]["dhcpdiscover"] == 9000
+    assert abs(summary["client_count"] - 5003) < 250
+
+
+def test_bounded_batch():
+    batch = dhcpdump_parser.Batch("10.0.0.1", "dhcp1", max_clients=2)
+    for i in range(0, 5):
+        packet = Packet()
+        packet.chaddr = mac(i)
+        packet.opname = "dhcpack"
+        batch.add(packet)
+    assert len(batch.acks) == 5
+    assert batch.server_stats["dhcpack_count"] == 5
+    summary = batch.client_counters.summary()
+    assert len(summary["clients"]) == 2
+    assert summary["clients_other"]["dhcpack"] == 3
+    assert summary["client_count"] == 5
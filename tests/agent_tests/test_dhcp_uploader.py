@@ -0,0 +1,113 @@
+import BaseHTTPServer
+import os
+import SocketServer
+import threading
+
+from . import util  # Puts scripts/ on sys.path.
+from dhcp_uploader import Uploader
+
+
+class Handler(BaseHTTPServer.BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+
+    def do_POST(self):
+        body = self.rfile.read(int(self.headers["Content-Length"]))
+        status = 200 if self.server.up else 503
+        if self.server.up:
+            self.server.received.append((self.path, body, self.headers["Content-Type"]))
+        self.send_response(status)
+        self.send_header("Content-Length", "0")
+        self.end_headers()
+
+    def log_message(self, *args):
+        pass
+
+
+class Server(SocketServer.ThreadingMixIn, BaseHTTPServer.HTTPServer):
+    daemon_threads = True
+
+
+HEADERS = {"Content-Type": "application/json"}
+
+
+def make_server():
+    server = Server(("127.0.0.1", 0), Handler)
+    server.up = False
+    server.received = []
+    thread = threading.Thread(target=server.serve_forever)
+    thread.daemon = True
+    thread.start()
+    return server, "http://127.0.0.1:%d" % server.server_port
+
+
+def test_spool_and_replay(tmpdir):
+    server, url = make_server()
+    spool_dir = str(tmpdir.join("spool"))
+    headers = {"Content-Type": "application/json"}
+
+    uploader = Uploader(spool_dir, max_retries=1, initial_backoff=0.01)
+    uploader.start()
+    uploader.submit(url + "/ack", "[1]", headers)
+    uploader.submit(url + "/ack", "[2]", headers)
+    uploader.stop()
+    assert server.received == []
+    assert len(os.listdir(spool_dir)) == 2
+    assert uploader.stats()["spooled"] == 2
+
+    server.up = True
+    uploader = Uploader(spool_dir, max_retries=1, initial_backoff=0.01)
+    uploader.start()
+    uploader.submit(url + "/stats", "[3]", headers)
+    uploader.stop()
+    # The live batch goes first, then the spool is replayed oldest first.
+    assert server.received == [
+        ("/stats", "[3]", "application/json"),
+        ("/ack", "[1]", "application/json"),
+        ("/ack", "[2]", "application/json"),
+    ]
+    assert os.listdir(spool_dir) == []
+    server.shutdown()
+
+
+def test_full_queue_spools(tmpdir):
+    spool_dir = str(tmpdir.join("spool"))
+    # Not started, so nothing drains the queue.
+    uploader = Uploader(spool_dir, queue_size=1)
+    uploader.submit("http://127.0.0.1:1/ack", "[1]", {})
+    uploader.submit("http://127.0.0.1:1/ack", "[2]", {})
+    assert uploader.stats()["queued"] == 1
+    assert len(os.listdir(spool_dir)) == 1
+
+
+def test_replay_skips_missing_batches(tmpdir):
+    server, url = make_server()
+    server.up = True
+    spool_dir = str(tmpdir.join("spool"))
+    uploader = Uploader(spool_dir)
+    uploader._spool(url + "/ack", "[1]", HEADERS)
+    uploader._spool(url + "/ack", "[2]", HEADERS)
+    # A listing made before the capture thread trimmed the oldest batch.
+    names = uploader._spool_files()
+    os.unlink(os.path.join(spool_dir, names[0]))
+    uploader._spool_files = lambda: names
+    uploader._replay()
+    assert [body for _, body, _ in server.received] == ["[2]"]
+    server.shutdown()
+
+
+def test_worker_survives_errors(tmpdir):
+    server, url = make_server()
+    server.up = True
+    uploader = Uploader(str(tmpdir.join("spool")))
+    replay = uploader._replay
+    def fail_once():
+        uploader._replay = replay
+        raise OSError("spool unavailable")
+    uploader._replay = fail_once
+    uploader.start()
+    uploader.submit(url + "/ack", "[1]", HEADERS)
+    uploader.submit(url + "/ack", "[2]", HEADERS)
+    uploader.stop()
+    assert [body for _, body, _ in server.received] == ["[1]", "[2]"]
+    assert uploader.stats()["sent"] == 2
+    server.shutdown()
@@ -0,0 +1,33 @@
+import json
+
+from . import util  # Puts scripts/ on sys.path.
+from api_tests.test_dhcp import TEST_DHCP_ACK_JSON
+import dhcp_wire
+import dhcpdump_parser
+from notouch import codec
+from notouch import wire
+
+
+def test_encode():
+    acks = []
+    for i in range(0, 3):
+        ack = json.loads(TEST_DHCP_ACK_JSON)
+        ack["ts"] = "2015-01-01 00:00:0%d.000000" % i
+        acks.append(ack)
+    del acks[2]["file"]
+    acks[2]["options"] = acks[2]["options"][:2]
+    batch = dhcp_wire.encode(acks)
+    assert batch["version"] == wire.VERSION
+    assert len(batch["rows"]) == 3
+    assert len(batch["options"]) == len(acks[0]["options"])
+    assert wire.decode(json.loads(json.dumps(batch))) == acks
+    # Values that can't be shared between rows.
+    acks[0]["extra"] = {"a": [1]}
+    assert wire.decode(json.loads(dhcp_wire.dumps(acks))) == acks
+    del acks[0]["extra"]
+
+    # The agent's encoding, as posted.
+    body, headers = dhcpdump_parser.encode(acks, "columnar")
+    assert headers["Content-Type"] == wire.COLUMNAR_CONTENT_TYPE
+    assert codec.decode_documents(body, headers["Content-Type"],
+        headers["Content-Encoding"]) == acks
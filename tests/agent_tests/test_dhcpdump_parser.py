@@ -0,0 +1,59 @@
+import os
+import StringIO
+
+from . import util  # Puts scripts/ on sys.path.
+from .test_dhcp_pcap import make_ack_frame, make_pcap
+from api_tests.test_dhcpdump import ENTRY
+import dhcp_pcap
+import dhcpdump_parser
+
+
+class PipeSource(dhcpdump_parser.DhcpdumpSource):
+    """
+    A DhcpdumpSource reading dhcpdump output written to a pipe.
+    """
+    def __init__(self, interface):
+        self.interface = interface
+        self.fd, self.writer = os.pipe()
+        self.splitter = dhcpdump_parser.EntrySplitter()
+        self.partial = ""
+
+
+def test_multi_source():
+    eth0, eth1 = PipeSource("eth0"), PipeSource("eth1")
+    source = dhcpdump_parser.MultiSource([eth0, eth1])
+    assert source.read(0) == []
+
+    os.write(eth0.writer, "".join(ENTRY))
+    os.write(eth1.writer, "".join(ENTRY[:10]))
+    packets = source.read(1)
+    assert [packet.xid for packet in packets] == ["0cd0ac2c"]
+
+    os.write(eth1.writer, "".join(ENTRY[10:]))
+    os.close(eth0.writer)
+    packets = source.read(1)
+    assert [packet.xid for packet in packets] == ["0cd0ac2c"]
+    assert source.sources == [eth1]
+
+    os.close(eth1.writer)
+    assert source.read(1) is None
+
+
+def test_batch_limits(tmpdir, monkeypatch):
+    capture = make_pcap([(1420070400, make_ack_frame())] * 5)
+    pcap = tmpdir.join("capture.pcap")
+    pcap.write(capture, "wb")
+    ack = next(dhcp_pcap.packets(dhcp_pcap.read_pcap(StringIO.StringIO(capture))))
+
+    batches = []
+    monkeypatch.setattr(dhcpdump_parser, "send",
+        lambda uploader, ack_endpoint, stats_endpoint, batch, *args: batches.append(batch))
+    dhcpdump_parser.main(True, None, 60, source="pcap", pcap_file=str(pcap), my_ip="10.0.0.1",
+        max_batch_packets=2)
+    assert [len(batch.acks) for batch in batches] == [2, 2, 1]
+    assert [batch.server_stats["dhcpack_count"] for batch in batches] == [2, 2, 1]
+
+    batches[:] = []
+    dhcpdump_parser.main(True, None, 60, source="pcap", pcap_file=str(pcap), my_ip="10.0.0.1",
+        max_batch_bytes=dhcpdump_parser.estimate_size(ack) * 3)
+    assert [len(batch.acks) for batch in batches] == [3, 2]
@@ -1,4 +1,5 @@
 import pytest
+import rethinkdb
 import tornado.httpserver
 import tornado.netutil
 
@@ -8,22 +9,19 @@ import random
 import logging
 
 from notouch.app import Application
-from notouch.util import create_database
-from notouch.util import clean_database
 
 class Server(object):
     """ Wrapper around Tornado server with test helpers. """
 
-    def __init__(self):
+    def __init__(self, storage, sqlite_path):
         tornado_settings = {
             "debug": False
         }
-        self.app = Application(tornado_settings)
-
         # Create a temproary database.
-        self.app.rethinkdb_db = "notouch_testing"
-        self.rethinkdb_conn = create_database(self.app.rethinkdb_host, self.app.rethinkdb_port,
-            self.app.rethinkdb_db)
+        self.app = Application(tornado_settings, storage=storage,
+            rethinkdb_db="notouch_testing", sqlite_path=sqlite_path,
+            sqlite_poll_interval=0.05)
+        self.app.storage.create()
 
         self.server = tornado.httpserver.HTTPServer(self.app)
         self.server.add_sockets(tornado.netutil.bind_sockets(
@@ -43,17 +41,20 @@ class Server(object):
         return self.server._sockets.values()[0].getsockname()[1]
 
 
-@pytest.fixture()
-def tornado_server(request):
+@pytest.fixture(params=["sqlite", "rethinkdb"])
+def tornado_server(request, tmpdir):
 
-    server = Server()
+    try:
+        server = Server(request.param, str(tmpdir.join("notouch.db")))
+    except rethinkdb.ReqlDriverError as e:
+        pytest.skip("rethinkdb is not available: %s" % e)
 
     def fin():
         tornado.ioloop.IOLoop.instance().stop()
         server.io_thread.join()
 
-        clean_database(server.rethinkdb_conn, server.app.rethinkdb_db, testing=True)
+        server.app.storage.clean()
 
     request.addfinalizer(fin)
 
-    return server
\ No newline at end of file
+    return server
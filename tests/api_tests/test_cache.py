@@ -0,0 +1,73 @@
+import json
+import time
+
+from notouch.handlers.cache import QueryCache
+from .fixtures import tornado_server
+from .test_dhcp import TEST_DHCP_ACK_JSON
+from .util import Client
+
+
+def test_query_cache_lru_and_invalidation():
+    cache = QueryCache(None, max_entries=3, ttl=60)
+    cache.put("all", "[1]", "dhcpack")
+    cache.put("chaddr 1", "[2]", "dhcpack", "chaddr", "1")
+    cache.put("chaddr 2", "[3]", "dhcpack", "chaddr", "2")
+    assert cache.get("all")[0] == "[1]"
+
+    # "chaddr 1" is now the least recently used.
+    cache.put("stats", "[4]", "dhcpserverstats")
+    assert cache.get("chaddr 1") is None
+    assert cache.evictions == 1
+
+    cache.invalidate("dhcpack", [{"chaddr": "3"}])
+    assert cache.get("all") is None
+    assert cache.get("chaddr 2")[0] == "[3]"
+    cache.invalidate("dhcpack", [{"chaddr": "2"}])
+    assert cache.get("chaddr 2") is None
+    assert cache.get("stats")[0] == "[4]"
+    assert cache.invalidations == 2
+
+    cache.ttl = 0
+    cache.put("expired", "[5]", "dhcpack")
+    time.sleep(0.01)
+    assert cache.get("expired") is None
+    assert cache.expirations == 1
+    assert cache.hits == 3
+    assert cache.misses == 4
+
+
+def test_query_cache_skips_pages_read_across_a_write():
+    cache = QueryCache(None, max_entries=3, ttl=60)
+    generation = cache.generation("dhcpack")
+    # A write lands while the page is being read, before it is put.
+    cache.invalidate("dhcpack", [{"chaddr": "1"}])
+    cache.put("all", "[1]", "dhcpack", generation=generation)
+    assert cache.get("all") is None
+
+    generation = cache.generation("dhcpack")
+    cache.invalidate("dhcpserverstats", [{"server_ip": "10.0.0.1"}])
+    cache.put("all", "[1]", "dhcpack", generation=generation)
+    assert cache.get("all")[0] == "[1]"
+
+
+def test_query_cache_etag(tornado_server):
+    c = Client(tornado_server)
+    assert c.post("/dhcp/ack", data=json.dumps([json.loads(TEST_DHCP_ACK_JSON)])).ok
+    # Caching starts once this worker's changefeed on the table is open.
+    for _ in range(0, 50):
+        resp = c.get("/dhcp/ack")
+        if c.get("/status/cache").json()["entries"]:
+            break
+        time.sleep(0.1)
+
+    resp = c.get("/dhcp/ack")
+    assert resp.ok
+    etag = resp.headers["Etag"]
+    resp = c.get("/dhcp/ack", headers={"If-None-Match": etag})
+    assert resp.status_code == 304
+    assert c.get("/status/cache").json()["hits"] >= 2
+
+    assert c.post("/dhcp/ack", data=json.dumps([json.loads(TEST_DHCP_ACK_JSON)])).ok
+    resp = c.get("/dhcp/ack", headers={"If-None-Match": etag})
+    assert resp.status_code == 200
+    assert len(resp.json()["results"]) == 2
@@ -1,5 +1,9 @@
+import csv
 import json
+import zlib
 
+from notouch import rollup
+from notouch.sketch import HyperLogLog
 from .fixtures import tornado_server
 from .util import Client
 
@@ -97,4 +101,329 @@ def test_dhcp_ack_insert(tornado_server):
     for i in range(0, 100):
         data.append(json.loads(TEST_DHCP_ACK_JSON))
     resp = c.request("post", "/dhcp/ack", data=json.dumps(data))
-    assert resp.ok
\ No newline at end of file
+    assert resp.ok
+
+def test_dhcp_ack_query(tornado_server):
+    c = Client(tornado_server)
+    data = []
+    for i in range(0, 10):
+        ack = json.loads(TEST_DHCP_ACK_JSON)
+        ack["chaddr"] = "0a:00:00:00:00:0%d" % (i % 2)
+        ack["ts"] = "2015-01-01 00:00:0%d.000000" % i
+        data.append(ack)
+    resp = c.post("/dhcp/ack", data=json.dumps(data))
+    assert resp.ok
+
+    acks = []
+    cursor = None
+    while True:
+        params = {"chaddr": "0a:00:00:00:00:01", "limit": 2}
+        if cursor:
+            params["cursor"] = cursor
+        resp = c.get("/dhcp/ack", params=params)
+        assert resp.ok
+        page = resp.json()
+        acks.extend(page["results"])
+        cursor = page["cursor"]
+        if cursor is None:
+            break
+    assert [ack["ts"][-8:] for ack in acks] == ["1.000000", "3.000000", "5.000000",
+        "7.000000", "9.000000"]
+    # MAC addresses are stored lowercased, and matched whatever their case.
+    resp = c.get("/dhcp/ack", params={"chaddr": "0A:00:00:00:00:01"})
+    assert resp.ok
+    assert [ack["ts"] for ack in resp.json()["results"]] == [ack["ts"] for ack in acks]
+
+    resp = c.get("/dhcp/ack", params={
+        "from": "2015-01-01 00:00:02", "to": "2015-01-01 00:00:05", "order": "desc"})
+    assert resp.ok
+    assert [ack["ts"][-8:] for ack in resp.json()["results"]] == ["4.000000", "3.000000",
+        "2.000000"]
+
+    # ISO 8601 and epoch second bounds mean the same times.
+    for bounds in (("2015-01-01T00:00:02Z", "2015-01-01T00:00:04.5Z"),
+            ("1420070402", "1420070404.5")):
+        resp = c.get("/dhcp/ack", params={"from": bounds[0], "to": bounds[1]})
+        assert resp.ok
+        assert [ack["ts"][-8:] for ack in resp.json()["results"]] == ["2.000000",
+            "3.000000", "4.000000"]
+    resp = c.get("/dhcp/ack", params={"from": "yesterday"})
+    assert resp.status_code == 400
+
+    resp = c.get("/dhcp/ack", params={"chaddr": "0a:00:00:00:00:01", "xid": "0cd0ac2c"})
+    assert resp.status_code == 400
+
+
+def test_dhcp_ack_stream(tornado_server):
+    c = Client(tornado_server)
+    data = []
+    for i in range(0, 50):
+        ack = json.loads(TEST_DHCP_ACK_JSON)
+        ack["ts"] = "2015-01-01 00:00:%02d.000000" % i
+        data.append(ack)
+    resp = c.post("/dhcp/ack", data=json.dumps(data))
+    assert resp.ok
+
+    resp = c.get("/dhcp/ack", params={"stream": "ndjson"})
+    assert resp.ok
+    assert resp.headers["Content-Type"] == "application/x-ndjson"
+    acks = [json.loads(line) for line in resp.text.splitlines()]
+    assert [ack["ts"] for ack in acks] == [ack["ts"] for ack in data]
+
+    resp = c.get("/dhcp/ack", params={"stream": "json", "limit": 10})
+    assert resp.ok
+    assert len(resp.json()) == 10
+
+
+def test_dhcp_ack_export(tornado_server):
+    c = Client(tornado_server)
+    data = []
+    for i in range(0, 20):
+        ack = json.loads(TEST_DHCP_ACK_JSON)
+        ack["ts"] = "2015-01-01 00:00:%02d.000000" % i
+        data.append(ack)
+    assert c.post("/dhcp/ack", data=json.dumps(data)).ok
+
+    resp = c.get("/dhcp/ack/export", params={
+        "from": "2015-01-01 00:00:05", "to": "2015-01-01 00:00:15"})
+    assert resp.ok
+    assert resp.headers["Content-Type"] == "application/x-ndjson"
+    acks = [json.loads(line) for line in resp.text.splitlines()]
+    assert [ack["ts"] for ack in acks] == [ack["ts"] for ack in data[5:15]]
+
+    # Resume after the fourth ack, as a client would after a disconnect.
+    after_ts = acks[3]["ts"].replace(" ", "T") + "Z"
+    resp = c.get("/dhcp/ack/export", params={"format": "csv.gz",
+        "to": "2015-01-01 00:00:15", "after_ts": after_ts, "after_id": acks[3]["id"]})
+    assert resp.ok
+    assert resp.headers["Content-Type"] == "application/gzip"
+    rows = list(csv.DictReader(zlib.decompress(resp.content, 16 + zlib.MAX_WBITS)
+        .splitlines()))
+    assert [row["id"] for row in rows] == [ack["id"] for ack in acks[4:]]
+    assert rows[0]["chaddr"] == data[9]["chaddr"]
+    assert rows[0]["lease_time"] == str(7 * 86400)
+    assert json.loads(rows[0]["options"]) == acks[4]["options"]
+
+    assert c.get("/dhcp/ack/export", params={"format": "xml"}).status_code == 400
+    assert c.get("/dhcp/ack/export", params={"after_ts": acks[3]["ts"]}).status_code == 400
+    assert c.get("/dhcp/ack/export", params={"after_ts": "soon",
+        "after_id": acks[3]["id"]}).status_code == 400
+
+
+def test_dhcp_ack_insert_gzip(tornado_server):
+    c = Client(tornado_server)
+    data = [json.loads(TEST_DHCP_ACK_JSON) for i in range(0, 10)]
+    compressor = zlib.compressobj(6, zlib.DEFLATED, 16 + zlib.MAX_WBITS)
+    body = compressor.compress(json.dumps(data)) + compressor.flush()
+    resp = c.post("/dhcp/ack", data=body, headers={"Content-Encoding": "gzip"})
+    assert resp.ok
+    assert len(c.get("/dhcp/ack").json()["results"]) == 10
+
+    resp = c.post("/dhcp/ack", data=body[:20], headers={"Content-Encoding": "gzip"})
+    assert resp.status_code == 400
+
+
+def test_dhcp_server_stats_rollup(tornado_server):
+    c = Client(tornado_server)
+    for i in range(0, 6):
+        stats = {
+            "server_ip": "10.0.0.1",
+            "server_hostname": "dhcp1",
+            "timestamp_start": "2015-01-01 00:0%d:30.000000" % (i // 2),
+            "timestamp_end": "2015-01-01 00:0%d:40.000000" % (i // 2),
+            "dhcpack_count": 1,
+            "dhcpdiscover_count": 2,
+            "dhcpoffer_count": 0,
+            "dhcprequest_count": 1,
+            "clients": {"00:00:00:00:00:0%d" % i: {}, "00:00:00:00:00:ff": {}},
+        }
+        resp = c.post("/dhcp/server_stats", data=json.dumps([stats]))
+        assert resp.ok
+
+    resp = c.get("/dhcp/server_stats/rollup", params={"resolution": "minute"})
+    assert resp.ok
+    rollups = resp.json()["results"]
+    assert [rollup["bucket"] for rollup in rollups] == [
+        "2015-01-01 00:00:00.000000", "2015-01-01 00:01:00.000000", "2015-01-01 00:02:00.000000"]
+    assert [rollup["dhcpack_count"] for rollup in rollups] == [2, 2, 2]
+    assert [rollup["client_count"] for rollup in rollups] == [3, 3, 3]
+    assert "clients" not in rollups[0]
+    assert "client_sketch" not in rollups[0]
+
+    resp = c.get("/dhcp/server_stats/rollup", params={"resolution": "minute", "clients": "1"})
+    assert resp.ok
+    assert resp.json()["results"][0]["clients"] == ["00:00:00:00:00:00", "00:00:00:00:00:01",
+        "00:00:00:00:00:ff"]
+
+    resp = c.get("/dhcp/server_stats/rollup", params={
+        "resolution": "hour", "server_ip": "10.0.0.1", "clients": "1"})
+    assert resp.ok
+    [rollup] = resp.json()["results"]
+    assert rollup["snapshots"] == 6
+    assert rollup["dhcpdiscover_count"] == 12
+    assert rollup["client_count"] == 7
+    # Only minute buckets keep the list of clients.
+    assert "clients" not in rollup
+
+    resp = c.get("/dhcp/server_stats/rollup", params={"resolution": "minute",
+        "from": "2015-01-01T00:01:00Z", "to": "2015-01-01 00:02:00"})
+    assert [rollup["bucket"] for rollup in resp.json()["results"]] == [
+        "2015-01-01 00:01:00.000000"]
+
+    resp = c.get("/dhcp/server_stats/rollup", params={"resolution": "week"})
+    assert resp.status_code == 400
+
+
+def test_rollup_sketch_size():
+    def snapshot(first, count):
+        return {
+            "server_ip": "10.0.0.1",
+            "timestamp_start": "2015-01-01 00:00:00.000000",
+            "clients": dict(("00:00:00:00:%02x:%02x" % (i >> 8, i & 0xff), {})
+                for i in range(first, first + count)),
+        }
+
+    [legacy] = [doc for doc in rollup.rollups([snapshot(0, 10)]) if doc["resolution"] == "day"]
+    # Stored before rollups kept a sketch.
+    legacy["clients"] = sorted(snapshot(0, 10)["clients"])
+    del legacy["client_sketch"]
+
+    doc = legacy
+    for first in range(5, 20000, 2000):
+        [new] = [new for new in rollup.rollups([snapshot(first, 2000)])
+            if new["resolution"] == "day"]
+        doc = rollup.merge_docs(doc, new)
+    assert "clients" not in doc
+    assert abs(doc["client_count"] - 20005) < 1000
+    assert len(doc["client_sketch"]) < 4096
+
+
+def test_dhcp_server_stats_rollup_bounded(tornado_server):
+    c = Client(tornado_server)
+    # Two snapshots of a storm from an agent run with --max_clients 10,
+    # overlapping by 1000 clients.
+    for first in (0, 2000):
+        sketch = HyperLogLog()
+        for i in range(first, first + 3000):
+            sketch.add("00:00:00:00:%02x:%02x" % (i >> 8, i & 0xff))
+        stats = {
+            "server_ip": "10.0.0.1",
+            "timestamp_start": "2015-01-01 00:00:%02d.000000" % (first // 100),
+            "dhcpdiscover_count": 3000,
+            "clients": {},
+            "clients_other": {"dhcpdiscover": 3000},
+            "client_count": sketch.count(),
+            "client_sketch": sketch.encode(),
+        }
+        resp = c.post("/dhcp/server_stats", data=json.dumps([stats]))
+        assert resp.ok
+
+    [rollup] = c.get("/dhcp/server_stats/rollup", params={"resolution": "hour"}).json()[
+        "results"]
+    assert rollup["dhcpdiscover_count"] == 6000
+    assert abs(rollup["client_count"] - 5000) < 250
+
+    stats["client_sketch"] = "garbage"
+    resp = c.post("/dhcp/server_stats", data=json.dumps([stats]))
+    assert resp.status_code == 400
+    assert "client_sketch must be an encoded HyperLogLog" in resp.json()["error"]
+
+
+def test_dhcp_server_stats_latency(tornado_server):
+    c = Client(tornado_server)
+    histogram = [0] * 15
+    histogram[6] = 2
+    for i in range(0, 3):
+        stats = {
+            "server_ip": "10.0.0.1",
+            "timestamp_start": "2015-01-01 00:0%d:00.000000" % i,
+            "latency": {"offer": histogram, "ack": histogram},
+            "relay_latency": {"10.1.0.1": histogram},
+            "handshakes_failed": {"no_request": 1},
+        }
+        if i == 0:
+            # From an agent that doesn't time handshakes.
+            del stats["latency"]
+        resp = c.post("/dhcp/server_stats", data=json.dumps([stats]))
+        assert resp.ok
+
+    results = c.get("/dhcp/server_stats").json()["results"]
+    assert "latency" not in results[0]
+    assert results[1]["latency"]["request"] == [0] * 15
+    assert results[1]["handshakes_failed"] == {"no_offer": 0, "no_request": 1, "no_ack": 0,
+        "nak": 0}
+
+    [rollup] = c.get("/dhcp/server_stats/rollup", params={"resolution": "hour"}).json()[
+        "results"]
+    assert rollup["latency"]["offer"][6] == 4
+    assert rollup["latency"]["handshake"] == [0] * 15
+    assert rollup["relay_latency"]["10.1.0.1"][6] == 4
+    assert rollup["handshakes_failed"]["no_request"] == 2
+
+    stats["latency"]["offer"] = [1, 2]
+    resp = c.post("/dhcp/server_stats", data=json.dumps([stats]))
+    assert resp.status_code == 400
+    assert "latency.offer must be a list of 15" in resp.json()["error"]
+
+
+def test_hosts(tornado_server):
+    c = Client(tornado_server)
+    data = []
+    for i in range(0, 6):
+        ack = json.loads(TEST_DHCP_ACK_JSON)
+        ack["chaddr"] = "00:00:00:00:00:0%d" % (i % 2)
+        ack["yiaddr"] = "10.0.0.%d" % i
+        ack["ts"] = "2015-01-01 00:00:0%d.000000" % i
+        data.append(ack)
+    # Post the newest acks first, the latest lease still wins.
+    resp = c.post("/dhcp/ack", data=json.dumps(data[3:]))
+    assert resp.ok
+    resp = c.post("/dhcp/ack", data=json.dumps(data[:3]))
+    assert resp.ok
+
+    resp = c.get("/hosts/00:00:00:00:00:01")
+    assert resp.ok
+    host = resp.json()
+    assert host["yiaddr"] == "10.0.0.5"
+    assert host["hostname"] == "<hostname>"
+    assert host["domainname"] == "<domainname>"
+    assert host["fname"] == "/<filename>"
+    assert host["first_seen"] == "2015-01-01 00:00:01.000000"
+    assert host["last_seen"] == "2015-01-01 00:00:05.000000"
+
+    assert c.get("/hosts/00:00:00:00:00:02").status_code == 404
+
+    resp = c.get("/hosts", params={"order": "desc"})
+    assert resp.ok
+    assert [host["chaddr"] for host in resp.json()["results"]] == ["00:00:00:00:00:01",
+        "00:00:00:00:00:00"]
+
+    resp = c.get("/hosts", params={"yiaddr": "10.0.0.4"})
+    assert resp.ok
+    assert [host["chaddr"] for host in resp.json()["results"]] == ["00:00:00:00:00:00"]
+
+
+def test_dhcp_ack_subnet_query(tornado_server):
+    c = Client(tornado_server)
+    data = []
+    for i in range(0, 8):
+        ack = json.loads(TEST_DHCP_ACK_JSON)
+        ack["yiaddr"] = "10.%d.0.%d" % (i % 2, i)
+        ack["ts"] = "2015-01-01 00:00:0%d.000000" % i
+        data.append(ack)
+    resp = c.post("/dhcp/ack", data=json.dumps(data))
+    assert resp.ok
+
+    resp = c.get("/dhcp/ack", params={"subnet": "10.1.0.0/16", "from": "2015-01-01 00:00:02",
+        "to": "2015-01-01 00:00:07", "order": "desc"})
+    assert resp.ok
+    assert [ack["yiaddr"] for ack in resp.json()["results"]] == ["10.1.0.5", "10.1.0.3"]
+
+    resp = c.get("/dhcp/ack", params={"subnet": "10.0.0.0/8", "limit": 5})
+    assert len(resp.json()["results"]) == 5
+    resp = c.get("/dhcp/ack", params={"subnet": "10.0.0.4/32"})
+    assert [ack["lease_time"] for ack in resp.json()["results"]] == [7 * 86400]
+
+    assert c.get("/dhcp/ack", params={"subnet": "10.0.0.0/12"}).status_code == 400
+    assert c.get("/dhcp/ack", params={"subnet": "10.0.0.0/8",
+        "chaddr": "00:00:00:00:00:00"}).status_code == 400
@@ -0,0 +1,67 @@
+from notouch import dhcpdump
+
+
+ENTRY = """
+---------------------------------------------------------------------------
+
+  TIME: 2015-01-01 00:00:00.056000
+    IP: 10.0.0.1 (aa:bb:cc:dd:ee:ff) > 10.1.0.1 (11:22:33:44:55:66)
+    OP: 2 (BOOTPREPLY)
+ HTYPE: 1 (Ethernet)
+  HLEN: 6
+  HOPS: 1
+   XID: 0cd0ac2c
+  SECS: 0
+ FLAGS: 8000
+CIADDR: 0.0.0.0
+YIADDR: 10.1.0.5
+SIADDR: 10.0.0.1
+GIADDR: 10.1.0.1
+CHADDR: 00:11:22:33:44:55:00:00:00:00:00:00:00:00:00:00
+ SNAME: .
+ FNAME: /pxelinux.0
+OPTION:  53 (  1) DHCP message type         5 (DHCPACK)
+OPTION:  54 (  4) Server identifier         10.0.0.1
+OPTION:  51 (  4) IP address leasetime      604800 (1w)
+OPTION:  55 (  2) Parameter Request List      1 (Subnet mask)
+                          3 (Routers)
+OPTION:  12 (  5) Host name                 host1
+
+---------------------------------------------------------------------------
+""".splitlines(True)
+
+
+def test_parse_entry():
+    entries = list(dhcpdump.split_entries(ENTRY))
+    assert len(entries) == 1
+    packet = dhcpdump.parse_entry(entries[0])
+
+    assert packet.ts == "2015-01-01 00:00:00.056000"
+    assert packet.ip_src == "10.0.0.1"
+    assert packet.mac_src == "aa:bb:cc:dd:ee:ff"
+    assert packet.ip_dst == "10.1.0.1"
+    assert packet.mac_dst == "11:22:33:44:55:66"
+    assert packet.op == 2
+    assert packet.opname == "dhcpack"
+    assert packet.hlen == 6
+    assert packet.hops == 1
+    assert packet.xid == "0cd0ac2c"
+    assert packet.secs == 0
+    assert packet.yiaddr == "10.1.0.5"
+    assert packet.giaddr == "10.1.0.1"
+    assert packet.chaddr == "00:11:22:33:44:55"
+    assert packet.fname == "/pxelinux.0"
+    assert packet.option(54) == "10.0.0.1"
+    assert packet.option(55) is None
+
+    doc = packet.to_dict()
+    assert doc["fname"] == "/pxelinux.0"
+    assert doc["options"][-1] == {"op": 12, "name": "host_name", "data": "host1"}
+
+
+def test_entry_splitter_partial_feeds():
+    splitter = dhcpdump.EntrySplitter()
+    assert splitter.feed(ENTRY[:10]) == []
+    entries = splitter.feed(ENTRY[10:])
+    assert len(entries) == 1
+    assert entries[0][0] == "TIME: 2015-01-01 00:00:00.056000"
@@ -0,0 +1,77 @@
+import gzip
+import json
+
+import pytest
+import tornado.ioloop
+
+from notouch import importer
+from notouch.storage import SQLiteStorage
+from .test_dhcp import TEST_DHCP_ACK_JSON
+from .test_dhcpdump import ENTRY
+
+
+def dhcpdump_output(count):
+    """
+    count copies of a dhcpdump ack entry, one second apart.
+    """
+    lines = []
+    for i in range(0, count):
+        lines.extend(line.replace("00:00:00.056000", "00:00:%02d.056000" % i)
+            for line in ENTRY[1:])
+    return lines
+
+
+def test_read_and_parse_chunks(tmpdir):
+    path = str(tmpdir.join("dhcpdump.log.gz"))
+    with gzip.open(path, "wb") as log_file:
+        log_file.writelines(dhcpdump_output(5))
+    assert importer.file_format(path) == "dhcpdump"
+
+    chunks = list(importer.read_chunks(path, "dhcpdump", 30))
+    assert len(chunks) == 3
+    results = [importer.parse_chunk("dhcpdump", chunk) for chunk in chunks]
+    acks = [ack for chunk_acks, _ in results for ack in chunk_acks]
+    assert [ack["ts"] for ack in acks] == ["2015-01-01 00:00:%02d.056000" % i
+        for i in range(0, 5)]
+    assert acks[0]["chaddr"] == "00:11:22:33:44:55"
+    assert acks[0]["yiaddr_int"] == (10 << 24) + (1 << 16) + 5
+    # Parsing the same entry twice gives it the same id.
+    assert acks[0]["id"] == importer.parse_chunk("dhcpdump", chunks[0])[0][0]["id"]
+
+    # A corrupt entry is counted and skipped, the rest of the chunk still parses.
+    lines = dhcpdump_output(2)
+    lines[lines.index("  SECS: 0\n")] = "  SECS: garbage\n"
+    acks, invalid = importer.parse_chunk("dhcpdump", lines)
+    assert (len(acks), invalid) == (1, 1)
+
+    ack = json.loads(TEST_DHCP_ACK_JSON)
+    lines = [json.dumps(ack) + "\n", json.dumps([ack, ack]) + "\n", "{\n", "\n",
+        json.dumps({"ts": "2015-01-01"}) + "\n"]
+    acks, invalid = importer.parse_chunk("ndjson", lines)
+    assert (len(acks), invalid) == (3, 2)
+
+
+@pytest.mark.skipif("importer.futures is None")
+def test_import(tmpdir):
+    dhcpdump_path = str(tmpdir.join("dhcpdump.log"))
+    with open(dhcpdump_path, "wb") as log_file:
+        log_file.writelines(dhcpdump_output(50))
+    ndjson_path = str(tmpdir.join("acks.ndjson"))
+    with open(ndjson_path, "wb") as ndjson_file:
+        ndjson_file.write(json.dumps(json.loads(TEST_DHCP_ACK_JSON)) + "\n")
+
+    storage = SQLiteStorage(str(tmpdir.join("notouch.db")))
+    storage.create()
+    io_loop = tornado.ioloop.IOLoop()
+    for _ in range(0, 2):
+        run = importer.Importer(storage, workers=2, chunk_lines=100, batch_size=7,
+            concurrency=2)
+        io_loop.run_sync(lambda: run.run([dhcpdump_path, ndjson_path]))
+        assert (run.files, run.parsed, run.written, run.invalid) == (2, 51, 51, 0)
+
+    # The second import replaced the acks of the first.
+    acks = io_loop.run_sync(lambda: storage.range("dhcpack", "ts"))
+    assert len(acks) == 51
+    host = io_loop.run_sync(lambda: storage.get("hosts", "00:11:22:33:44:55"))
+    assert host["last_seen"] == "2015-01-01 00:00:49.056000"
+    io_loop.close()
@@ -0,0 +1,123 @@
+import json
+
+import pytest
+import tornado.ioloop
+
+from notouch import ingest
+from notouch import migrate
+from notouch import wire
+from .fixtures import tornado_server
+from .test_retention import run_on_loop
+from .test_dhcp import TEST_DHCP_ACK_JSON
+from .util import Client
+
+
+def test_normalize_ack():
+    ack = json.loads(TEST_DHCP_ACK_JSON)
+    ack["chaddr"] = "0A:1B:2C:3D:4E:5F"
+    ack["ts"] = "2015-01-01T00:00:01Z"
+    ack["options"].append({"op": 81, "name": "fqdn", "data": ""})
+    [ack] = ingest.normalize("dhcpack", [ack])
+    assert ack["chaddr"] == "0a:1b:2c:3d:4e:5f"
+    assert ack["ts"] == "2015-01-01 00:00:01.000000"
+    assert 81 not in [option["op"] for option in ack["options"]]
+    assert ack["siaddr_int"] is None
+    assert (ack["lease_time"], ack["renewal_time"], ack["rebinding_time"]) == (
+        7 * 86400, 3 * 86400 + 12 * 3600, 6 * 86400 + 3 * 3600)
+
+    stats = {"server_ip": "10.0.0.1", "timestamp_start": 1420070400,
+        "clients": {"0A:00:00:00:00:01": {}}}
+    [stats] = ingest.normalize("dhcpserverstats", [stats])
+    assert stats["timestamp_start"] == "2015-01-01 00:00:00.000000"
+    assert stats["clients"] == {"0a:00:00:00:00:01": {}}
+
+    with pytest.raises(ingest.ValidationError) as e:
+        ingest.normalize("dhcpack", [json.loads(TEST_DHCP_ACK_JSON),
+            {"chaddr": "00:00:00:00:00:01", "ts": "yesterday"}, {"ts": "2015-01-01"}])
+    assert "document 1: ts is not a timestamp" in str(e.value)
+    assert "document 2: chaddr is required" in str(e.value)
+
+
+def test_columnar_batch(tornado_server):
+    # Encoded by the agent's scripts/dhcp_wire.py, see agent_tests.test_dhcp_wire.
+    batch = {
+        "version": 1,
+        "fields": ["ts", "chaddr", "yiaddr"],
+        "values": ["2015-01-01 00:00:00.000000", "00:11:22:33:44:55", "10.1.0.5",
+            "2015-01-01 00:00:01.000000"],
+        "options": [[53, "dhcp_message_type", "dhcpack"],
+            [54, "server_identifier", "10.0.0.1"]],
+        "rows": [[0, 1, 2, [0, 1]], [3, 1, None, [0]]],
+    }
+    acks = wire.decode(batch)
+    assert acks[1] == {"ts": "2015-01-01 00:00:01.000000", "chaddr": "00:11:22:33:44:55",
+        "options": [{"op": 53, "name": "dhcp_message_type", "data": "dhcpack"}]}
+    c = Client(tornado_server)
+    resp = c.post("/dhcp/ack", data=json.dumps(batch),
+        headers={"Content-Type": wire.COLUMNAR_CONTENT_TYPE})
+    assert resp.ok
+    assert [ack["ts"] for ack in c.get("/dhcp/ack").json()["results"]] == [
+        ack["ts"] for ack in acks]
+
+    batch["version"] = 2
+    with pytest.raises(wire.WireError):
+        wire.decode(batch)
+    batch["version"] = 1
+    for index in (len(batch["values"]), -1):
+        batch["rows"][0][0] = index
+        with pytest.raises(wire.WireError):
+            wire.decode(batch)
+    batch["rows"][0][0] = 0
+    batch["rows"][0][-1] = [-1]
+    with pytest.raises(wire.WireError):
+        wire.decode(batch)
+    resp = c.post("/dhcp/ack", data=json.dumps(batch),
+        headers={"Content-Type": wire.COLUMNAR_CONTENT_TYPE})
+    assert resp.status_code == 400
+
+
+def test_invalid_batch_rejected(tornado_server):
+    c = Client(tornado_server)
+    ack = json.loads(TEST_DHCP_ACK_JSON)
+    del ack["ts"]
+    resp = c.post("/dhcp/ack", data=json.dumps([json.loads(TEST_DHCP_ACK_JSON), ack]))
+    assert resp.status_code == 400
+    assert "document 1: ts is required" in resp.json()["error"]
+    assert c.get("/dhcp/ack").json()["results"] == []
+
+
+def test_migrate(tornado_server):
+    c = Client(tornado_server)
+    storage = tornado_server.app.storage
+    acks = []
+    for i in range(0, 5):
+        ack = json.loads(TEST_DHCP_ACK_JSON)
+        ack["yiaddr"] = "10.2.0.%d" % i
+        ack["ts"] = "2015-01-01 00:00:0%d.000000" % i
+        acks.append(ack)
+    # Stored as they were before acks had typed fields.
+    run_on_loop(storage.insert, "dhcpack", acks)
+    subnet = [24, (10 << 24) + (2 << 16)]
+    assert run_on_loop(lambda: storage.range("dhcpack", "yiaddr_subnet_ts", prefix=subnet)) == []
+
+    migration = migrate.MIGRATIONS["dhcpack"]
+    assert run_on_loop(migrate.migrate, storage, "dhcpack", migration, 2, 0) == (5, 5)
+    assert run_on_loop(migrate.migrate, storage, "dhcpack", migration, 2, 0) == (5, 0)
+    results = c.get("/dhcp/ack", params={"subnet": "10.2.0.0/24"}).json()["results"]
+    assert [ack["yiaddr_int"] for ack in results] == [(10 << 24) + (2 << 16) + i
+        for i in range(0, 5)]
+
+
+@pytest.mark.skipif("ingest.futures is None")
+def test_ingest_pool_offloads_large_bodies():
+    pool = ingest.IngestPool(workers=1, inline_bytes=100)
+    small = json.dumps({"chaddr": "0A:00:00:00:00:01", "ts": "2015-01-01 00:00:00"})
+    large = json.dumps([json.loads(TEST_DHCP_ACK_JSON)] * 10)
+    io_loop = tornado.ioloop.IOLoop()
+    docs = io_loop.run_sync(lambda: pool.prepare("dhcpack", small))
+    assert docs[0]["chaddr"] == "0a:00:00:00:00:01"
+    docs = io_loop.run_sync(lambda: pool.prepare("dhcpack", large))
+    assert len(docs) == 10
+    assert (pool.inline, pool.offloaded) == (1, 1)
+    pool.executor.shutdown()
+    io_loop.close()
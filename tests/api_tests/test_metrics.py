@@ -0,0 +1,49 @@
+import json
+import os
+
+import requests
+
+from notouch.metrics import Metrics
+from .fixtures import tornado_server
+from .test_dhcp import TEST_DHCP_ACK_JSON
+from .util import Client
+
+
+def test_metrics_render(tmpdir):
+    metrics = Metrics(str(tmpdir), dump_interval=3600)
+    metrics.inc("notouch_ingest_documents_total", {"table": "dhcpack"}, 10)
+    metrics.observe("notouch_ingest_body_bytes", {"table": "dhcpack"}, 1000)
+    metrics.observe("notouch_ingest_body_bytes", {"table": "dhcpack"}, 10 ** 9)
+
+    # A snapshot from another live worker (our parent stands in for it) is merged
+    # in, one from a worker that no longer exists is not.
+    other = Metrics()
+    other.inc("notouch_ingest_documents_total", {"table": "dhcpack"}, 5)
+    for pid in (os.getppid(), 2 ** 22 + 1):
+        with open(str(tmpdir.join("%d.json" % pid)), "w") as snapshot_file:
+            json.dump(other.snapshot(), snapshot_file)
+
+    lines = metrics.render().splitlines()
+    assert "# TYPE notouch_ingest_body_bytes histogram" in lines
+    assert 'notouch_ingest_documents_total{table="dhcpack"} 15' in lines
+    assert 'notouch_ingest_body_bytes_bucket{table="dhcpack",le="1024"} 1' in lines
+    assert 'notouch_ingest_body_bytes_bucket{table="dhcpack",le="+Inf"} 2' in lines
+    assert 'notouch_ingest_body_bytes_count{table="dhcpack"} 2' in lines
+
+
+def test_metrics_endpoint(tornado_server):
+    c = Client(tornado_server)
+    assert c.post("/dhcp/ack", data=json.dumps([json.loads(TEST_DHCP_ACK_JSON)] * 3)).ok
+    assert c.get("/dhcp/ack").ok
+
+    resp = requests.get("http://localhost:%d/metrics" % tornado_server.port)
+    assert resp.ok
+    lines = resp.text.splitlines()
+    assert 'notouch_ingest_documents_total{table="dhcpack"} 3' in lines
+    assert ('notouch_http_requests_total{code="200",method="POST",'
+        'route="/api/v1/dhcp/ack"} 1') in lines
+    # Labelled with the storage operation, the same on every backend.
+    for operation in ("insert", "range"):
+        assert any(line.startswith(
+            'notouch_db_query_duration_seconds_count{query="%s"}' % operation)
+            for line in lines)
@@ -0,0 +1,74 @@
+import json
+import threading
+
+import tornado.ioloop
+
+from notouch import archive
+from notouch.retention import Retention
+from .fixtures import tornado_server
+from .test_dhcp import TEST_DHCP_ACK_JSON
+from .util import Client
+
+
+def run_on_loop(func, *args):
+    """
+    Run a coroutine on the test server's IOLoop thread and return its result.
+    """
+    done = threading.Event()
+    result = {}
+
+    def finished(future):
+        try:
+            result["value"] = future.result()
+        except Exception as e:
+            result["error"] = e
+        done.set()
+
+    def start():
+        tornado.ioloop.IOLoop.current().add_future(func(*args), finished)
+
+    tornado.ioloop.IOLoop.instance().add_callback(start)
+    assert done.wait(30)
+    if "error" in result:
+        raise result["error"]
+    return result["value"]
+
+
+def test_archive_read(tmpdir):
+    archive_dir = str(tmpdir)
+    rows = [{"id": str(i), "ts": "2015-01-0%d 12:00:00.000000" % (i % 3 + 1),
+        "chaddr": str(i % 2)} for i in range(0, 9)]
+    archive.write(archive_dir, "dhcpack", "ts", rows[:5])
+    archive.write(archive_dir, "dhcpack", "ts", rows[5:])
+    assert archive.partitions(archive_dir, "dhcpack") == ["2015-01-01", "2015-01-02",
+        "2015-01-03"]
+
+    read = list(archive.read(archive_dir, "dhcpack", "ts"))
+    assert sorted(row["id"] for row in read) == [str(i) for i in range(0, 9)]
+
+    read = list(archive.read(archive_dir, "dhcpack", "ts", start="2015-01-02",
+        end="2015-01-03", filters={"chaddr": "1"}))
+    assert [row["id"] for row in read] == ["1", "7"]
+
+
+def test_retention(tornado_server, tmpdir):
+    c = Client(tornado_server)
+    data = []
+    for i in range(0, 10):
+        ack = json.loads(TEST_DHCP_ACK_JSON)
+        ack["ts"] = "2015-01-01 00:00:0%d.000000" % i
+        if i >= 7:
+            ack["ts"] = "2999-01-01 00:00:00.000000"
+        data.append(ack)
+    resp = c.post("/dhcp/ack", data=json.dumps(data))
+    assert resp.ok
+
+    retention = Retention(tornado_server.app, str(tmpdir), batch_size=3, max_rate=0,
+        retention={"dhcpack": {"days": 30, "index": "ts", "time_field": "ts"}})
+    count = run_on_loop(retention.expire, "dhcpack", retention.retention["dhcpack"])
+    assert count == 7
+
+    remaining = c.get("/dhcp/ack").json()["results"]
+    assert [ack["ts"][:4] for ack in remaining] == ["2999"] * 3
+    archived = list(archive.read(str(tmpdir), "dhcpack", "ts"))
+    assert sorted(ack["ts"] for ack in archived) == sorted(ack["ts"] for ack in data[:7])
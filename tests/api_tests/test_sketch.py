@@ -0,0 +1,24 @@
+import pytest
+
+from notouch.sketch import HyperLogLog
+
+
+def mac(i):
+    return "00:00:00:%02x:%02x:%02x" % (i >> 16, (i >> 8) & 0xff, i & 0xff)
+
+
+def test_hyperloglog():
+    distinct = HyperLogLog()
+    for i in range(0, 20000):
+        distinct.add(mac(i % 5000))
+    assert abs(distinct.count() - 5000) < 250
+
+    other = HyperLogLog()
+    for i in range(2500, 7500):
+        other.add(mac(i))
+    distinct = HyperLogLog.decode(distinct.encode())
+    distinct.update(other)
+    assert abs(distinct.count() - 7500) < 375
+    for data in ("garbage", distinct.encode()[:-8], 42):
+        with pytest.raises(ValueError):
+            HyperLogLog.decode(data)
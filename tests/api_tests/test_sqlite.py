@@ -0,0 +1,34 @@
+import json
+import sqlite3
+import time
+
+import tornado.gen
+import tornado.ioloop
+
+from notouch.storage import SQLiteStorage
+from .test_dhcp import TEST_DHCP_ACK_JSON
+
+
+def test_write_waits_off_the_ioloop(tmpdir):
+    path = str(tmpdir.join("notouch.db"))
+    storage = SQLiteStorage(path)
+    storage.create()
+    # Another worker's transaction holds the write lock.
+    other = sqlite3.connect(path, isolation_level=None)
+    other.execute("BEGIN IMMEDIATE")
+
+    @tornado.gen.coroutine
+    def write_while_locked():
+        write = storage.insert("dhcpack", [json.loads(TEST_DHCP_ACK_JSON)])
+        start = time.time()
+        yield tornado.gen.sleep(0.1)
+        # The IOLoop kept running while the write waited for the lock.
+        assert time.time() - start < 1
+        assert not write.done()
+        other.execute("ROLLBACK")
+        yield write
+        docs = yield storage.range("dhcpack", "ts")
+        raise tornado.gen.Return(docs)
+
+    docs = tornado.ioloop.IOLoop().run_sync(write_while_locked)
+    assert len(docs) == 1
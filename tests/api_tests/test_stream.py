@@ -0,0 +1,51 @@
+import json
+
+from notouch import feed
+from .fixtures import tornado_server
+from .test_dhcp import TEST_DHCP_ACK_JSON
+from .util import Client
+
+
+def test_subscriber_filters_and_drops():
+    subscriber = feed.Subscriber({"giaddr": "10.1.0.1"},
+        {"yiaddr": feed.parse_subnet("10.1.0.0/16")}, max_buffer=2)
+    assert subscriber.matches({"giaddr": "10.1.0.1", "yiaddr": "10.1.200.3"})
+    assert not subscriber.matches({"giaddr": "10.1.0.1", "yiaddr": "10.2.0.3"})
+    assert not subscriber.matches({"giaddr": "10.1.0.2", "yiaddr": "10.1.0.3"})
+    assert not subscriber.matches({"giaddr": "10.1.0.1"})
+
+    for i in range(0, 5):
+        subscriber.put({"i": i})
+    assert subscriber.ready.is_set()
+    assert subscriber.take() == ([{"i": 3}, {"i": 4}], 3)
+    assert not subscriber.ready.is_set()
+    assert subscriber.take() == ([], 0)
+
+
+def test_dhcp_ack_stream_events(tornado_server):
+    c = Client(tornado_server)
+    resp = c.get("/dhcp/ack/stream", params={"chaddr": "00:00:00:00:00:01"}, stream=True,
+        timeout=10)
+    assert resp.ok
+    assert resp.headers["Content-Type"] == "text/event-stream"
+    lines = resp.iter_lines()
+    assert next(lines) == ": connected"
+
+    data = []
+    for i in range(0, 4):
+        ack = json.loads(TEST_DHCP_ACK_JSON)
+        ack["chaddr"] = "00:00:00:00:00:0%d" % (i % 2)
+        ack["ts"] = "2015-01-01 00:00:0%d.000000" % i
+        data.append(ack)
+    assert c.post("/dhcp/ack", data=json.dumps(data)).ok
+
+    events = []
+    for line in lines:
+        if line.startswith("data: "):
+            events.append(json.loads(line[len("data: "):]))
+        if len(events) == 2:
+            break
+    resp.close()
+    assert sorted(ack["ts"] for ack in events) == [data[1]["ts"], data[3]["ts"]]
+
+    assert c.get("/dhcp/ack/stream", params={"subnet": "10.0.0.0/33"}).status_code == 400
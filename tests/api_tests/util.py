@@ -13,7 +13,8 @@ class Client(object):
         headers = {}
         
         if method.lower() in ("put", "post"):
-            headers["Content-type"] = "application/json"
+            headers["Content-Type"] = "application/json"
+        headers.update(kwargs.pop("headers", {}))
 
         return requests.request(
             method, self.base_url + url,